@@ -3,7 +3,9 @@ from django.utils.html import format_html
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources, fields
 from import_export.widgets import ForeignKeyWidget
-from .models import Department, Staff, Visit, SystemSetting
+from .models import Department, Staff, Visit, SystemSetting, NotificationOutbox
+from .directory import invalidate_staff_directory
+from .notifications import retry_dead_notifications
 from django.db.models import F
 from django.db.models.functions import Coalesce
 
@@ -28,6 +30,9 @@ class DepartmentAdmin(admin.ModelAdmin):
     # 表示順
     ordering = ('order', 'id')
 
+    # 階層情報は保存時に自動計算される
+    readonly_fields = ('full_name',)
+
     # 一覧画面で連携状態をアイコン表示するカスタムメソッド
     def teams_api_status(self, obj):
         if obj.teams_api_url:
@@ -55,6 +60,12 @@ class StaffResource(resources.ModelResource):
             'photo_url'
         )
 
+    def after_import(self, dataset, result, **kwargs):
+        super().after_import(dataset, result, **kwargs)
+        # 一括インポートで社員が入れ替わるため名簿キャッシュを破棄
+        if not kwargs.get("dry_run"):
+            invalidate_staff_directory()
+
 # -------------------
 # Visit Inline
 # -------------------
@@ -173,6 +184,26 @@ class SystemSettingAdmin(admin.ModelAdmin):
         }),
     )
 
+# -------------------
+# NotificationOutbox Admin
+# -------------------
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "visit", "webhook_url", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("webhook_url", "last_error")
+    ordering = ("-created_at",)
+    readonly_fields = (
+        "visit", "webhook_url", "payload", "status", "attempts",
+        "next_attempt_at", "last_error", "sent_at", "created_at", "updated_at",
+    )
+    actions = ["retry_dead"]
+
+    def retry_dead(self, request, queryset):
+        count = retry_dead_notifications(queryset)
+        self.message_user(request, f"{count}件を再送待ちに戻しました")
+    retry_dead.short_description = "送信失敗した通知を再送する"
+
 # # -------------------
 # # NotificationLog Admin
 # # -------------------
@@ -0,0 +1,356 @@
+"""
+Redis を使わない Channels のチャネルレイヤー（同一ホスト内の複数ワーカー向け）
+
+メッセージとグループを共有の SQLite ファイル（WAL モード）に置き、同じホストの
+ワーカープロセス間で group_send を配信する。小規模な拠点で Redis を立てずに
+WebSocket 通知（NotificationConsumer / ReceptionConsumer）を使うためのもの。
+
+- send / group_send はメッセージ行を書き込むだけ（書き込みはトランザクションで直列化される）
+- 各プロセスは自分の接続（specific チャネル）宛ての行を poll_interval ごとにまとめて取り出し、
+  プロセス内のキューへ振り分ける
+- ポーリング・グループの参照・掃除の要否は読み込みトランザクションで確認し、行を書き換えるときだけ
+  書き込みロック（BEGIN IMMEDIATE）を取る。WAL では読み込みは書き込みを待たせないため、
+  メッセージが無い間のポーリングが他のワーカーの送信を止めない
+- メッセージは expiry 秒、グループ登録は group_expiry 秒で期限切れ。期限切れのメッセージが
+  残っていたチャネル（落ちたプロセスの接続）はグループからも外す
+
+設定例:
+    CHANNEL_LAYERS = {"default": {
+        "BACKEND": "api.channel_layer.SQLiteChannelLayer",
+        "CONFIG": {"path": "/var/tmp/reception_channels.sqlite3"},
+    }}
+複数ホストにまたがる構成では Redis のチャネルレイヤーを使うこと。
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    non_local TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_non_local ON channel_messages (non_local, id);
+CREATE INDEX IF NOT EXISTS channel_messages_expires ON channel_messages (expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+CREATE INDEX IF NOT EXISTS channel_groups_channel ON channel_groups (channel);
+"""
+
+# 期限切れのメッセージ・グループ登録を掃除する間隔（秒）
+CLEANUP_INTERVAL = 1.0
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.05,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = path or os.path.join(tempfile.gettempdir(), "reception_channels.sqlite3")
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self._db_lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._reset_local_state()
+
+    # -------------------
+    # プロセス・イベントループごとの状態
+    # -------------------
+    def _reset_local_state(self):
+        # fork 後の子プロセスが親の接続・チャネル名を引き継がないよう pid ごとに作り直す
+        self._pid = os.getpid()
+        self._connection = None
+        self.client_prefix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+        self._queues = {}
+        self._receiving = set()
+        self._loop = None
+        self._poller = None
+        self._next_cleanup = 0.0
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._reset_local_state()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _run(self, func, *args, write=True):
+        """
+        DB 操作をトランザクション内で実行する（スレッドから呼ばれる）
+        write=False は読み込みだけのトランザクション（書き込みロックを取らない）
+        """
+        with self._db_lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN DEFERRED")
+            try:
+                result = func(connection, *args)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+
+    async def _db(self, func, *args, write=True):
+        self._check_process()
+        return await asyncio.to_thread(self._run, func, *args, write=write)
+
+    async def _take_messages(self, non_local_names, now, limit=None):
+        """メッセージがあるときだけ書き込みトランザクションで取り出す"""
+        if not await self._db(self._pending, non_local_names, now, write=False):
+            return []
+        return await self._db(self._take, non_local_names, now, limit)
+
+    # -------------------
+    # DB 操作（_run から呼ぶ）
+    # -------------------
+    @staticmethod
+    def _pack(message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    @staticmethod
+    def _unpack(payload):
+        return msgpack.unpackb(payload, raw=False)
+
+    def _insert(self, connection, channels, payload, now):
+        """容量に空きのあるチャネルへ書き込み、書き込めなかったチャネルを返す"""
+        placeholders = ",".join("?" * len(channels))
+        counts = dict(connection.execute(
+            f"SELECT channel, COUNT(*) FROM channel_messages WHERE channel IN ({placeholders}) AND expires > ? "
+            "GROUP BY channel",
+            (*channels, now),
+        ).fetchall())
+        rows, full = [], []
+        for channel in channels:
+            if counts.get(channel, 0) >= self.get_capacity(channel):
+                full.append(channel)
+            else:
+                rows.append((channel, self.non_local_name(channel), payload, now + self.expiry))
+        connection.executemany(
+            "INSERT INTO channel_messages (channel, non_local, payload, expires) VALUES (?, ?, ?, ?)", rows
+        )
+        return full
+
+    @staticmethod
+    def _group_channels(connection, group, now):
+        return [
+            channel for (channel,) in connection.execute(
+                "SELECT channel FROM channel_groups WHERE group_name = ? AND expires > ?", (group, now)
+            )
+        ]
+
+    @staticmethod
+    def _pending(connection, non_local_names, now):
+        """指定チャネル宛ての未期限切れメッセージがあるか"""
+        placeholders = ",".join("?" * len(non_local_names))
+        row = connection.execute(
+            f"SELECT EXISTS (SELECT 1 FROM channel_messages WHERE non_local IN ({placeholders}) AND expires > ?)",
+            (*non_local_names, now),
+        ).fetchone()
+        return bool(row[0])
+
+    @staticmethod
+    def _take(connection, non_local_names, now, limit=None):
+        """指定チャネル宛ての未期限切れメッセージを古い順に取り出して削除する"""
+        placeholders = ",".join("?" * len(non_local_names))
+        query = (
+            f"SELECT id, channel, payload, expires FROM channel_messages "
+            f"WHERE non_local IN ({placeholders}) AND expires > ? ORDER BY id"
+        )
+        params = (*non_local_names, now)
+        if limit:
+            query += " LIMIT ?"
+            params += (limit,)
+        rows = connection.execute(query, params).fetchall()
+        if rows:
+            connection.executemany("DELETE FROM channel_messages WHERE id = ?", [(row[0],) for row in rows])
+        return [(channel, payload, expires) for _, channel, payload, expires in rows]
+
+    @staticmethod
+    def _expired(connection, now):
+        """期限切れのメッセージ・グループ登録があるか"""
+        row = connection.execute(
+            "SELECT EXISTS (SELECT 1 FROM channel_messages WHERE expires <= ?) "
+            "OR EXISTS (SELECT 1 FROM channel_groups WHERE expires <= ?)",
+            (now, now),
+        ).fetchone()
+        return bool(row[0])
+
+    @staticmethod
+    def _cleanup(connection, now):
+        # 期限切れのメッセージが残っていたチャネルは受信者がいないものとしてグループから外す
+        connection.execute(
+            "DELETE FROM channel_groups WHERE channel IN "
+            "(SELECT DISTINCT channel FROM channel_messages WHERE expires <= ?)",
+            (now,),
+        )
+        connection.execute("DELETE FROM channel_messages WHERE expires <= ?", (now,))
+        connection.execute("DELETE FROM channel_groups WHERE expires <= ?", (now,))
+
+    # -------------------
+    # チャネルレイヤー API
+    # -------------------
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+
+        full = await self._db(self._insert, [channel], self._pack(message), time.time())
+        if full:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self._check_process()
+
+        if "!" not in channel:
+            # 通常のチャネル: DB から直接1件ずつ取り出す
+            while True:
+                rows = await self._take_messages([channel], time.time(), 1)
+                if rows:
+                    return self._unpack(rows[0][1])
+                await asyncio.sleep(self.poll_interval)
+
+        # プロセス固有のチャネル: ポーリングタスクがプロセス内のキューへ振り分ける
+        self._ensure_poller()
+        queue = self._queues.setdefault(channel, asyncio.Queue())
+        self._receiving.add(channel)
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires > time.time():
+                    return message
+        finally:
+            self._receiving.discard(channel)
+
+    async def new_channel(self, prefix="specific."):
+        self._check_process()
+        suffix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+        return f"{prefix}{self.client_prefix}!{suffix}"
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 別のイベントループ（async_to_sync 等）では受信状態を共有しない
+            self._loop = loop
+            self._queues = {}
+            self._receiving = set()
+            self._poller = None
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        """このプロセスの specific チャネル宛てのメッセージをまとめて取り出す"""
+        while self._queues:
+            now = time.time()
+            non_local_names = sorted({self.non_local_name(channel) for channel in self._queues})
+            rows = await self._take_messages(non_local_names, now)
+            for channel, payload, expires in rows:
+                queue = self._queues.setdefault(channel, asyncio.Queue())
+                queue.put_nowait((expires, self._unpack(payload)))
+
+            if now >= self._next_cleanup:
+                self._next_cleanup = now + CLEANUP_INTERVAL
+                self._prune_queues(now)
+                if await self._db(self._expired, now, write=False):
+                    await self._db(self._cleanup, now)
+            if not rows:
+                await asyncio.sleep(self.poll_interval)
+
+    def _prune_queues(self, now):
+        """期限切れのメッセージを捨て、受信待ちの無い空のキュー（切断済みの接続）を外す"""
+        for channel, queue in list(self._queues.items()):
+            items = []
+            while not queue.empty():
+                items.append(queue.get_nowait())
+            for item in items:
+                if item[0] > now:
+                    queue.put_nowait(item)
+            if queue.empty() and channel not in self._receiving:
+                del self._queues[channel]
+
+    # -------------------
+    # groups 拡張
+    # -------------------
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def add(connection):
+            connection.execute(
+                "INSERT OR REPLACE INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?)",
+                (group, channel, time.time() + self.group_expiry),
+            )
+
+        await self._db(add)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+
+        def discard(connection):
+            connection.execute(
+                "DELETE FROM channel_groups WHERE group_name = ? AND channel = ?", (group, channel)
+            )
+
+        await self._db(discard)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        payload = self._pack(message)
+
+        now = time.time()
+        channels = await self._db(self._group_channels, group, now, write=False)
+        if channels:
+            # 容量を超えたチャネルへは送らない（InMemoryChannelLayer と同じ扱い）
+            await self._db(self._insert, channels, payload, now)
+
+    # -------------------
+    # flush 拡張
+    # -------------------
+    async def flush(self):
+        def flush(connection):
+            connection.execute("DELETE FROM channel_messages")
+            connection.execute("DELETE FROM channel_groups")
+
+        await self._db(flush)
+        self._queues = {}
+        self._receiving = set()
+
+    async def close(self):
+        with self._db_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
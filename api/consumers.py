@@ -1,52 +1,178 @@
+import asyncio
+import itertools
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
+from urllib.parse import parse_qs
+
+import msgpack
 from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from . import presence
+from .models import Visit
+from .visit_events import RECEPTION_GROUP, build_visit_message, staff_group_name, visit_group_name
+
+# WebSocket のサブプロトコル（Sec-WebSocket-Protocol）で送信形式を選ぶ
+# 指定が無い・未対応のときは従来どおり JSON のテキストフレーム
+MSGPACK_PROTOCOL = "msgpack"
+JSON_PROTOCOL = "json"
+
+# ?batch=1 で接続したときに更新をまとめて送る間隔（ミリ秒）
+BATCH_INTERVAL_MS = getattr(settings, "WEBSOCKET_BATCH_INTERVAL_MS", 200)
+
+
+class CompactMessageMixin:
+    """
+    メッセージの送信形式と、まとめ送り（バッチ）を扱う
+
+    - サブプロトコル "msgpack" で接続すると msgpack のバイナリフレームで送る
+    - ?batch=1 で接続すると BATCH_INTERVAL_MS ごとに {"type": "batch", "messages": [...]} で送る。
+      同じキーのメッセージは最新のものだけを残す（キーの無いメッセージはすべて送る）
+    """
+
+    async def accept_compact(self):
+        protocols = self.scope.get("subprotocols") or []
+        self.use_msgpack = MSGPACK_PROTOCOL in protocols
+        subprotocol = None
+        if self.use_msgpack:
+            subprotocol = MSGPACK_PROTOCOL
+        elif JSON_PROTOCOL in protocols:
+            subprotocol = JSON_PROTOCOL
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.batch_interval = BATCH_INTERVAL_MS / 1000 if query.get("batch", ["0"])[-1] in ("1", "true") else 0
+        self.pending = {}
+        self.sequence = itertools.count()
+        self.flush_task = None
+        await self.accept(subprotocol=subprotocol)
+
+    async def send_message(self, message):
+        if self.use_msgpack:
+            await self.send(bytes_data=msgpack.packb(message, use_bin_type=True))
+        else:
+            await self.send(text_data=json.dumps(message))
+
+    async def queue_message(self, message, key=None):
+        """バッチ有効時は次のまとめ送りまで保留し、無効時はすぐに送る"""
+        if not self.batch_interval:
+            await self.send_message(message)
+            return
+
+        if key is None:
+            key = ("", next(self.sequence))
+        # 同じキーは最新の状態で置き換え、更新された順に並べる
+        self.pending.pop(key, None)
+        self.pending[key] = message
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.batch_interval)
+        self.flush_task = None
+        await self.flush_pending()
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+    async def flush_pending(self):
+        if not self.pending:
+            return
+        messages = list(self.pending.values())
+        self.pending = {}
+        await self.send_message({"type": "batch", "messages": messages})
+
+    async def close_compact(self):
+        if getattr(self, "flush_task", None) is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.pending = {}
+
+
+class NotificationConsumer(CompactMessageMixin, AsyncWebsocketConsumer):
+    """
+    ws/staff/<staff_id>/ : 担当者ごとの通知
+    接続中は在席として登録し（api.presence）、HEARTBEAT_SECONDS ごとに期限を延ばす。
+    クライアントからのフレーム（{"type": "heartbeat"} など）も在席の更新として扱う
+    """
     async def connect(self):
         self.staff_id = self.scope["url_route"]["kwargs"]["staff_id"]
-        self.room_group_name = f"staff_{self.staff_id}"
-        
+        self.room_group_name = staff_group_name(self.staff_id)
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
-    
+        await self.accept_compact()
+        await sync_to_async(presence.mark_online)(self.staff_id, self.channel_name)
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+
     async def disconnect(self, close_code):
+        await self.close_compact()
+        heartbeat_task = getattr(self, "heartbeat_task", None)
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+            await sync_to_async(presence.mark_offline)(self.staff_id, self.channel_name)
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-    
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(presence.HEARTBEAT_SECONDS)
+            await sync_to_async(presence.mark_online)(self.staff_id, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await sync_to_async(presence.mark_online)(self.staff_id, self.channel_name)
+
     async def visitor_notification(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        await self.queue_message(event["message"])
 
     async def escalation_notification(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        message = event["message"]
+        await self.queue_message(message, key=(message["type"], message["visit_id"]))
 
     async def ping(self, event):
-        await self.send(text_data=json.dumps({"type": "pong"}))
+        await self.send_message({"type": "pong"})
 
-class ReceptionConsumer(AsyncWebsocketConsumer):
+class ReceptionConsumer(CompactMessageMixin, AsyncWebsocketConsumer):
+    """
+    ws/reception/            : 受付全体（全来訪のステータス変更を受け取る）
+    ws/reception/<visit_id>/ : 待機画面用（その来訪のステータス変更だけを受け取る）
+    受付の一覧表示など更新の多い画面は ?batch=1 で来訪ごとの最新状態をまとめて受け取れる
+    """
     async def connect(self):
-        self.room_group_name = "reception"
-        
+        self.visit_id = self.scope["url_route"]["kwargs"].get("visit_id")
+        self.room_group_name = visit_group_name(self.visit_id) if self.visit_id else RECEPTION_GROUP
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
-    
+        await self.accept_compact()
+
+        # 画面表示〜接続までの間に応答済みだった場合に備えて現在のステータスを送る
+        if self.visit_id:
+            message = await self.get_current_status()
+            if message and message["result"]:
+                await self.send_message(message)
+
     async def disconnect(self, close_code):
+        await self.close_compact()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-    
+
+    @database_sync_to_async
+    def get_current_status(self):
+        visit = Visit.objects.filter(pk=self.visit_id).values("status", "response_message", "staff_id").first()
+        if visit is None:
+            return None
+        return build_visit_message(int(self.visit_id), visit["status"], visit["response_message"], visit["staff_id"])
+
     async def visit_status_update(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        # ステータス変更とエスカレーションは別々に、来訪ごとの最新だけを残す
+        message = event["message"]
+        await self.queue_message(message, key=(message.get("type"), message.get("visit_id")))
 
     async def ping(self, event):
-        await self.send(text_data=json.dumps({"type": "pong"}))
-
+        await self.send_message({"type": "pong"})
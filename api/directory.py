@@ -0,0 +1,240 @@
+"""
+受付端末の担当者検索画面で使う社員名簿（部署タブ＋課ごとの社員＋全社員リスト）の構築
+
+部署と社員をそれぞれ1クエリで取得し、入れ子構造はメモリ上で組み立てる。
+社員数が増えてもクエリ数は一定（2本）のまま。
+
+構築済みの名簿はバージョン付きスナップショットとしてキャッシュし、
+部署・社員の変更時にバージョンを進めることで無効化する（api.signals 参照）。
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .kana import dakuten_variants, simple_clean, to_hiragana
+from .models import Department, Staff
+
+# 部署タブとして表示する部署タイプ
+TAB_DEPARTMENT_TYPES = ("headquarters", "special")
+
+# 名簿に必要な列だけを取得する（写真の ImageField インスタンスは作らない）
+DEPARTMENT_FIELDS = ("id", "name", "department_type", "parent_id", "order", "full_name")
+STAFF_FIELDS = (
+    "id", "name", "name_kana", "position", "photo_url", "department_id", "name_reading", "name_normalized",
+)
+
+
+def _photo_url(path):
+    """保存パスから画像URLを組み立てる"""
+    if not path:
+        return ""
+    return Staff._meta.get_field("photo_url").storage.url(path)
+
+
+def _sort_key(dept):
+    return (dept["order"], dept["id"])
+
+
+def build_staff_directory():
+    """
+    担当者検索画面用の名簿を構築する
+
+    戻り値:
+        {
+            "departments_data": [{"id", "name", "full_name", "staff_list", "sections": [...]}, ...],
+            "staff_list": [{"id", "name", "name_kana", "position", "photo_url", "department_full_name"}, ...],
+        }
+    """
+    departments = {
+        dept["id"]: dept for dept in Department.objects.values(*DEPARTMENT_FIELDS)
+    }
+
+    # 部署ID → 所属社員（氏名順）
+    staff_by_department = {}
+    staff_list = []
+    for row in Staff.objects.order_by("name", "id").values(*STAFF_FIELDS):
+        dept = departments.get(row["department_id"])
+        entry = {
+            "id": row["id"],
+            "name": row["name"],
+            "name_kana": row["name_kana"],
+            "position": row["position"],
+            "photo_url": _photo_url(row["photo_url"]),
+            "department_full_name": (dept["full_name"] or dept["name"]) if dept else "",
+            "name_reading": row["name_reading"],
+            "name_normalized": row["name_normalized"],
+        }
+        staff_list.append(entry)
+        if dept:
+            staff_by_department.setdefault(dept["id"], []).append(entry)
+
+    # 親部署ID → 直下の課
+    sections_by_parent = {}
+    for dept in departments.values():
+        if dept["department_type"] == "section" and dept["parent_id"]:
+            sections_by_parent.setdefault(dept["parent_id"], []).append(dept)
+
+    tabs = sorted(
+        (dept for dept in departments.values() if dept["department_type"] in TAB_DEPARTMENT_TYPES),
+        key=_sort_key,
+    )
+
+    departments_data = []
+    for hq in tabs:
+        departments_data.append({
+            "id": hq["id"],
+            "name": hq["name"],
+            "full_name": hq["name"],
+            "staff_list": staff_by_department.get(hq["id"], []),
+            "sections": [
+                {
+                    "id": section["id"],
+                    "name": section["name"],
+                    "full_name": section["full_name"] or section["name"],
+                    "staff_list": staff_by_department.get(section["id"], []),
+                }
+                for section in sorted(sections_by_parent.get(hq["id"], []), key=_sort_key)
+            ],
+        })
+
+    return {
+        "departments_data": departments_data,
+        "staff_list": staff_list,
+    }
+
+
+def filter_staff_entries(staff_list, query):
+    """
+    名簿の社員リストを検索語で絞り込む（担当者検索画面のJSと同じ規則）
+    - 1文字なら読みの前方一致（濁音は清音も候補に含める）、2文字以上は部分一致
+    - ローマ字混じりの氏名向けに、元の氏名の部分一致も許可する
+    """
+    term = to_hiragana(query)
+    raw = simple_clean(query)
+    if not term and not raw:
+        return staff_list
+
+    variants = dakuten_variants(term) if term else []
+
+    def matches(entry):
+        for variant in variants:
+            if len(variant) == 1:
+                if entry["name_reading"].startswith(variant) or entry["name_normalized"].startswith(variant):
+                    return True
+            elif variant in entry["name_reading"] or variant in entry["name_normalized"]:
+                return True
+        return bool(raw) and raw in entry["name"].lower()
+
+    return [entry for entry in staff_list if matches(entry)]
+
+
+# -------------------
+# スナップショットキャッシュ
+# -------------------
+# スナップショットの構造を変えたら上げる（古い構造のキャッシュを読まないため）
+DIRECTORY_SCHEMA = 2
+
+DIRECTORY_VERSION_KEY = "staff_directory:version"
+DIRECTORY_SNAPSHOT_KEY = f"staff_directory:s{DIRECTORY_SCHEMA}:snapshot:{{version}}"
+DIRECTORY_LATEST_KEY = f"staff_directory:s{DIRECTORY_SCHEMA}:latest"
+DIRECTORY_LOCK_KEY = "staff_directory:rebuild_lock:{version}"
+
+DIRECTORY_CACHE_TIMEOUT = getattr(settings, "STAFF_DIRECTORY_CACHE_TIMEOUT", 60 * 60 * 24)
+# 再構築中ロックの有効期限（再構築プロセスが落ちてもこの秒数で解放される）
+DIRECTORY_LOCK_TIMEOUT = 30
+# ロックを取れなかったリクエストが他プロセスの再構築完了を待つ最大秒数
+DIRECTORY_WAIT_TIMEOUT = 5
+DIRECTORY_WAIT_INTERVAL = 0.05
+
+# プロセス内で最後に取得したスナップショット（毎回キャッシュから読み直さないため）
+_local_snapshot = {"version": None, "snapshot": None}
+_local_lock = threading.Lock()
+
+
+def _initial_version():
+    # キャッシュからバージョンが消えても、以前のバージョン（に incr した値）より必ず大きくなるよう時刻から始める
+    return time.time_ns()
+
+
+def get_directory_version():
+    """現在の名簿バージョンを返す（未設定なら初期化する）"""
+    version = cache.get(DIRECTORY_VERSION_KEY)
+    if version is None:
+        initial = _initial_version()
+        cache.add(DIRECTORY_VERSION_KEY, initial, timeout=None)
+        version = cache.get(DIRECTORY_VERSION_KEY, initial)
+    return version
+
+
+def invalidate_staff_directory():
+    """名簿バージョンを進め、以降のリクエストで再構築させる"""
+    try:
+        cache.incr(DIRECTORY_VERSION_KEY)
+    except ValueError:
+        # キーが存在しない（初回・キャッシュ消失時）は新しいバージョンで初期化
+        # 同時に他のプロセスが初期化していたら、そちらを進める
+        if not cache.add(DIRECTORY_VERSION_KEY, _initial_version(), timeout=None):
+            cache.incr(DIRECTORY_VERSION_KEY)
+
+
+def _build_snapshot(version):
+    snapshot = build_staff_directory()
+    snapshot["version"] = version
+    snapshot["built_at"] = timezone.now().isoformat()
+    cache.set(DIRECTORY_SNAPSHOT_KEY.format(version=version), snapshot, timeout=DIRECTORY_CACHE_TIMEOUT)
+    cache.set(DIRECTORY_LATEST_KEY, snapshot, timeout=DIRECTORY_CACHE_TIMEOUT)
+    return snapshot
+
+
+def _remember(version, snapshot):
+    _local_snapshot["version"] = version
+    _local_snapshot["snapshot"] = snapshot
+    return snapshot
+
+
+def get_staff_directory():
+    """
+    キャッシュ済みの名簿スナップショットを返す
+
+    - プロセス内に同じバージョンがあればキャッシュにも問い合わせない
+    - 再構築は1プロセス1スレッドのみが行う（single-flight）
+    - 再構築中の他リクエストは直前のスナップショットを返し、無ければ完了を待つ
+    """
+    version = get_directory_version()
+    if _local_snapshot["version"] == version:
+        return _local_snapshot["snapshot"]
+
+    snapshot_key = DIRECTORY_SNAPSHOT_KEY.format(version=version)
+    snapshot = cache.get(snapshot_key)
+    if snapshot is not None:
+        return _remember(version, snapshot)
+
+    with _local_lock:
+        # ロック待ちの間に同一プロセス内の別スレッドが構築済みの場合
+        if _local_snapshot["version"] == version:
+            return _local_snapshot["snapshot"]
+
+        lock_key = DIRECTORY_LOCK_KEY.format(version=version)
+        if cache.add(lock_key, 1, timeout=DIRECTORY_LOCK_TIMEOUT):
+            try:
+                return _remember(version, _build_snapshot(version))
+            finally:
+                cache.delete(lock_key)
+
+        # 他プロセスが再構築中：古いスナップショットがあればそれを返す
+        stale = cache.get(DIRECTORY_LATEST_KEY)
+        if stale is not None:
+            return stale
+
+        deadline = time.monotonic() + DIRECTORY_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(DIRECTORY_WAIT_INTERVAL)
+            snapshot = cache.get(snapshot_key)
+            if snapshot is not None:
+                return _remember(version, snapshot)
+
+        # 待っても完成しない場合は自前で構築する
+        return _remember(version, _build_snapshot(version))
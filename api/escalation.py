@@ -0,0 +1,268 @@
+"""
+応答待ち来訪のエスカレーション（サーバー側で期限を管理する）
+
+担当者が escalation_interval_seconds 以内に応答しなければ、次の通知先へ順に回す。
+  レベル 1..n : 担当者の部署の上位部署のうち、まだ通知していない Teams チャネルを近い順に
+  最終レベル  : 総務対応（status="notified"）。SystemSetting general_affairs_department_id の部署にも通知する
+
+期限は Visit.escalation_due_at に保存し、`python manage.py run_escalations` の
+EscalationScheduler（asyncio・期限順のヒープ）が期限を迎えた来訪を escalate_visit() で進める。
+スケジューラーは起動時と一定間隔で DB から応答待ちの期限を読み直すため、再起動しても取りこぼさない。
+ESCALATION_SKIP_OFFLINE_STAFF のときは、担当者が接続していない（api.presence）来訪を待たずに次の通知先へ進める。
+"""
+import asyncio
+import heapq
+import logging
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Department, Visit
+from . import presence
+from .notifications import enqueue_teams_notification
+from .system_settings import get_int, get_seconds
+from .visit_events import publish_visit_escalation, publish_visitor_notification
+from .visit_statistics import apply_visit_change, key_of
+from .visit_transitions import StaleTransition, transition_visit
+
+logger = logging.getLogger(__name__)
+
+# DB から期限を読み直す間隔（他プロセスで作られた応答待ちを拾う）
+RELOAD_SECONDS = getattr(settings, "ESCALATION_RELOAD_SECONDS", 2)
+# 担当者が不在なら最初のエスカレーション期限を待たない（担当者の画面が ws/staff/<id>/ に接続する運用向け）
+SKIP_OFFLINE_STAFF = getattr(settings, "ESCALATION_SKIP_OFFLINE_STAFF", False)
+
+WAITING_STATUS = "waiting"
+# 最後まで応答が無かったときのステータス（総務部対応）
+FINAL_STATUS = "notified"
+GENERAL_AFFAIRS_NAME = "総務"
+
+
+def escalation_interval():
+    return timedelta(seconds=get_seconds("escalation_interval_seconds", 5))
+
+
+def general_affairs_department():
+    department_id = get_int("general_affairs_department_id", 0)
+    return Department.objects.filter(pk=department_id).first() if department_id else None
+
+
+def escalation_targets(visit):
+    """
+    担当者が応答しないときに順に通知する部署（最終の総務は含まない）
+    担当者の部署から上位へたどり、最初の通知先と同じ Teams チャネルは除く
+    """
+    department = visit.staff.department if visit.staff_id else None
+    if department is None:
+        return []
+
+    notified_urls = {department.teams_api_url}
+    ancestor_ids = department.ancestor_id_list
+    ancestors = Department.objects.in_bulk(ancestor_ids)
+    targets = []
+    for pk in reversed(ancestor_ids):
+        ancestor = ancestors.get(pk)
+        if ancestor and ancestor.teams_api_url and ancestor.teams_api_url not in notified_urls:
+            notified_urls.add(ancestor.teams_api_url)
+            targets.append(ancestor)
+    return targets
+
+
+def start_waiting(visit, staff):
+    """
+    担当者を決めて応答待ちを開始する（待機画面の表示時）
+    担当者の部署へ通知し、最初のエスカレーション期限を設定する
+    SKIP_OFFLINE_STAFF で担当者が接続していなければ期限を現在時刻にし、スケジューラーがすぐ次の通知先へ回す
+    応答済み・総務対応済みの来訪、同じ担当者で待機中の来訪（画面の再表示）はそのまま返す
+    """
+    if visit.status != WAITING_STATUS:
+        return visit
+    if visit.staff_id == (staff.pk if staff else None) and visit.escalation_due_at:
+        return visit
+
+    due_at = None
+    if staff:
+        due_at = timezone.now()
+        if not SKIP_OFFLINE_STAFF or presence.is_online(staff.pk):
+            due_at += escalation_interval()
+
+    # 読んだ時点から状態・担当者が変わっていない場合だけ書き込む（同時に来た担当者の応答を上書きしない）
+    values = {"staff": staff, "escalation_level": 0, "escalation_due_at": due_at, "updated_at": timezone.now()}
+    old_key = key_of(visit)
+    with transaction.atomic():
+        updated = Visit.objects.filter(pk=visit.pk, status=WAITING_STATUS, staff_id=visit.staff_id).update(**values)
+        if not updated:
+            visit.refresh_from_db()
+            return visit
+        for name, value in values.items():
+            setattr(visit, name, value)
+        apply_visit_change(old_key, key_of(visit))
+        if staff:
+            enqueue_teams_notification(visit)
+            publish_visitor_notification(visit)
+    return visit
+
+
+def escalate_visit(visit_id, force=False):
+    """
+    応答待ちの来訪を1段階エスカレーションする
+    force=False なら期限前・応答済みの来訪は何もしない（None を返す）
+    戻り値: {"visit_id", "level", "status", "target", "next_due_at"}
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        visit = Visit.objects.select_related("staff__department").filter(pk=visit_id, status=WAITING_STATUS).first()
+        if visit is None:
+            return None
+        if not force and (visit.escalation_due_at is None or visit.escalation_due_at > now):
+            return None
+
+        targets = escalation_targets(visit)
+        level = visit.escalation_level + 1
+        if level <= len(targets):
+            target = targets[level - 1]
+            next_due_at = now + escalation_interval()
+        else:
+            target = general_affairs_department()
+            next_due_at = None
+
+        # 複数のスケジューラー・手動操作が重なっても1段階だけ進める
+        if next_due_at is None:
+            # 総務対応へ（段階とステータスを1回の UPDATE で変える）
+            try:
+                transition_visit(
+                    visit, FINAL_STATUS, where={"escalation_level": visit.escalation_level},
+                    escalation_level=level, escalation_due_at=None,
+                )
+            except StaleTransition:
+                return None
+        else:
+            claimed = Visit.objects.filter(
+                pk=visit.pk, status=WAITING_STATUS, escalation_level=visit.escalation_level
+            ).update(escalation_level=level, escalation_due_at=next_due_at, updated_at=now)
+            if not claimed:
+                return None
+            visit.escalation_level = level
+            visit.escalation_due_at = next_due_at
+
+        target_name = (target.full_name or target.name) if target else GENERAL_AFFAIRS_NAME
+        note = f"⚠️ {visit.staff.name if visit.staff else '担当者'} さんから応答が無いため転送しました（{level}回目）"
+        if target is not None:
+            enqueue_teams_notification(visit, department=target, note=note)
+        publish_visit_escalation(
+            visit, target_name, int((next_due_at - now).total_seconds()) if next_due_at else None
+        )
+
+    return {
+        "visit_id": visit.pk,
+        "level": level,
+        "status": visit.status,
+        "target": target_name,
+        "next_due_at": next_due_at,
+    }
+
+
+def pending_deadlines():
+    """応答待ちの来訪の [(期限, visit_id), ...]"""
+    return list(
+        Visit.objects.filter(status=WAITING_STATUS, escalation_due_at__isnull=False)
+        .values_list("escalation_due_at", "id")
+    )
+
+
+class EscalationScheduler:
+    """
+    エスカレーション期限を管理する asyncio スケジューラー
+
+    期限順のヒープから最も近い期限まで待ち、期限を迎えた来訪を escalate_visit() で進める。
+    応答・キャンセルで期限が変わったものは、DB の読み直しでヒープの古い項目を無視する。
+    """
+
+    def __init__(self, reload_seconds=RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self.heap = []
+        self.deadlines = {}
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+
+    def schedule(self, visit_id, due_at):
+        if self.deadlines.get(visit_id) == due_at:
+            return
+        self.deadlines[visit_id] = due_at
+        heapq.heappush(self.heap, (due_at, visit_id))
+        self.wakeup.set()
+
+    def replace_all(self, deadlines):
+        """DB の内容で期限一覧を置き換える（応答済み・削除済みの来訪は外れる）"""
+        current = {visit_id: due_at for due_at, visit_id in deadlines}
+        for visit_id in list(self.deadlines):
+            if visit_id not in current:
+                del self.deadlines[visit_id]
+        for visit_id, due_at in current.items():
+            self.schedule(visit_id, due_at)
+        # 無効になった項目が溜まりすぎたらヒープを作り直す
+        if len(self.heap) > 2 * len(self.deadlines) + 100:
+            self.heap = [(due_at, visit_id) for visit_id, due_at in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now):
+        """期限を迎えた visit_id を取り出す"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, visit_id = heapq.heappop(self.heap)
+            if self.deadlines.get(visit_id) == due_at:
+                del self.deadlines[visit_id]
+                due.append(visit_id)
+        return due
+
+    def seconds_until_next(self, now):
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(0.0, (self.heap[0][0] - now).total_seconds())
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    async def reload(self):
+        self.replace_all(await database_sync_to_async(pending_deadlines)())
+
+    async def fire(self, visit_id):
+        try:
+            result = await database_sync_to_async(escalate_visit)(visit_id)
+        except Exception:
+            logger.exception("Escalation failed (visit_id=%s)", visit_id)
+            return None
+        if result and result["next_due_at"]:
+            self.schedule(visit_id, result["next_due_at"])
+        return result
+
+    async def run(self, on_escalated=None):
+        """stop() されるまで期限を監視する"""
+        next_reload = 0.0
+        loop = asyncio.get_running_loop()
+        while not self.stopping:
+            if loop.time() >= next_reload:
+                await database_sync_to_async(close_old_connections)()
+                await self.reload()
+                next_reload = loop.time() + self.reload_seconds
+
+            for visit_id in self.pop_due(timezone.now()):
+                result = await self.fire(visit_id)
+                if result and on_escalated:
+                    on_escalated(result)
+
+            timeout = max(0.0, next_reload - loop.time())
+            until_next = self.seconds_until_next(timezone.now())
+            if until_next is not None:
+                timeout = min(timeout, until_next)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
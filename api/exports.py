@@ -0,0 +1,192 @@
+"""
+CSVエクスポート（社員一覧・来訪記録）
+
+行はDBカーソルから chunk_size 件ずつ読みながら StreamingHttpResponse で順に送り出す。
+件数が増えてもメモリ使用量は一定で、ヘッダー行はクエリ実行前にすぐ返る。
+Excel で文字化けしないよう UTF-8 の BOM を先頭に付ける。
+
+ASGI（SERVER_MODE=asgi）では Django 4.2 が同期イテレーターを sync_to_async(list) で全件
+読んでから送るため、非同期イテレーターに包み、行をまとめてスレッドで取り出しながら送る。
+"""
+import csv
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Staff, Visit
+from .partitions import visit_querysets
+
+EXPORT_CHUNK_SIZE = getattr(settings, "CSV_EXPORT_CHUNK_SIZE", 2000)
+
+BOM = "\ufeff"
+
+# (CSVの見出し, values_list に渡すフィールド)
+STAFF_COLUMNS = [
+    ("社員番号", "employee_number"),
+    ("氏名", "name"),
+    ("氏名カナ", "name_kana"),
+    ("部署名", "department__name"),
+    ("役職", "position"),
+]
+
+VISIT_COLUMNS = [
+    ("来訪日時", "visited_at"),
+    ("来訪種別", "visit_type"),
+    ("会社名", "visitor_company"),
+    ("来訪者名", "visitor_name"),
+    ("担当者社員番号", "staff__employee_number"),
+    ("担当者", "staff__name"),
+    ("部署名", "staff__department__name"),
+    ("ステータス", "status"),
+    ("用件（選択肢）", "purpose_preset"),
+    ("用件（自由入力）", "purpose_custom"),
+    ("対応メッセージ", "response_message"),
+    ("対応時間", "response_time"),
+]
+
+
+# 月別パーティション（api.partitions）では担当者の情報を列として直接持つ
+ARCHIVED_VISIT_FIELDS = {
+    "staff__employee_number": "staff_employee_number",
+    "staff__name": "staff_name",
+    "staff__department__name": "department_name",
+}
+
+
+class InvalidDateRange(ValueError):
+    """期間指定が不正"""
+
+
+class Echo:
+    """csv.writer の書き込み先。書いた1行をそのまま返す"""
+
+    def write(self, value):
+        return value
+
+
+def _format_datetime(value):
+    return timezone.localtime(value).strftime("%Y-%m-%d %H:%M") if value else ""
+
+
+def _choice_label(choices):
+    labels = dict(choices)
+    return lambda value: labels.get(value, value)
+
+
+VISIT_FORMATTERS = {
+    "visited_at": _format_datetime,
+    "response_time": _format_datetime,
+    "visit_type": _choice_label(Visit.VISIT_TYPES),
+    "status": _choice_label(Visit.STATUS_CHOICES),
+}
+
+
+def iter_csv_rows(queryset, columns, formatters=None, chunk_size=None):
+    """
+    ヘッダー行（BOM付き）→ データ行の順に CSV の1行ずつを返すジェネレーター
+    queryset は最初のデータ行を取り出す時点で初めて実行される
+    """
+    writer = csv.writer(Echo())
+    yield BOM + writer.writerow([header for header, _ in columns])
+    yield from iter_csv_data(writer, queryset, [field for _, field in columns], formatters, chunk_size)
+
+
+def iter_csv_data(writer, queryset, fields, formatters=None, chunk_size=None):
+    """queryset の fields の値を CSV のデータ行にする"""
+    formatters = formatters or {}
+    convert = [formatters.get(field) for field in fields]
+    for values in queryset.values_list(*fields).iterator(chunk_size=chunk_size or EXPORT_CHUNK_SIZE):
+        yield writer.writerow([
+            func(value) if func else ("" if value is None else value)
+            for func, value in zip(convert, values)
+        ])
+
+
+def _next_chunk(rows, count):
+    return "".join(islice(rows, count))
+
+
+async def aiter_chunks(rows, chunk_size=None):
+    """
+    同期の行イテレーターを非同期イテレーターにする（chunk_size 行ずつスレッドで取り出す）
+    最初はヘッダー行だけを返し、クエリの実行を待たずに送り始める
+    """
+    next_chunk = sync_to_async(_next_chunk)
+    count = 1
+    try:
+        while True:
+            chunk = await next_chunk(rows, count)
+            if not chunk:
+                return
+            yield chunk
+            count = chunk_size or EXPORT_CHUNK_SIZE
+    finally:
+        # 途中で切断されたときもカーソルを閉じる
+        await sync_to_async(rows.close)()
+
+
+def is_asgi_request(request):
+    # DRF の Request は元の HttpRequest を _request に持つ
+    return isinstance(getattr(request, "_request", request), ASGIRequest)
+
+
+def csv_response(rows, filename, request=None):
+    if request is not None and is_asgi_request(request):
+        rows = aiter_chunks(rows)
+    response = StreamingHttpResponse(rows, content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def export_staff_csv(request=None):
+    """社員一覧（取り込みCSVと同じ列構成）"""
+    queryset = Staff.objects.order_by("employee_number")
+    return csv_response(iter_csv_rows(queryset, STAFF_COLUMNS), "staff_export.csv", request)
+
+
+def parse_date_range(date_from=None, date_to=None):
+    """
+    YYYY-MM-DD の期間（両端を含む、ローカル日付）を来訪日時の範囲 [start, end) にする
+    未指定の側は None
+    """
+    bounds = []
+    for label, value, offset in (("from", date_from, 0), ("to", date_to, 1)):
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise InvalidDateRange(f"{label} must be a date (YYYY-MM-DD)")
+        bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=offset), time.min)))
+
+    start, end = bounds
+    if start and end and start >= end:
+        raise InvalidDateRange("from must be on or before to")
+    return start, end
+
+
+def iter_visit_csv_rows(start=None, end=None):
+    """来訪記録の CSV 行（期間に重なる月別パーティション → api_visit の順）"""
+    writer = csv.writer(Echo())
+    yield BOM + writer.writerow([header for header, _ in VISIT_COLUMNS])
+    for queryset in visit_querysets(start, end):
+        fields = [field for _, field in VISIT_COLUMNS]
+        if queryset.model is not Visit:
+            fields = [ARCHIVED_VISIT_FIELDS.get(field, field) for field in fields]
+        yield from iter_csv_data(writer, queryset.order_by("visited_at", "id"), fields, VISIT_FORMATTERS)
+
+
+def export_visits_csv(date_from=None, date_to=None, request=None):
+    """来訪記録（期間指定可）。期間が不正なら InvalidDateRange"""
+    start, end = parse_date_range(date_from, date_to)
+    name = "_".join(filter(None, ["visits", date_from, date_to]))
+    return csv_response(iter_visit_csv_rows(start, end), f"{name}.csv", request)
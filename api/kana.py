@@ -0,0 +1,104 @@
+"""
+社員検索用の読み仮名正規化
+
+担当者検索画面（staff_search.html）の JavaScript と同じ規則で、
+ローマ字・カタカナ・全角半角の揺れを「ひらがな文字列」に揃える。
+Staff.name_reading / Staff.name_normalized の算出と /api/staff/search/ の検索語の変換に使う。
+"""
+import re
+import unicodedata
+
+# ローマ字 → ひらがな（3文字 → 2文字 → 1文字の順に貪欲マッチ）
+ROMAJI_MAP = {
+    "kya": "きゃ", "kyu": "きゅ", "kyo": "きょ", "sha": "しゃ", "shu": "しゅ", "sho": "しょ",
+    "cha": "ちゃ", "chu": "ちゅ", "cho": "ちょ", "nya": "にゃ", "nyu": "にゅ", "nyo": "にょ",
+    "hya": "ひゃ", "hyu": "ひゅ", "hyo": "ひょ", "mya": "みゃ", "myu": "みゅ", "myo": "みょ",
+    "rya": "りゃ", "ryu": "りゅ", "ryo": "りょ", "gya": "ぎゃ", "gyu": "ぎゅ", "gyo": "ぎょ",
+    "ja": "じゃ", "ju": "じゅ", "jo": "じょ", "bya": "びゃ", "byu": "びゅ", "byo": "びょ",
+    "pya": "ぴゃ", "pyu": "ぴゅ", "pyo": "ぴょ",
+    "shi": "し", "chi": "ち", "tsu": "つ", "fu": "ふ", "ji": "じ",
+    "ka": "か", "ki": "き", "ku": "く", "ke": "け", "ko": "こ",
+    "sa": "さ", "si": "し", "su": "す", "se": "せ", "so": "そ",
+    "ta": "た", "ti": "ち", "tu": "つ", "te": "て", "to": "と",
+    "na": "な", "ni": "に", "nu": "ぬ", "ne": "ね", "no": "の",
+    "ha": "は", "hi": "ひ", "hu": "ふ", "he": "へ", "ho": "ほ",
+    "ma": "ま", "mi": "み", "mu": "む", "me": "め", "mo": "も",
+    "ya": "や", "yu": "ゆ", "yo": "よ", "ra": "ら", "ri": "り", "ru": "る", "re": "れ", "ro": "ろ",
+    "wa": "わ", "wo": "を", "n": "ん",
+    "ga": "が", "gi": "ぎ", "gu": "ぐ", "ge": "げ", "go": "ご",
+    "za": "ざ", "zi": "じ", "zu": "ず", "ze": "ぜ", "zo": "ぞ",
+    "da": "だ", "di": "ぢ", "du": "づ", "de": "で", "do": "ど",
+    "ba": "ば", "bi": "び", "bu": "ぶ", "be": "べ", "bo": "ぼ",
+    "pa": "ぱ", "pi": "ぴ", "pu": "ぷ", "pe": "ぺ", "po": "ぽ",
+    "a": "あ", "i": "い", "u": "う", "e": "え", "o": "お",
+}
+
+# 濁音・半濁音 → 清音
+DAKUTEN_MAP = {
+    "が": "か", "ぎ": "き", "ぐ": "く", "げ": "け", "ご": "こ",
+    "ざ": "さ", "じ": "し", "ず": "す", "ぜ": "せ", "ぞ": "そ",
+    "だ": "た", "ぢ": "ち", "づ": "つ", "で": "て", "ど": "と",
+    "ば": "は", "び": "ひ", "ぶ": "ふ", "べ": "へ", "ぼ": "ほ",
+    "ぱ": "は", "ぴ": "ひ", "ぷ": "ふ", "ぺ": "へ", "ぽ": "ほ",
+}
+
+# 促音（っ）として扱う子音の重なり。"nn" は「ん」＋な行として扱うため n は含めない
+SOKUON_CONSONANTS = set("bcdfghjklmpqrstvwxyz")
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+LATIN_PATTERN = re.compile(r"[a-zA-Z]")
+
+
+def normalize_nfkc(value):
+    return unicodedata.normalize("NFKC", value or "")
+
+
+def kata_to_hira(value):
+    """カタカナ（ァ〜ヶ）をひらがなに変換"""
+    return "".join(chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch for ch in value or "")
+
+
+def simple_clean(value):
+    """NFKC正規化のうえ空白・長音記号を除去して小文字化"""
+    return WHITESPACE_PATTERN.sub("", normalize_nfkc(value).strip()).replace("ー", "").lower()
+
+
+def romaji_to_hiragana(value):
+    """ローマ字をひらがなに変換（変換できない文字は読み飛ばす）"""
+    text = simple_clean(value)
+    out = []
+    i = 0
+    while i < len(text):
+        # 促音（子音の重なり）
+        if i + 1 < len(text) and text[i] == text[i + 1] and text[i] in SOKUON_CONSONANTS:
+            out.append("っ")
+            i += 1
+            continue
+        for size in (3, 2, 1):
+            kana = ROMAJI_MAP.get(text[i:i + size])
+            if kana:
+                out.append(kana)
+                i += size
+                break
+        else:
+            i += 1
+    return "".join(out)
+
+
+def to_hiragana(value):
+    """任意の入力（ローマ字/カナ/漢字/ひらがな）をひらがな基準の比較用文字列にする"""
+    if not value:
+        return ""
+    text = normalize_nfkc(value)
+    if LATIN_PATTERN.search(text):
+        return romaji_to_hiragana(text)
+    text = kata_to_hira(text)
+    return WHITESPACE_PATTERN.sub("", text.replace("ー", "")).lower()
+
+
+def dakuten_variants(hiragana):
+    """1文字の検索語に限り、濁音・半濁音を清音に揃えた候補も返す"""
+    variants = [hiragana]
+    if len(hiragana) == 1 and hiragana in DAKUTEN_MAP:
+        variants.append(DAKUTEN_MAP[hiragana])
+    return variants
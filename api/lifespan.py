@@ -0,0 +1,225 @@
+"""
+ASGI サーバーの起動・終了処理（lifespan）
+
+gunicorn + uvicorn ワーカー（docker-entrypoint.sh の SERVER_MODE=asgi）で HTTP と WebSocket を
+同じプロセスで扱うときに、ワーカーごとに1回呼ばれる。
+- startup : バックグラウンド処理をワーカー内で動かす（別プロセスを起動しなくてよい）
+  - エスカレーションのスケジューラー（api.escalation.EscalationScheduler。ESCALATION_IN_SERVER）
+  - Teams 通知の配信（api.notifications.deliver_due_notifications。NOTIFICATIONS_IN_SERVER）
+- shutdown: バックグラウンド処理を止め、チャネルレイヤーの接続を閉じる
+
+バックグラウンド処理は全ワーカーのうち共有キャッシュ（CACHES）のリーダー lease を持つ1つだけが動かし、
+lease が切れたら（ワーカーが落ちたら）他のワーカーが引き継ぐ。引き継ぎの間に2つ動いても、
+escalate_visit() の条件付き更新で1つの来訪は1段階ずつしか進まず、通知キューは
+claim_due_notifications() の lease で同じ行を同時に送らない。
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from .escalation import EscalationScheduler
+from .notifications import BATCH_SIZE, CONCURRENCY, POLL_INTERVAL, create_session, deliver_due_notifications
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_IN_SERVER = getattr(settings, "ESCALATION_IN_SERVER", True)
+NOTIFICATIONS_IN_SERVER = getattr(settings, "NOTIFICATIONS_IN_SERVER", True)
+# 終了時にバックグラウンド処理の停止を待つ秒数
+SHUTDOWN_TIMEOUT = 5
+# リーダー lease の秒数（この 1/3 ごとに延長する。リーダーが落ちたらこの秒数で他が引き継ぐ）
+LEADER_TTL = getattr(settings, "BACKGROUND_LEADER_TTL", 15)
+
+
+class LeaderLease:
+    """cache.add による簡易的なリーダー lease（キャッシュに自分の ID がある間だけリーダー）"""
+
+    def __init__(self, key, ttl=LEADER_TTL):
+        self.key = f"lifespan:leader:{key}"
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.ttl = ttl
+
+    def acquire(self):
+        return cache.add(self.key, self.owner, timeout=self.ttl) or self.renew()
+
+    def renew(self):
+        # 同時に add して上書きされた側はここで外れる
+        if cache.get(self.key) != self.owner:
+            return False
+        cache.set(self.key, self.owner, timeout=self.ttl)
+        return True
+
+    def release(self):
+        if cache.get(self.key) == self.owner:
+            cache.delete(self.key)
+
+
+class LeaderTask:
+    """
+    リーダー lease を持っている間だけバックグラウンド処理を動かす
+    make_worker() は (stop() を持つ処理, 実行するコルーチン) を返す
+    """
+
+    def __init__(self, name, key, make_worker, ttl=LEADER_TTL):
+        self.name = name
+        self.make_worker = make_worker
+        self.lease = LeaderLease(key, ttl)
+        self.interval = ttl / 3
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    async def sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        while not self.stopping.is_set():
+            try:
+                leader = await sync_to_async(self.lease.acquire)()
+            except Exception:
+                logger.exception("%s: leader lease failed", self.name)
+                leader = False
+            if leader:
+                await self.lead()
+            await self.sleep(self.interval)
+
+    async def lead(self):
+        worker, coroutine = self.make_worker()
+        task = asyncio.create_task(coroutine)
+        logger.info("%s started in server process (pid=%s)", self.name, os.getpid())
+        try:
+            while not task.done() and not self.stopping.is_set():
+                await self.sleep(self.interval)
+                if not self.stopping.is_set() and not await sync_to_async(self.lease.renew)():
+                    logger.warning("%s: leader lease lost", self.name)
+                    break
+        finally:
+            worker.stop()
+            try:
+                await asyncio.wait_for(task, timeout=SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("%s did not stop in %ss", self.name, SHUTDOWN_TIMEOUT)
+            except Exception:
+                logger.exception("%s failed", self.name)
+            await sync_to_async(self.lease.release)()
+
+
+class NotificationDeliverer:
+    """送信時刻を迎えた通知キューを配信し続ける（send_notifications コマンドのループと同じ）"""
+
+    def __init__(self, batch_size=BATCH_SIZE, concurrency=CONCURRENCY, poll_interval=POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    async def run(self):
+        session = create_session(pool_size=self.concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        deliver = database_sync_to_async(deliver_due_notifications)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    results = await deliver(
+                        session, executor, batch_size=self.batch_size, concurrency=self.concurrency
+                    )
+                except Exception:
+                    logger.exception("Notification delivery failed")
+                    results = {}
+                if any(results.values()):
+                    logger.info("Notifications: %s", results)
+                # 見送りだけのバッチは送信できる行が無いのと同じ扱い
+                if sum(results.values()) - results.get("deferred", 0):
+                    continue
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 送信中のものは lease が切れた後に他のワーカーが送り直す（イベントループは止めない）
+            executor.shutdown(wait=False)
+            session.close()
+
+
+class Lifespan:
+    """ProtocolTypeRouter の "lifespan" に渡す ASGI アプリケーション"""
+
+    def __init__(self):
+        # [(LeaderTask, タスク), ...]
+        self.workers = []
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("ASGI startup failed")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await self.shutdown()
+                except Exception as e:
+                    logger.exception("ASGI shutdown failed")
+                    await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def start_worker(self, name, key, make_worker):
+        leader = LeaderTask(name, key, make_worker)
+        self.workers.append((leader, asyncio.create_task(leader.run())))
+
+    def make_scheduler(self):
+        scheduler = EscalationScheduler()
+        return scheduler, scheduler.run(on_escalated=self.report)
+
+    @staticmethod
+    def make_deliverer():
+        deliverer = NotificationDeliverer()
+        return deliverer, deliverer.run()
+
+    async def startup(self):
+        if ESCALATION_IN_SERVER:
+            self.start_worker("Escalation scheduler", "escalation", self.make_scheduler)
+        if NOTIFICATIONS_IN_SERVER:
+            self.start_worker("Notification delivery", "notifications", self.make_deliverer)
+
+    async def shutdown(self):
+        for leader, task in self.workers:
+            leader.stop()
+        for leader, task in self.workers:
+            try:
+                await asyncio.wait_for(task, timeout=2 * SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("%s did not stop in %ss", leader.name, 2 * SHUTDOWN_TIMEOUT)
+        self.workers = []
+
+        close = getattr(get_channel_layer(), "close", None)
+        if close is not None:
+            await close()
+
+    @staticmethod
+    def report(result):
+        logger.info(
+            "visit=%s level=%s status=%s target=%s",
+            result["visit_id"], result["level"], result["status"], result["target"],
+        )
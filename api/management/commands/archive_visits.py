@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitions import HOT_MONTHS, archive_visits, partition_months
+
+
+class Command(BaseCommand):
+    help = "Move visits older than the recent months from api_visit into monthly partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-months", type=int, default=HOT_MONTHS,
+            help=f"api_visit に残す月数（今月を含む。既定 {HOT_MONTHS}）",
+        )
+        parser.add_argument("--list", action="store_true", help="移さずにパーティションの一覧だけを表示する")
+
+    def handle(self, *args, **options):
+        if options["list"]:
+            for month in partition_months():
+                self.stdout.write(f"{month:%Y-%m}")
+            return
+
+        if options["keep_months"] < 1:
+            raise CommandError("--keep-months must be 1 or more")
+        results = archive_visits(options["keep_months"])
+        for month, moved in results.items():
+            self.stdout.write(f"{month:%Y-%m}: {moved} visits archived")
+        self.stdout.write(self.style.SUCCESS(f"Archived {sum(results.values())} visits."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.query_plans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot queries and fail if any of them falls back to a full table scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="各クエリの実行計画をすべて表示する")
+
+    def handle(self, *args, **options):
+        failures = []
+        for result in check_query_plans():
+            if result["full_scans"]:
+                failures.append(result["name"])
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {result['name']}: {', '.join(result['full_scans'])}"))
+            else:
+                self.stdout.write(f"ok         {result['name']}")
+            if options["verbose_plans"] or result["full_scans"]:
+                for line in result["plan"].splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries use a full table scan: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("All hot queries use an index."))
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.partitions import UnknownPartition, detach_partition
+
+
+class Command(BaseCommand):
+    help = "Detach a monthly visit partition (the table is kept as api_visit_dYYYYMM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("month", help="切り離す月（YYYY-MM）")
+
+    def handle(self, *args, **options):
+        try:
+            year, month = (int(part) for part in options["month"].split("-"))
+            target = date(year, month, 1)
+        except ValueError:
+            raise CommandError(f"{options['month']} is not a month (YYYY-MM)")
+
+        try:
+            table = detach_partition(target)
+        except UnknownPartition as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Detached {target:%Y-%m} as {table}."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.staff_import import CHUNK_SIZE, ImportFormatError, import_staff_csv
+
+
+class Command(BaseCommand):
+    help = "Import staff from a CSV file (社員番号, 氏名, 氏名カナ, 部署名, 役職)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="取り込むCSVファイル（UTF-8）")
+        parser.add_argument("--dry-run", action="store_true", help="登録せずに検証結果だけを表示する")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="1回に読み込み・登録する行数")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], "rb") as f:
+                summary = import_staff_csv(f, dry_run=options["dry_run"], chunk_size=options["chunk_size"])
+        except (OSError, ImportFormatError) as e:
+            raise CommandError(str(e))
+
+        for error in summary["errors"]:
+            self.stderr.write(f"Line {error['line']} ({error['employee_number']}): {' / '.join(error['errors'])}")
+        if summary["departments_created"]:
+            self.stdout.write(f"departments created: {', '.join(summary['departments_created'])}")
+        self.stdout.write(
+            f"{'[dry-run] ' if summary['dry_run'] else ''}total={summary['total']} "
+            f"created={summary['created']} updated={summary['updated']} skipped={summary['skipped']}"
+        )
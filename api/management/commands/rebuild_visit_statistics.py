@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.visit_statistics import rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = "Rebuild the visit statistics rollup (VisitStatistic) from Visit records"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="作り直す期間の開始日（YYYY-MM-DD）。省略時は全期間")
+        parser.add_argument("--to", dest="date_to", help="作り直す期間の終了日（YYYY-MM-DD）。省略時は全期間")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ("date_from", "date_to"):
+            value = options[option]
+            try:
+                dates[option] = parse_date(value) if value else None
+            except ValueError:
+                dates[option] = None
+            if value and dates[option] is None:
+                raise CommandError(f"{value} is not a date (YYYY-MM-DD)")
+
+        created = rebuild_statistics(dates["date_from"], dates["date_to"])
+        period = f"{dates['date_from'] or ''}〜{dates['date_to'] or ''}" if any(dates.values()) else "all"
+        self.stdout.write(f"Rebuilt visit statistics ({period}): {created} rows.")
@@ -0,0 +1,32 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from api.escalation import RELOAD_SECONDS, EscalationScheduler
+
+
+class Command(BaseCommand):
+    help = "Escalate visits whose staff did not respond in time (Visit.escalation_due_at)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reload-interval", type=float, default=RELOAD_SECONDS, help="DBから期限を読み直す秒数")
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options["reload_interval"]))
+
+    async def serve(self, reload_interval):
+        scheduler = EscalationScheduler(reload_seconds=reload_interval)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, scheduler.stop)
+
+        self.stdout.write(f"Escalation scheduler started (reload every {reload_interval}s).")
+        await scheduler.run(on_escalated=self.report)
+        self.stdout.write("Escalation scheduler stopped.")
+
+    def report(self, result):
+        self.stdout.write(
+            f"visit={result['visit_id']} level={result['level']} "
+            f"status={result['status']} target={result['target']}"
+        )
@@ -0,0 +1,52 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.notifications import BATCH_SIZE, CONCURRENCY, POLL_INTERVAL, create_session, deliver_due_notifications
+
+
+class Command(BaseCommand):
+    help = "Deliver queued Teams notifications (NotificationOutbox)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="送信時刻を迎えた分だけ配信して終了する")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="1回に確保するキューの件数")
+        parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同時送信数")
+        parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="キューが空のときの待機秒数")
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        concurrency = max(1, options["concurrency"])
+        session = create_session(pool_size=concurrency)
+
+        self.stdout.write(f"Notification worker started (concurrency={concurrency}).")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while self.running:
+                close_old_connections()
+                results = deliver_due_notifications(
+                    session, executor, batch_size=options["batch_size"], concurrency=concurrency
+                )
+                processed = sum(results.values())
+                if processed:
+                    self.stdout.write(
+                        f"sent={results['sent']} retry={results['retry']} "
+                        f"dead={results['dead']} deferred={results['deferred']} lost={results['lost']}"
+                    )
+                # 見送りだけのバッチは送信できる行が無いのと同じ扱い
+                delivered = processed - results["deferred"]
+                if options["once"] and not delivered:
+                    break
+                if not delivered:
+                    time.sleep(options["poll_interval"])
+
+        session.close()
+        self.stdout.write("Notification worker stopped.")
+
+    def stop(self, signum, frame):
+        self.running = False
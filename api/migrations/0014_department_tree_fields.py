@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+def populate_tree_fields(apps, schema_editor):
+    """既存部署の full_name / depth / ancestor_ids をルートから順に埋める"""
+    Department = apps.get_model("api", "Department")
+    separator = " > "
+
+    departments = list(Department.objects.all())
+    children = {}
+    for dept in departments:
+        children.setdefault(dept.parent_id, []).append(dept)
+
+    stack = [(dept, None) for dept in children.get(None, [])]
+    while stack:
+        dept, parent = stack.pop()
+        if parent is None:
+            dept.full_name = dept.name
+            dept.depth = 0
+            dept.ancestor_ids = "/"
+        else:
+            dept.full_name = f"{parent.full_name}{separator}{dept.name}"
+            dept.depth = parent.depth + 1
+            dept.ancestor_ids = f"{parent.ancestor_ids}{parent.pk}/"
+        stack.extend((child, dept) for child in children.get(dept.pk, []))
+
+    Department.objects.bulk_update(departments, ["full_name", "depth", "ancestor_ids"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_department_teams_api_url_alter_staff_photo_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='ancestor_ids',
+            field=models.CharField(blank=True, default='/', editable=False, help_text="ルートから親までの部署IDを '/1/5/' の形式で保持します", max_length=255, verbose_name='上位部署IDパス'),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='階層の深さ'),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='full_name',
+            field=models.CharField(blank=True, editable=False, max_length=500, verbose_name='部署フルパス名'),
+        ),
+        migrations.RunPython(populate_tree_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+from api.kana import to_hiragana
+
+
+def populate_search_fields(apps, schema_editor):
+    """既存社員の name_reading / name_normalized を埋める"""
+    Staff = apps.get_model("api", "Staff")
+    staff_list = list(Staff.objects.only("id", "name", "name_kana"))
+    for staff in staff_list:
+        staff.name_reading = to_hiragana(staff.name_kana)[:100]
+        staff.name_normalized = to_hiragana(staff.name)[:100]
+    Staff.objects.bulk_update(staff_list, ["name_reading", "name_normalized"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_department_tree_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staff',
+            name='name_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='氏名（検索用）'),
+        ),
+        migrations.AddField(
+            model_name='staff',
+            name='name_reading',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='読み（検索用）'),
+        ),
+        migrations.RunPython(populate_search_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_staff_search_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('webhook_url', models.URLField(max_length=500, verbose_name='送信先URL')),
+                ('payload', models.JSONField(verbose_name='送信内容')),
+                ('status', models.CharField(choices=[('pending', '送信待ち'), ('sent', '送信済み'), ('dead', '送信失敗（再送打ち切り）')], default='pending', max_length=20, verbose_name='状態')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='送信試行回数')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='次回送信予定')),
+                ('last_error', models.TextField(blank=True, verbose_name='最終エラー')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='送信日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('visit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notifications', to='api.visit', verbose_name='来訪')),
+            ],
+            options={
+                'verbose_name': '通知送信キュー',
+                'verbose_name_plural': '通知送信キュー',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='api_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='staff',
+            name='email',
+        ),
+        migrations.RemoveField(
+            model_name='staff',
+            name='phone',
+        ),
+    ]
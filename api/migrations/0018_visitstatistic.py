@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:40
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Coalesce, ExtractHour, TruncDate
+from django.utils import timezone
+
+
+def populate_statistics(apps, schema_editor):
+    """既存の来訪記録から集計表を作る（日付・時間帯は TIME_ZONE のローカル時刻）"""
+    Visit = apps.get_model("api", "Visit")
+    VisitStatistic = apps.get_model("api", "VisitStatistic")
+    tz = timezone.get_current_timezone()
+    rows = (
+        Visit.objects.annotate(
+            stat_date=TruncDate("visited_at", tzinfo=tz),
+            stat_hour=ExtractHour("visited_at", tzinfo=tz),
+            stat_staff_id=Coalesce("staff_id", 0),
+        )
+        .values("stat_date", "stat_hour", "visit_type", "status", "stat_staff_id")
+        .annotate(stat_count=Count("id"))
+        .order_by()
+    )
+    VisitStatistic.objects.bulk_create(
+        [
+            VisitStatistic(
+                date=row["stat_date"], hour=row["stat_hour"], visit_type=row["visit_type"] or "",
+                status=row["status"] or "", staff_id=row["stat_staff_id"], count=row["stat_count"],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_remove_staff_email_phone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='来訪日')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='時間帯')),
+                ('visit_type', models.CharField(max_length=20, verbose_name='来訪種別')),
+                ('status', models.CharField(max_length=20, verbose_name='ステータス')),
+                ('staff_id', models.IntegerField(default=0, verbose_name='担当者ID')),
+                ('count', models.IntegerField(default=0, verbose_name='件数')),
+            ],
+            options={
+                'verbose_name': '来訪集計',
+                'verbose_name_plural': '来訪集計',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='visitstatistic',
+            constraint=models.UniqueConstraint(fields=('date', 'hour', 'visit_type', 'status', 'staff_id'), name='api_visitstatistic_key'),
+        ),
+        migrations.RunPython(populate_statistics, migrations.RunPython.noop),
+    ]
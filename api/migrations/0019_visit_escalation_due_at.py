@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_visitstatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='escalation_due_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='次回エスカレーション予定'),
+        ),
+    ]
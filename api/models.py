@@ -1,7 +1,14 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils import timezone
 
+from .kana import to_hiragana
+
 class Department(models.Model):
+    # 部署フルパス名の区切り文字（例：本部 > 部 > 課）
+    FULL_NAME_SEPARATOR = " > "
+    PARENT_CYCLE_MESSAGE = "自身または配下の部署を親部署に指定することはできません。"
+
     DEPARTMENT_TYPES = [
         ("headquarters", "本部"),
         ("department", "部"),
@@ -22,16 +29,114 @@ class Department(models.Model):
         help_text="この部署に通知を飛ばすTeamsチャネルのAPI URLを入力してください"
     )
     order = models.IntegerField(default=0, verbose_name="表示順")
+
+    # 階層情報のキャッシュ（save() 時に自動更新されるため直接編集しない）
+    full_name = models.CharField(max_length=500, blank=True, editable=False, verbose_name="部署フルパス名")
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="階層の深さ")
+    ancestor_ids = models.CharField(
+        max_length=255, blank=True, default="/", editable=False, verbose_name="上位部署IDパス",
+        help_text="ルートから親までの部署IDを '/1/5/' の形式で保持します"
+    )
+
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
     def __str__(self):
         return self.name
 
+    @property
+    def ancestor_id_list(self):
+        """ルート側から並んだ上位部署IDのリスト（自身は含まない）"""
+        return [int(pk) for pk in self.ancestor_ids.strip("/").split("/") if pk]
+
+    @property
+    def descendant_path(self):
+        """子孫部署の ancestor_ids が必ず含む部分文字列"""
+        return f"/{self.pk}/"
+
+    def get_descendants(self, include_self=False):
+        """配下の全部署を1クエリで取得"""
+        query = models.Q(ancestor_ids__contains=self.descendant_path)
+        if include_self:
+            query |= models.Q(pk=self.pk)
+        return Department.objects.filter(query)
+
+    def _apply_tree_fields(self, parent):
+        """親部署の階層情報から自身の full_name / depth / ancestor_ids を算出"""
+        if parent is None:
+            self.full_name = self.name
+            self.depth = 0
+            self.ancestor_ids = "/"
+        else:
+            self.full_name = f"{parent.full_name}{self.FULL_NAME_SEPARATOR}{self.name}"
+            self.depth = parent.depth + 1
+            self.ancestor_ids = f"{parent.ancestor_ids}{parent.pk}/"
+
+    def creates_cycle(self, parent_id):
+        """parent_id を親にすると循環するか（自分自身・配下の部署。親の階層情報は DB から読む）"""
+        if not (self.pk and parent_id):
+            return False
+        if parent_id == self.pk:
+            return True
+        ancestor_ids = Department.objects.filter(pk=parent_id).values_list("ancestor_ids", flat=True).first()
+        return self.descendant_path in (ancestor_ids or "")
+
+    def clean(self):
+        super().clean()
+        # 自分自身や配下の部署を親に指定すると循環してしまうため禁止
+        if self.creates_cycle(self.parent_id):
+            raise ValidationError({"parent": self.PARENT_CYCLE_MESSAGE})
+
+    def save(self, *args, **kwargs):
+        # clean() を通らない保存（API・インポート等）でも循環を作らない
+        if self.creates_cycle(self.parent_id):
+            raise ValidationError({"parent": self.PARENT_CYCLE_MESSAGE})
+
+        old_tree = None
+        if self.pk:
+            old_tree = (
+                Department.objects.filter(pk=self.pk)
+                .values_list("full_name", "ancestor_ids")
+                .first()
+            )
+
+        self._apply_tree_fields(self.parent if self.parent_id else None)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"full_name", "depth", "ancestor_ids"}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # 名前または親が変わった場合は配下の部署もまとめて更新
+            if old_tree and old_tree != (self.full_name, self.ancestor_ids):
+                self._sync_descendants()
+
+    def _sync_descendants(self):
+        """配下の部署の階層情報を親から順に再計算し、一括更新する"""
+        descendants = list(self.get_descendants().order_by("depth"))
+        if not descendants:
+            return
+
+        # 部署の相対的な親子関係は変わらないため、旧 depth 順に処理すれば親が必ず先に確定する
+        nodes = {self.pk: self}
+        for dept in descendants:
+            dept._apply_tree_fields(nodes[dept.parent_id])
+            nodes[dept.pk] = dept
+
+        Department.objects.bulk_update(
+            descendants, ["full_name", "depth", "ancestor_ids"], batch_size=500
+        )
+
     class Meta:
         db_table = "api_department"  
         verbose_name = "部署"
         verbose_name_plural = "部署一覧"
+        indexes = [
+            # 受付画面の部署一覧（部署タイプで絞って表示順に並べる）
+            models.Index(fields=["department_type", "order"], name="api_dept_type_order_idx"),
+            # 子部署の一覧（親部署で絞って表示順に並べる）
+            models.Index(fields=["parent", "order"], name="api_dept_parent_order_idx"),
+        ]
 
 
 class Staff(models.Model):
@@ -41,15 +146,36 @@ class Staff(models.Model):
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, verbose_name="部署")
     position = models.CharField(max_length=100, blank=True, verbose_name="役職")
     photo_url = models.ImageField(upload_to='staff_photos/', blank=True, null=True, verbose_name="写真")
+
+    # 検索用の正規化済み文字列（save() 時に自動更新されるため直接編集しない）
+    name_reading = models.CharField(max_length=100, blank=True, db_index=True, editable=False, verbose_name="読み（検索用）")
+    name_normalized = models.CharField(max_length=100, blank=True, db_index=True, editable=False, verbose_name="氏名（検索用）")
+
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
     def __str__(self):
         return self.name
 
+    def apply_search_fields(self):
+        """氏名・カナから検索用の正規化済み文字列を算出"""
+        self.name_reading = to_hiragana(self.name_kana)[:100]
+        self.name_normalized = to_hiragana(self.name)[:100]
+
+    def save(self, *args, **kwargs):
+        self.apply_search_fields()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"name_reading", "name_normalized"}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "社員"
         verbose_name_plural = "社員一覧"
+        indexes = [
+            # 部署ごとの社員一覧（氏名順）
+            models.Index(fields=["department", "name"], name="api_staff_dept_name_idx"),
+        ]
 
 
 class Visit(models.Model):
@@ -91,6 +217,8 @@ class Visit(models.Model):
     response_time = models.DateTimeField(null=True, blank=True, verbose_name="対応時間")
 
     escalation_level = models.IntegerField(default=0, verbose_name="エスカレーションレベル")
+    # 次にエスカレーションする時刻（応答待ちの間だけ設定。run_escalations が監視する）
+    escalation_due_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name="次回エスカレーション予定")
     notified_staff = models.ManyToManyField(
         Staff, related_name="notified_visits", blank=True, verbose_name="通知対象スタッフ"
     )
@@ -105,6 +233,114 @@ class Visit(models.Model):
     class Meta:
         verbose_name = "来訪"
         verbose_name_plural = "来訪記録"
+        indexes = [
+            # 来訪一覧（新しい順）・期間指定の CSV 出力と集計
+            models.Index(fields=["visited_at"], name="api_visit_visited_idx"),
+            # ステータス別・担当者別の来訪一覧（新しい順）
+            models.Index(fields=["status", "visited_at"], name="api_visit_status_visited_idx"),
+            models.Index(fields=["staff", "visited_at"], name="api_visit_staff_visited_idx"),
+            # 応答待ちのエスカレーション期限（run_escalations が定期的に読み直す）
+            models.Index(fields=["status", "escalation_due_at"], name="api_visit_status_due_idx"),
+        ]
+
+
+class ArchivedVisitBase(models.Model):
+    """
+    月別パーティションへ移した来訪の列構成（api.partitions がテーブルを作成・参照する）
+
+    担当者は外部キーにせず、移した時点の社員番号・氏名・部署名を一緒に残す
+    （担当者が退職・削除されても過去の記録として読めるように）。
+    """
+    id = models.BigIntegerField(primary_key=True)
+    visit_type = models.CharField(max_length=20, verbose_name="来訪種別")
+    visitor_company = models.CharField(max_length=200, verbose_name="会社名")
+    visitor_name = models.CharField(max_length=100, verbose_name="来訪者名")
+    staff_id = models.BigIntegerField(null=True, verbose_name="担当者ID")
+    staff_employee_number = models.CharField(max_length=20, blank=True, verbose_name="担当者社員番号")
+    staff_name = models.CharField(max_length=100, blank=True, verbose_name="担当者")
+    department_name = models.CharField(max_length=100, blank=True, verbose_name="部署名")
+    status = models.CharField(max_length=20, verbose_name="ステータス")
+    purpose = models.TextField(blank=True, verbose_name="来訪目的")
+    purpose_type = models.CharField(max_length=100, blank=True, verbose_name="目的タイプ")
+    purpose_preset = models.CharField(max_length=200, blank=True, verbose_name="用件（選択肢）")
+    purpose_custom = models.TextField(blank=True, verbose_name="用件（自由入力）")
+    response_message = models.TextField(blank=True, verbose_name="対応メッセージ")
+    response_time = models.DateTimeField(null=True, verbose_name="対応時間")
+    escalation_level = models.IntegerField(default=0, verbose_name="エスカレーションレベル")
+    # 通知対象スタッフのIDを '/1/5/' の形式で保持
+    notified_staff_ids = models.TextField(blank=True, default="/", verbose_name="通知対象スタッフID")
+    visited_at = models.DateTimeField(verbose_name="来訪日時")
+    created_at = models.DateTimeField(verbose_name="作成日時")
+    updated_at = models.DateTimeField(verbose_name="更新日時")
+
+    class Meta:
+        abstract = True
+
+
+class NotificationOutbox(models.Model):
+    """
+    Teams 通知の送信待ちキュー（トランザクショナル・アウトボックス）
+
+    来訪の保存と同じトランザクションで書き込み、送信は
+    ASGI サーバー内の配信タスク（api.lifespan）または `python manage.py send_notifications` が行う。
+    """
+    STATUS_CHOICES = [
+        ("pending", "送信待ち"),
+        ("sent", "送信済み"),
+        ("dead", "送信失敗（再送打ち切り）"),
+    ]
+
+    visit = models.ForeignKey(
+        Visit, null=True, blank=True, on_delete=models.SET_NULL, related_name="notifications", verbose_name="来訪"
+    )
+    webhook_url = models.URLField(max_length=500, verbose_name="送信先URL")
+    payload = models.JSONField(verbose_name="送信内容")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending", verbose_name="状態")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="送信試行回数")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="次回送信予定")
+    last_error = models.TextField(blank=True, verbose_name="最終エラー")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="送信日時")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    def __str__(self):
+        return f"{self.webhook_url} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "通知送信キュー"
+        verbose_name_plural = "通知送信キュー"
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="api_outbox_due_idx"),
+        ]
+
+
+class VisitStatistic(models.Model):
+    """
+    来訪件数の集計表（日付・時間帯・来訪種別・ステータス・担当者ごとの件数）
+
+    Visit の保存・削除時にシグナルで差分だけ加減算する。
+    /api/visits/statistics/ はこの表だけを読むため、Visit が増えても集計は速い。
+    作り直しは `python manage.py rebuild_visit_statistics`。
+    """
+    date = models.DateField(verbose_name="来訪日")
+    hour = models.PositiveSmallIntegerField(verbose_name="時間帯")
+    visit_type = models.CharField(max_length=20, verbose_name="来訪種別")
+    status = models.CharField(max_length=20, verbose_name="ステータス")
+    # 担当者が削除されても集計は残すため外部キーにしない（0 は担当者なし）
+    staff_id = models.IntegerField(default=0, verbose_name="担当者ID")
+    count = models.IntegerField(default=0, verbose_name="件数")
+
+    def __str__(self):
+        return f"{self.date} {self.hour}時 {self.visit_type}/{self.status}: {self.count}"
+
+    class Meta:
+        verbose_name = "来訪集計"
+        verbose_name_plural = "来訪集計"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "hour", "visit_type", "status", "staff_id"], name="api_visitstatistic_key"
+            ),
+        ]
 
 
 class SystemSetting(models.Model):
@@ -118,10 +354,9 @@ class SystemSetting(models.Model):
 
     @staticmethod
     def get_setting(key, default=None):
-        try:
-            return SystemSetting.objects.get(key=key).value
-        except SystemSetting.DoesNotExist:
-            return default
+        # 全設定を1クエリで読み込んだプロセス内キャッシュから返す
+        from .system_settings import get_setting
+        return get_setting(key, default)
 
     class Meta:
         verbose_name = "システム設定"
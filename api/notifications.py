@@ -0,0 +1,285 @@
+"""
+Teams 通知の作成と配信
+
+- enqueue_teams_notification(): 来訪保存と同じトランザクション内で送信キューに積む
+- deliver_due_notifications(): 送信時刻を迎えたキューをまとめて配信する
+  （ASGI サーバー内の配信タスク api.lifespan、または send_notifications コマンドから呼ぶ）
+
+配信はプールされた requests.Session を使い、同時送信数を制限したうえで
+失敗時は指数バックオフで再送、上限回数を超えたものは dead にする。
+送信先 URL ごとのブレーカー・レート制限（api.webhook_health）で見送ったものは
+試行回数を消費せずに後ろ倒しする。
+"""
+import math
+import random
+from concurrent.futures import as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from . import webhook_health
+from .models import NotificationOutbox
+
+TEAMS_TIMEOUT = getattr(settings, "TEAMS_NOTIFICATION_TIMEOUT", 5)
+MAX_ATTEMPTS = getattr(settings, "TEAMS_NOTIFICATION_MAX_ATTEMPTS", 8)
+BACKOFF_BASE = getattr(settings, "TEAMS_NOTIFICATION_BACKOFF_BASE", 2)
+BACKOFF_MAX = getattr(settings, "TEAMS_NOTIFICATION_BACKOFF_MAX", 600)
+BATCH_SIZE = getattr(settings, "TEAMS_NOTIFICATION_BATCH_SIZE", 50)
+CONCURRENCY = getattr(settings, "TEAMS_NOTIFICATION_CONCURRENCY", 4)
+POLL_INTERVAL = getattr(settings, "TEAMS_NOTIFICATION_POLL_INTERVAL", 1.0)
+# 1件の送信にかかる最大秒数（接続・応答待ちのそれぞれに TEAMS_TIMEOUT）
+SEND_SECONDS = TEAMS_TIMEOUT * 2
+
+# 再送しても結果が変わらない HTTP ステータス（408/429 以外の 4xx）
+RETRYABLE_CLIENT_ERRORS = {408, 429}
+
+
+def lease_seconds(batch_size, concurrency=1):
+    """
+    確保した行を他ワーカーに取られないよう次回送信予定を先送りする秒数
+    concurrency 件ずつ送ってバッチ全体を送り終えるまでの最大時間（＋1件分の余裕）
+    """
+    return (math.ceil(batch_size / max(1, concurrency)) + 1) * SEND_SECONDS
+
+
+class LeaseExpired(Exception):
+    """確保した lease の残りが1件の送信時間に満たない（他ワーカーが取り直す可能性があるので送らない）"""
+
+
+class DeliveryError(Exception):
+    """配信失敗。permanent=True なら再送しない"""
+
+    def __init__(self, message, permanent=False, retry_after=None, status_code=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+    @property
+    def trips_breaker(self):
+        """送信先の障害とみなすか（レート制限・宛先不正はブレーカーの失敗に数えない）"""
+        return not self.permanent and self.status_code != 429
+
+
+def build_teams_payload(visit, note=""):
+    """
+    TeamsチャネルへのAdaptive Card形式の通知内容
+    note: エスカレーション時など、本文の先頭に添える一文
+    """
+    local_time = timezone.localtime(visit.visited_at).strftime('%H:%M')
+    # 担当者を選ばずに総務へ回った来訪もある
+    staff_line = f"担当: **{visit.staff.name}** さん" if visit.staff else "担当: **未割り当て**"
+
+    payload = {
+        "type": "message",
+        "attachments": [{
+            "contentType": "application/vnd.microsoft.card.adaptive",
+            "content": {
+                "type": "AdaptiveCard",
+                "version": "1.4",
+                "body": [
+                    {"type": "TextBlock", "text": "🔔 来客通知", "weight": "Bolder", "size": "Large", "color": "Attention"},
+                    {"type": "TextBlock", "text": staff_line, "wrap": True},
+                    {"type": "FactSet", "facts": [
+                        {"title": "会社名:", "value": visit.visitor_company},
+                        {"title": "お客様:", "value": f"{visit.visitor_name} 様"},
+                        {"title": "用件:", "value": visit.purpose_preset or visit.purpose_custom or "なし"},
+                        {"title": "到着:", "value": local_time}
+                    ]}
+                ],
+                "actions": [
+                    {
+                        "type": "Action.OpenUrl",
+                        "title": "管理画面を表示",
+                        "url": f"http://localhost:8000/admin/api/visit/{visit.id}/change/"
+                    }
+                ],
+                "$schema": "http://adaptivecards.io/schemas/adaptive-card.json"
+            }
+        }]
+    }
+    if note:
+        payload["attachments"][0]["content"]["body"].insert(
+            1, {"type": "TextBlock", "text": note, "wrap": True, "color": "Warning"}
+        )
+    return payload
+
+
+def enqueue_teams_notification(visit, department=None, note=""):
+    """
+    部署（省略時は担当者の部署）に Teams API URL があれば送信キューに積む
+    呼び出し側のトランザクション内で実行すること（来訪と通知が必ずセットで保存される）
+    """
+    if department is None:
+        department = visit.staff.department if visit.staff else None
+    if not department or not department.teams_api_url:
+        return None
+    return NotificationOutbox.objects.create(
+        visit=visit,
+        webhook_url=department.teams_api_url,
+        payload=build_teams_payload(visit, note),
+    )
+
+
+def create_session(pool_size=10):
+    """接続を使い回すための requests.Session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def send_teams_notification(session, webhook_url, payload):
+    """Teams Webhook へ1件送信する。失敗時は DeliveryError を送出"""
+    try:
+        response = session.post(webhook_url, json=payload, timeout=TEAMS_TIMEOUT)
+    except requests.RequestException as e:
+        raise DeliveryError(f"{type(e).__name__}: {e}")
+
+    if response.status_code < 300:
+        return response
+
+    message = f"HTTP {response.status_code}: {response.text[:200]}"
+    permanent = 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS
+    raise DeliveryError(
+        message,
+        permanent=permanent,
+        retry_after=parse_retry_after(response),
+        status_code=response.status_code,
+    )
+
+
+def parse_retry_after(response):
+    """Retry-After ヘッダー（秒数）を読み取る"""
+    value = response.headers.get("Retry-After", "")
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def backoff_seconds(attempts, retry_after=None):
+    """指数バックオフ（ジッター付き）。Retry-After があればそれ以上待つ"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+    delay = delay * random.uniform(0.5, 1.0)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def claim_due_notifications(limit, concurrency=1):
+    """
+    送信時刻を迎えたキューを最大 limit 件確保する
+
+    next_attempt_at を条件付きで先送りすることで、複数ワーカーが
+    同じ行を同時に送らないようにする（ワーカーが落ちても lease 経過後に再取得される）。
+    返す行の next_attempt_at が lease の期限で、結果の記録はこの値が変わっていない行にだけ行う。
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=lease_seconds(limit, concurrency))
+    candidates = list(
+        NotificationOutbox.objects.filter(status="pending", next_attempt_at__lte=now)
+        .order_by("next_attempt_at")
+        .values_list("id", "next_attempt_at")[:limit]
+    )
+
+    claimed = []
+    for pk, next_attempt_at in candidates:
+        updated = NotificationOutbox.objects.filter(
+            pk=pk, status="pending", next_attempt_at=next_attempt_at
+        ).update(next_attempt_at=lease_until, attempts=F("attempts") + 1)
+        if updated:
+            claimed.append(pk)
+    return list(NotificationOutbox.objects.filter(pk__in=claimed))
+
+
+def _claimed(item):
+    """確保したときの lease が続いている行（lease 切れで他ワーカーに取り直されていれば空）"""
+    return NotificationOutbox.objects.filter(pk=item.pk, status="pending", next_attempt_at=item.next_attempt_at)
+
+
+def _record_success(item):
+    now = timezone.now()
+    if not _claimed(item).update(status="sent", sent_at=now, last_error="", updated_at=now):
+        return "lost"
+    return "sent"
+
+
+def _record_failure(item, error):
+    now = timezone.now()
+    if error.permanent or item.attempts >= MAX_ATTEMPTS:
+        if not _claimed(item).update(status="dead", last_error=str(error), updated_at=now):
+            return "lost"
+        return "dead"
+
+    next_attempt_at = now + timedelta(seconds=backoff_seconds(item.attempts, error.retry_after))
+    if not _claimed(item).update(next_attempt_at=next_attempt_at, last_error=str(error), updated_at=now):
+        return "lost"
+    return "retry"
+
+
+def _record_deferred(item, wait):
+    """ブレーカー・レート制限・lease 切れで見送った分は試行回数を戻して後ろ倒しする"""
+    now = timezone.now()
+    if not _claimed(item).update(
+        next_attempt_at=now + timedelta(seconds=wait), attempts=F("attempts") - 1, updated_at=now
+    ):
+        return "lost"
+    return "deferred"
+
+
+def _attempt(session, item):
+    """HTTP送信のみを行う（スレッドプール上で実行。DBには触れない）"""
+    if timezone.now() + timedelta(seconds=SEND_SECONDS) > item.next_attempt_at:
+        return LeaseExpired()
+    try:
+        send_teams_notification(session, item.webhook_url, item.payload)
+    except DeliveryError as e:
+        return e
+    return None
+
+
+def deliver_due_notifications(session, executor, batch_size=BATCH_SIZE, concurrency=1):
+    """
+    送信時刻を迎えたキューを最大 batch_size 件配信する
+    同時送信数は executor（ThreadPoolExecutor）のスレッド数で制限し、concurrency にはそのスレッド数を渡す
+    （lease の長さの計算に使う）。結果の記録は送信が終わった順に呼び出し元スレッドで行う
+    戻り値: {"sent": n, "retry": n, "dead": n, "deferred": n, "lost": n}
+    lost は lease が切れて他ワーカーに取り直されたため結果を記録しなかった件数
+    """
+    results = {"sent": 0, "retry": 0, "dead": 0, "deferred": 0, "lost": 0}
+
+    # 送信先が open 中・レート超過のものは HTTP を行わずに見送る
+    ready = []
+    for item in claim_due_notifications(batch_size, concurrency):
+        wait = webhook_health.before_send(item.webhook_url)
+        if wait > 0:
+            results[_record_deferred(item, wait)] += 1
+        else:
+            ready.append(item)
+
+    futures = {executor.submit(_attempt, session, item): item for item in ready}
+    for future in as_completed(futures):
+        item, error = futures[future], future.result()
+        if isinstance(error, LeaseExpired):
+            outcome = _record_deferred(item, 0)
+        elif error is None:
+            webhook_health.record_success(item.webhook_url)
+            outcome = _record_success(item)
+        else:
+            webhook_health.record_failure(item.webhook_url, retry_after=error.retry_after, trip=error.trips_breaker)
+            outcome = _record_failure(item, error)
+        results[outcome] += 1
+    return results
+
+
+def retry_dead_notifications(queryset):
+    """dead になったキューを送信待ちに戻す（管理画面の再送アクション用）"""
+    return queryset.filter(status="dead").update(
+        status="pending", attempts=0, next_attempt_at=timezone.now(), last_error=""
+    )
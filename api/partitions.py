@@ -0,0 +1,306 @@
+"""
+来訪記録の月別パーティション
+
+Visit（api_visit）には直近 VISIT_HOT_MONTHS か月分だけを置き、それより古い月は
+`python manage.py archive_visits` で月別のパーティションへ移す。受付端末の書き込みや
+直近の一覧・管理画面は小さいまま保たれる。
+
+- PostgreSQL: api_visit_archive を visited_at の RANGE で分割したネイティブパーティション
+  （api_visit_pYYYYMM）。期間指定の検索はプランナーが該当月だけを読む
+- SQLite   : 月ごとの独立したテーブル（api_visit_pYYYYMM）。visit_querysets() が期間に
+  重なる月のテーブルだけを選ぶ
+
+古い月は detach_partition() で切り離す（PostgreSQL は DETACH PARTITION、SQLite はテーブル名の
+変更のみで、行のコピー・削除は行わない）。切り離したテーブルは api_visit_dYYYYMM として残るので、
+退避後に DROP する。集計表（VisitStatistic）の件数は移動・切り離しの影響を受けない。
+
+api_visit 自体をパーティション化しないのは、PostgreSQL ではパーティションキーを主キーに含める
+必要があり、通知キュー・通知対象スタッフからの外部キーを張れなくなるため。
+"""
+import re
+from datetime import date, datetime, time
+
+from django.apps.registry import Apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from .models import ArchivedVisitBase, NotificationOutbox, Visit
+
+# api_visit に残す月数（今月を含む）
+HOT_MONTHS = getattr(settings, "VISIT_HOT_MONTHS", 3)
+# 1回のトランザクションで移す行数
+ARCHIVE_BATCH_SIZE = getattr(settings, "VISIT_ARCHIVE_BATCH_SIZE", 1000)
+
+ARCHIVE_TABLE = "api_visit_archive"
+PARTITION_PREFIX = "api_visit_p"
+DETACHED_PREFIX = "api_visit_d"
+PARTITION_PATTERN = re.compile(rf"^{PARTITION_PREFIX}(\d{{4}})(\d{{2}})$")
+
+# パーティションのモデルはグローバルなアプリ登録（マイグレーション・管理画面）に載せない
+archive_apps = Apps()
+_archive_models = {}
+
+
+class UnknownPartition(ValueError):
+    """指定した月のパーティションが無い"""
+
+
+def month_start(value):
+    """日付・日時（ローカル時刻）の月初日"""
+    if isinstance(value, datetime):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """月の来訪日時の範囲 [start, end)（ローカル時刻の月初で区切る）"""
+    return (
+        timezone.make_aware(datetime.combine(month, time.min)),
+        timezone.make_aware(datetime.combine(add_months(month, 1), time.min)),
+    )
+
+
+def partition_table(month):
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def uses_native_partitions(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == "postgresql"
+
+
+def archive_model(table):
+    """パーティション（または親テーブル）を読み書きするモデル"""
+    model = _archive_models.get(table)
+    if model is None:
+        meta = type("Meta", (), {"db_table": table, "managed": False, "apps": archive_apps, "app_label": "api"})
+        name = "ArchivedVisit_" + table
+        model = type(name, (ArchivedVisitBase,), {"__module__": __name__, "Meta": meta})
+        _archive_models[table] = model
+    return model
+
+
+def _columns_sql(connection, model):
+    quote = connection.ops.quote_name
+    return ", ".join(
+        f"{quote(field.column)} {field.db_type(connection)}{'' if field.null else ' NOT NULL'}"
+        for field in model._meta.local_fields
+    )
+
+
+def ensure_partition(month, using=DEFAULT_DB_ALIAS):
+    """月のパーティションが無ければ作る"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = partition_table(month)
+    model = archive_model(table)
+
+    with connection.cursor() as cursor:
+        if uses_native_partitions(using):
+            # 主キーにパーティションキー（visited_at）を含める必要がある
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(ARCHIVE_TABLE)} ({_columns_sql(connection, model)}, "
+                f"PRIMARY KEY (id, visited_at)) PARTITION BY RANGE (visited_at)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote(ARCHIVE_TABLE + '_visited_at')} "
+                f"ON {quote(ARCHIVE_TABLE)} (visited_at)"
+            )
+            start, end = month_bounds(month)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(table)} PARTITION OF {quote(ARCHIVE_TABLE)} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        else:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(table)} ({_columns_sql(connection, model)}, PRIMARY KEY (id))"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {quote(table + '_visited_at')} ON {quote(table)} (visited_at)")
+    return table
+
+
+def partition_months(using=DEFAULT_DB_ALIAS):
+    """接続中（切り離していない）パーティションの月の一覧（古い順）"""
+    months = []
+    for table in connections[using].introspection.table_names():
+        match = PARTITION_PATTERN.match(table)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def visit_querysets(start=None, end=None, using=DEFAULT_DB_ALIAS):
+    """
+    来訪日時が [start, end) の来訪を読む QuerySet の一覧（パーティション→api_visit の順）
+    パーティションのモデルは ArchivedVisitBase の列を持つ（担当者は名前等を直接持つ）
+    """
+    def bounded(queryset):
+        if start:
+            queryset = queryset.filter(visited_at__gte=start)
+        if end:
+            queryset = queryset.filter(visited_at__lt=end)
+        return queryset
+
+    querysets = []
+    months = partition_months(using)
+    if months:
+        if uses_native_partitions(using):
+            # 該当月の絞り込みは PostgreSQL のパーティションプルーニングに任せる
+            querysets.append(bounded(archive_model(ARCHIVE_TABLE).objects.using(using).all()))
+        else:
+            first = month_start(start) if start else None
+            for month in months:
+                if (first and month < first) or (end and month_bounds(month)[0] >= end):
+                    continue
+                querysets.append(bounded(archive_model(partition_table(month)).objects.using(using).all()))
+    querysets.append(bounded(Visit.objects.using(using).all()))
+    return querysets
+
+
+def find_archived_visit(pk, using=DEFAULT_DB_ALIAS):
+    """パーティションへ移した来訪を ID で探す（無ければ None）"""
+    if uses_native_partitions(using):
+        tables = [ARCHIVE_TABLE] if partition_months(using) else []
+    else:
+        tables = [partition_table(month) for month in reversed(partition_months(using))]
+    for table in tables:
+        visit = archive_model(table).objects.using(using).filter(id=pk).first()
+        if visit is not None:
+            return visit
+    return None
+
+
+def hot_cutoff(keep_months=None, now=None):
+    """これより前の来訪をパーティションへ移す（keep_months か月前の月初）"""
+    keep_months = HOT_MONTHS if keep_months is None else keep_months
+    this_month = month_start(now or timezone.now())
+    return month_bounds(add_months(this_month, 1 - max(keep_months, 1)))[0]
+
+
+ARCHIVE_SOURCE_FIELDS = (
+    "id", "visit_type", "visitor_company", "visitor_name", "staff_id",
+    "staff__employee_number", "staff__name", "staff__department__name", "status",
+    "purpose", "purpose_type", "purpose_preset", "purpose_custom",
+    "response_message", "response_time", "escalation_level",
+    "visited_at", "created_at", "updated_at",
+)
+
+
+def _archive_rows(visits, notified):
+    for visit in visits:
+        staff_ids = notified.get(visit["id"], [])
+        yield {
+            "id": visit["id"],
+            "visit_type": visit["visit_type"],
+            "visitor_company": visit["visitor_company"],
+            "visitor_name": visit["visitor_name"],
+            "staff_id": visit["staff_id"],
+            "staff_employee_number": visit["staff__employee_number"] or "",
+            "staff_name": visit["staff__name"] or "",
+            "department_name": visit["staff__department__name"] or "",
+            "status": visit["status"],
+            "purpose": visit["purpose"],
+            "purpose_type": visit["purpose_type"],
+            "purpose_preset": visit["purpose_preset"],
+            "purpose_custom": visit["purpose_custom"],
+            "response_message": visit["response_message"],
+            "response_time": visit["response_time"],
+            "escalation_level": visit["escalation_level"],
+            "notified_staff_ids": "/" + "".join(f"{pk}/" for pk in sorted(staff_ids)),
+            "visited_at": visit["visited_at"],
+            "created_at": visit["created_at"],
+            "updated_at": visit["updated_at"],
+        }
+
+
+def archive_month(month, using=DEFAULT_DB_ALIAS, batch_size=None):
+    """
+    api_visit の指定月の来訪をパーティションへ移す（ARCHIVE_BATCH_SIZE 行ずつのトランザクション）
+    保存・削除シグナルは送らないため、集計表の件数はそのまま残る
+    戻り値: 移した行数
+    """
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    start, end = month_bounds(month)
+    table = ensure_partition(month, using)
+    target = archive_model(ARCHIVE_TABLE if uses_native_partitions(using) else table)
+    through = Visit.notified_staff.through
+    connection = connections[using]
+    quote = connection.ops.quote_name
+
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            visits = list(
+                Visit.objects.using(using)
+                .filter(visited_at__gte=start, visited_at__lt=end)
+                .order_by("id")
+                .values(*ARCHIVE_SOURCE_FIELDS)[:batch_size]
+            )
+            if not visits:
+                break
+            ids = [visit["id"] for visit in visits]
+            notified = {}
+            for visit_id, staff_id in through.objects.using(using).filter(visit_id__in=ids).values_list(
+                "visit_id", "staff_id"
+            ):
+                notified.setdefault(visit_id, []).append(staff_id)
+
+            target.objects.using(using).bulk_create(
+                [target(**row) for row in _archive_rows(visits, notified)], ignore_conflicts=True
+            )
+            through.objects.using(using).filter(visit_id__in=ids).delete()
+            NotificationOutbox.objects.using(using).filter(visit_id__in=ids).update(visit=None)
+            # Visit.delete() は集計表を減らすシグナルが走るため SQL で直接消す
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {quote(Visit._meta.db_table)} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+                )
+        moved += len(visits)
+    return moved
+
+
+def archive_visits(keep_months=None, using=DEFAULT_DB_ALIAS):
+    """
+    直近 keep_months か月より前の来訪を月ごとにパーティションへ移す
+    戻り値: {月初日: 移した行数}
+    """
+    cutoff = hot_cutoff(keep_months)
+    oldest = Visit.objects.using(using).filter(visited_at__lt=cutoff).order_by("visited_at").values_list(
+        "visited_at", flat=True
+    ).first()
+    if oldest is None:
+        return {}
+
+    results = {}
+    month = month_start(oldest)
+    last = month_start(cutoff)
+    while month < last:
+        start, end = month_bounds(month)
+        if Visit.objects.using(using).filter(visited_at__gte=start, visited_at__lt=end).exists():
+            results[month] = archive_month(month, using)
+        month = add_months(month, 1)
+    return results
+
+
+def detach_partition(month, using=DEFAULT_DB_ALIAS):
+    """
+    月のパーティションを切り離す（行数によらず一定時間）。以後の検索・集計の作り直しには含まれない
+    戻り値: 切り離したテーブル名
+    """
+    table = partition_table(month)
+    if month not in partition_months(using):
+        raise UnknownPartition(f"No visit partition for {month:%Y-%m}")
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    detached = f"{DETACHED_PREFIX}{month:%Y%m}"
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if uses_native_partitions(using):
+            cursor.execute(f"ALTER TABLE {quote(ARCHIVE_TABLE)} DETACH PARTITION {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(detached)}")
+    return detached
@@ -0,0 +1,63 @@
+"""
+担当者の在席（WebSocket 接続）状況
+
+NotificationConsumer（ws/staff/<staff_id>/）の接続中は共有キャッシュ（CACHES）に
+担当者ごとの接続一覧 {channel_name: 有効期限} を置き、全ワーカーから参照できるようにする。
+接続中はハートビートで期限を延ばし、ワーカーが落ちて切断処理が走らなくても
+STAFF_PRESENCE_TTL 秒で自然に不在になる。
+
+- is_online(staff_id): キャッシュ1件の読み込みで判定
+- online_staff_ids(ids): get_many でまとめて判定
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRESENCE_TTL = getattr(settings, "STAFF_PRESENCE_TTL", 60)
+# 接続中の担当者の期限を延ばす間隔（TTL の間に複数回更新する）
+HEARTBEAT_SECONDS = PRESENCE_TTL / 3
+
+
+def presence_key(staff_id):
+    return f"presence:staff:{staff_id}"
+
+
+def _live(connections, now):
+    return {channel: expires for channel, expires in (connections or {}).items() if expires > now}
+
+
+def mark_online(staff_id, channel_name):
+    """接続を登録する（ハートビートでも呼ぶ）"""
+    now = time.time()
+    key = presence_key(staff_id)
+    # 同じ担当者の接続が別ワーカーで同時に更新されると片方が欠けることがあるが、
+    # 次のハートビートで登録し直されるため許容する
+    connections = _live(cache.get(key), now)
+    connections[channel_name] = now + PRESENCE_TTL
+    cache.set(key, connections, PRESENCE_TTL)
+
+
+def mark_offline(staff_id, channel_name):
+    """切断した接続を外す（他の接続が残っていれば在席のまま）"""
+    now = time.time()
+    key = presence_key(staff_id)
+    connections = _live(cache.get(key), now)
+    connections.pop(channel_name, None)
+    if connections:
+        cache.set(key, connections, PRESENCE_TTL)
+    else:
+        cache.delete(key)
+
+
+def is_online(staff_id):
+    return bool(_live(cache.get(presence_key(staff_id)), time.time()))
+
+
+def online_staff_ids(staff_ids):
+    """指定した担当者のうち接続中の ID の集合"""
+    keys = {presence_key(staff_id): staff_id for staff_id in staff_ids}
+    if not keys:
+        return set()
+    now = time.time()
+    return {keys[key] for key, connections in cache.get_many(keys).items() if _live(connections, now)}
@@ -0,0 +1,66 @@
+"""
+よく使うクエリの実行計画の確認（`python manage.py check_query_plans`）
+
+HOT_QUERIES の各クエリに EXPLAIN をかけ、テーブルの全件走査になっているものを報告する。
+- SQLite    : "SCAN <table>"（USING INDEX の無いもの）を全件走査とみなす
+- PostgreSQL: "Seq Scan" を全件走査とみなす。行数が少ないと索引があっても Seq Scan を選ぶため、
+              enable_seqscan を無効にしたトランザクション内で確認する
+"""
+import re
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Department, NotificationOutbox, Staff, Visit, VisitStatistic
+
+SQLITE_FULL_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b.*\bINDEX\b)")
+POSTGRESQL_FULL_SCAN = re.compile(r"\bSeq Scan on (\w+)")
+
+
+def hot_queries():
+    """[(名前, QuerySet), ...]（値は実在しなくてよい。計画だけを見る）"""
+    now = timezone.now()
+    return [
+        ("departments by type", Department.objects.filter(department_type="department").order_by("order")),
+        ("sections of department", Department.objects.filter(parent_id=1, department_type="section").order_by("order")),
+        ("children of department", Department.objects.filter(parent_id=1).order_by("order")),
+        ("staff of department", Staff.objects.filter(department_id=1).order_by("name")),
+        ("staff by employee number", Staff.objects.filter(employee_number="0001")),
+        ("recent visits", Visit.objects.order_by("-visited_at")[:50]),
+        ("visits in period", Visit.objects.filter(
+            visited_at__gte=now - timedelta(days=30), visited_at__lt=now
+        ).order_by("visited_at", "id")),
+        ("visits by status", Visit.objects.filter(status="waiting").order_by("-visited_at")[:50]),
+        ("visits by staff", Visit.objects.filter(staff_id=1).order_by("-visited_at")[:50]),
+        ("escalation deadlines", Visit.objects.filter(status="waiting", escalation_due_at__isnull=False)),
+        ("due notifications", NotificationOutbox.objects.filter(
+            status="pending", next_attempt_at__lte=now
+        ).order_by("next_attempt_at")),
+        ("statistics in period", VisitStatistic.objects.filter(
+            date__gte=(now - timedelta(days=30)).date(), date__lte=now.date()
+        )),
+    ]
+
+
+def full_scans(plan):
+    """実行計画の文字列から全件走査しているテーブル名の一覧"""
+    pattern = POSTGRESQL_FULL_SCAN if connection.vendor == "postgresql" else SQLITE_FULL_SCAN
+    return [match.group(1) for line in plan.splitlines() for match in [pattern.search(line)] if match]
+
+
+def explain(queryset):
+    if connection.vendor != "postgresql":
+        return queryset.explain()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+
+def check_query_plans(queries=None):
+    """[{"name", "plan", "full_scans"}, ...]"""
+    return [
+        {"name": name, "plan": plan, "full_scans": full_scans(plan)}
+        for name, plan in ((name, explain(queryset)) for name, queryset in (queries or hot_queries()))
+    ]
@@ -4,4 +4,5 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r"ws/staff/(?P<staff_id>\w+)/$", consumers.NotificationConsumer.as_asgi()),
     re_path(r"ws/reception/$", consumers.ReceptionConsumer.as_asgi()),
+    re_path(r"ws/reception/(?P<visit_id>\d+)/$", consumers.ReceptionConsumer.as_asgi()),
 ]
@@ -1,29 +1,56 @@
 from rest_framework import serializers
 from .models import Department, Staff, Visit, SystemSetting
 
+def build_children_map(departments):
+    """部署リストから 親ID → 子部署リスト（表示順）の辞書をメモリ上で作る"""
+    children_map = {}
+    for dept in sorted(departments, key=lambda d: (d.order, d.name)):
+        children_map.setdefault(dept.parent_id, []).append(dept)
+    return children_map
+
+
 class DepartmentSerializer(serializers.ModelSerializer):
+    """
+    子部署を children に再帰的に含める
+
+    context:
+        children_map: build_children_map() の結果。指定時は子部署をDBに問い合わせない
+        max_depth: children を展開する最大階層数（0 ならルートのみ）
+    """
     children = serializers.SerializerMethodField()
 
     class Meta:
         model = Department
         fields = '__all__'
 
+    def validate_parent(self, value):
+        # ModelSerializer は Model.clean() を呼ばないため、循環はここで 400 にする
+        if value and self.instance is not None and self.instance.creates_cycle(value.pk):
+            raise serializers.ValidationError(Department.PARENT_CYCLE_MESSAGE)
+        return value
+
     def get_children(self, obj):
-        return DepartmentSerializer(obj.children.order_by('order'), many=True).data
+        level = self.context.get('level', 0)
+        max_depth = self.context.get('max_depth')
+        if max_depth is not None and level >= max_depth:
+            return []
+
+        children_map = self.context.get('children_map')
+        if children_map is None:
+            children = obj.children.order_by('order')
+        else:
+            children = children_map.get(obj.id, [])
+        return DepartmentSerializer(children, many=True, context={**self.context, 'level': level + 1}).data
 
 class StaffSerializer(serializers.ModelSerializer):
     department_name = serializers.CharField(source='department.name', read_only=True)
-
-    class Meta:
-        model = Staff
-        fields = '__all__'
     teams_api_url = serializers.CharField(source='department.teams_api_url', read_only=True)
 
     class Meta:
         model = Staff
         fields = [
             'id', 'employee_number', 'name', 'name_kana', 
-            'department', 'position', 'photo_url', 'teams_api_url'
+            'department', 'department_name', 'position', 'photo_url', 'teams_api_url'
         ]
 
 class VisitSerializer(serializers.ModelSerializer):
@@ -34,6 +61,51 @@ class VisitSerializer(serializers.ModelSerializer):
         model = Visit
         fields = '__all__'
 
+class ArchivedVisitSerializer(serializers.Serializer):
+    """
+    月別パーティションへ移した来訪（api.partitions.archive_model のインスタンス・読み取り専用）
+    VisitSerializer と同じキーに、移した時点の担当者情報と archived=True を加える
+    """
+    id = serializers.IntegerField()
+    visit_type = serializers.CharField()
+    visitor_company = serializers.CharField()
+    visitor_name = serializers.CharField()
+    staff = serializers.IntegerField(source="staff_id", allow_null=True)
+    staff_name = serializers.CharField()
+    staff_employee_number = serializers.CharField()
+    department_name = serializers.CharField()
+    status = serializers.CharField()
+    status_display = serializers.SerializerMethodField()
+    purpose = serializers.CharField()
+    purpose_type = serializers.CharField()
+    purpose_preset = serializers.CharField()
+    purpose_custom = serializers.CharField()
+    response_message = serializers.CharField()
+    response_time = serializers.DateTimeField(allow_null=True)
+    escalation_level = serializers.IntegerField()
+    escalation_due_at = serializers.SerializerMethodField()
+    notified_staff = serializers.SerializerMethodField()
+    visited_at = serializers.DateTimeField()
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
+    archived = serializers.SerializerMethodField()
+
+    STATUS_LABELS = dict(Visit.STATUS_CHOICES)
+
+    def get_status_display(self, obj):
+        return self.STATUS_LABELS.get(obj.status, obj.status)
+
+    def get_escalation_due_at(self, obj):
+        return None
+
+    def get_notified_staff(self, obj):
+        # '/1/5/' → [1, 5]
+        return [int(pk) for pk in obj.notified_staff_ids.split("/") if pk]
+
+    def get_archived(self, obj):
+        return True
+
+
 class SystemSettingSerializer(serializers.ModelSerializer):
     class Meta:
         model = SystemSetting
@@ -0,0 +1,132 @@
+"""
+API と画面の両方から呼ぶ読み取り系サービス
+
+DRF の ViewSet と frontend のJSONエンドポイントが同じ関数を直接呼ぶことで、
+自サーバーへの HTTP 折り返し（localhost:8000/api/...）を行わずに同じJSONを返す。
+"""
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .kana import dakuten_variants, simple_clean, to_hiragana
+from .models import Department, Staff
+from .serializers import DepartmentSerializer, StaffSerializer, build_children_map
+
+
+class InvalidParameter(ValueError):
+    """クエリパラメータが不正"""
+
+
+def _serializer_context(request):
+    # request があれば画像URLなどを絶対URLで返す（API と同じ表現）
+    return {"request": request} if request is not None else {}
+
+
+def parse_depth(value):
+    """?depth= の値を検証して int（未指定なら None）にする"""
+    if value is None:
+        return None
+    try:
+        depth = int(value)
+    except ValueError:
+        depth = -1
+    if depth < 0:
+        raise InvalidParameter("depth must be a non-negative integer")
+    return depth
+
+
+def get_department_tree(root_id=None, depth=None, request=None):
+    """
+    部署の階層構造（DepartmentSerializer 形式）を返す
+    - root_id: 指定部署を起点としたサブツリーを返す（存在しなければ Department.DoesNotExist）
+    - depth: children を展開する階層数（0 ならルートのみ）
+    部署は1クエリでまとめて取得し、ツリーはメモリ上で組み立てる
+    """
+    departments = Department.objects.all()
+    if root_id is not None:
+        root_id = str(root_id)
+        if not root_id.isdigit():
+            raise InvalidParameter("root must be a department id")
+        departments = departments.filter(Q(pk=root_id) | Q(ancestor_ids__contains=f"/{root_id}/"))
+
+    departments = list(departments)
+    children_map = build_children_map(departments)
+
+    if root_id is not None:
+        root_departments = [dept for dept in departments if dept.pk == int(root_id)]
+        if not root_departments:
+            raise Department.DoesNotExist("Department not found")
+    else:
+        root_departments = children_map.get(None, [])
+
+    context = _serializer_context(request)
+    context["children_map"] = children_map
+    context["max_depth"] = depth
+    return DepartmentSerializer(root_departments, many=True, context=context).data
+
+
+def get_department_list(queryset=None, request=None):
+    """部署一覧（各部署の children も1クエリで取得した部署から組み立てる）"""
+    if queryset is None:
+        queryset = Department.objects.all().order_by("order", "name")
+    context = _serializer_context(request)
+    context["children_map"] = build_children_map(Department.objects.all())
+    return DepartmentSerializer(list(queryset), many=True, context=context).data
+
+
+def staff_queryset():
+    """一覧・検索で使う社員の QuerySet（部署名を JOIN で取得）"""
+    return Staff.objects.select_related("department")
+
+
+def get_staff_list(queryset=None, request=None):
+    """社員一覧（StaffSerializer 形式）"""
+    if queryset is None:
+        queryset = staff_queryset().order_by("employee_number")
+    return StaffSerializer(queryset, many=True, context=_serializer_context(request)).data
+
+
+def search_staff(query="", department_id=None, match="", limit=None):
+    """
+    名前、カナ、社員番号によるスタッフ検索（社員のリストを返す）
+    - 検索語はローマ字・カタカナを含めてひらがなに正規化し、保存済みの読みと照合する
+    - 1文字なら前方一致（濁音は清音も候補に含める）、2文字以上は部分一致
+    - match="prefix" で常に前方一致
+    - 完全一致 → 前方一致 → 部分一致 の順に並べる
+    - 読みで1件も見つからないときだけ、氏名・社員番号の部分一致（全件走査）で探し直す
+    """
+    staff = staff_queryset()
+    if department_id:
+        staff = staff.filter(department__id=department_id)
+
+    def limited(queryset):
+        return list(queryset[:int(limit)] if limit else queryset)
+
+    if not query:
+        return limited(staff.order_by("name_reading", "name"))
+
+    term = to_hiragana(query)
+    raw = simple_clean(query)
+    prefix_only = match == "prefix" or len(term) == 1
+
+    exact_q = Q(employee_number=query.strip())
+    prefix_q = Q(employee_number__startswith=query.strip())
+    contains_q = Q()
+    if term:
+        exact_q |= Q(name_reading=term) | Q(name_normalized=term)
+        for variant in dakuten_variants(term):
+            prefix_q |= Q(name_reading__startswith=variant) | Q(name_normalized__startswith=variant)
+        if not prefix_only:
+            contains_q = Q(name_reading__contains=term) | Q(name_normalized__contains=term)
+
+    ranks = [When(exact_q, then=Value(0)), When(prefix_q, then=Value(1))]
+    if contains_q:
+        ranks.append(When(contains_q, then=Value(2)))
+
+    results = limited(
+        staff.filter(exact_q | prefix_q | contains_q).annotate(
+            rank=Case(*ranks, default=Value(3), output_field=IntegerField())
+        ).order_by("rank", "name_reading", "name")
+    )
+    if results or not raw:
+        return results
+    fallback_q = Q(name__icontains=raw) | Q(employee_number__icontains=query.strip())
+    return limited(staff.filter(fallback_q).order_by("name_reading", "name"))
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .directory import invalidate_staff_directory
+from .models import Department, Staff, SystemSetting, Visit
+from .system_settings import invalidate_settings
+from .visit_events import publish_visit_status
+from .visit_statistics import apply_visit_change, key_of, load_key
+
+# 集計キーに関わる Visit のフィールド（update_fields がこれらを含まなければ集計は変わらない）
+STATISTIC_FIELDS = {"visited_at", "visit_type", "status", "staff", "staff_id"}
+
+
+# -------------------
+# 社員名簿スナップショットの無効化
+# -------------------
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+def invalidate_directory_on_change(sender, **kwargs):
+    # コミット前に再構築されると変更前のデータを掴むため、コミット後に無効化する
+    transaction.on_commit(invalidate_staff_directory)
+
+
+# -------------------
+# SystemSetting キャッシュの無効化
+# -------------------
+@receiver(post_save, sender=SystemSetting)
+@receiver(post_delete, sender=SystemSetting)
+def invalidate_settings_on_change(sender, **kwargs):
+    transaction.on_commit(invalidate_settings)
+
+
+# -------------------
+# 来訪集計（VisitStatistic）の差分更新
+# -------------------
+@receiver(pre_save, sender=Visit)
+def remember_visit_statistic_key(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._statistic_key = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not STATISTIC_FIELDS & set(update_fields):
+        instance._statistic_key = False
+        return
+    # 変更前の値はDBから読む（画面で書き換えられた instance の値は使えない）
+    instance._statistic_key = load_key(instance.pk)
+
+
+@receiver(post_save, sender=Visit)
+def update_visit_statistics_on_save(sender, instance, raw=False, **kwargs):
+    old_key = getattr(instance, "_statistic_key", None)
+    if raw or old_key is False:
+        return
+    apply_visit_change(old_key, key_of(instance))
+
+
+# -------------------
+# 来訪ステータス変更の WebSocket 配信（待機画面へ）
+# -------------------
+@receiver(post_save, sender=Visit)
+def publish_visit_status_on_change(sender, instance, created=False, raw=False, **kwargs):
+    # 変更前のキーは remember_visit_statistic_key で読み込み済み（ステータスを含む）
+    old_key = getattr(instance, "_statistic_key", None)
+    if raw or created or not old_key:
+        return
+    if old_key["status"] != (instance.status or ""):
+        publish_visit_status(instance)
+
+
+@receiver(post_delete, sender=Visit)
+def update_visit_statistics_on_delete(sender, instance, **kwargs):
+    apply_visit_change(key_of(instance), None)
@@ -0,0 +1,228 @@
+"""
+社員CSVの一括インポート
+
+- CSV は chunk_size 行ずつ読み込み、ファイル全体をメモリに載せない
+- 部署名 → 部署ID はファイルごとに1回だけ解決し、未登録の部署はまとめて作成する
+- 入力チェックはチャンク単位に pandas でまとめて行い、行番号付きのエラーを返す
+- 登録は社員番号をキーに bulk_create(update_conflicts=True) で upsert し、チャンクごとにコミットする
+- dry_run=True なら何も書き込まずに検証結果（エラー・新規/更新件数）だけを返す
+"""
+import pandas as pd
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .directory import invalidate_staff_directory
+from .models import Department, Staff
+
+CHUNK_SIZE = getattr(settings, "STAFF_IMPORT_CHUNK_SIZE", 1000)
+
+# CSV の列名 → Staff のフィールド
+COLUMNS = {
+    "社員番号": "employee_number",
+    "氏名": "name",
+    "氏名カナ": "name_kana",
+    "部署名": "department",
+    "役職": "position",
+}
+REQUIRED_COLUMNS = ("社員番号", "氏名", "部署名")
+
+# 文字数の上限（モデルの max_length に合わせる）
+MAX_LENGTHS = {
+    "社員番号": 20,
+    "氏名": 100,
+    "氏名カナ": 100,
+    "部署名": 100,
+    "役職": 100,
+}
+
+# upsert 時に上書きするフィールド（写真・作成日時は既存の値を残す）
+UPDATE_FIELDS = ["name", "name_kana", "department", "position", "name_reading", "name_normalized", "updated_at"]
+
+# CSV の1行目はヘッダー
+HEADER_LINES = 1
+
+# 未登録の部署を作成するときの部署タイプ
+NEW_DEPARTMENT_TYPE = "section"
+
+
+class ImportFormatError(ValueError):
+    """CSV の形式（ヘッダー・文字コード）が不正"""
+
+
+class DepartmentResolver:
+    """部署名 → 部署ID の解決（1ファイルにつき部署テーブルを1回だけ読む）"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.ids = {}
+        self.ambiguous = set()
+        self.created = []
+        for pk, name in Department.objects.order_by("id").values_list("id", "name"):
+            if name in self.ids:
+                self.ambiguous.add(name)
+            else:
+                self.ids[name] = pk
+
+    def missing(self, names):
+        """未登録の部署名（空欄を除く）"""
+        return sorted(set(names) - set(self.ids) - {""})
+
+    def ensure(self, names):
+        """未登録の部署を作成する（dry_run では作成せず、作成予定として記録するだけ）"""
+        for name in self.missing(names):
+            if self.dry_run:
+                self.ids[name] = None
+            else:
+                self.ids[name] = Department.objects.create(name=name, department_type=NEW_DEPARTMENT_TYPE).pk
+            self.created.append(name)
+
+    def discard(self, names):
+        """ロールバックされた部署の作成を取り消す（作成前に失敗した部署名は無視する）"""
+        for name in names:
+            if self.ids.pop(name, None) is not None:
+                self.created.remove(name)
+
+    def get(self, name):
+        """部署ID（部署名が空欄なら None）"""
+        return self.ids.get(name) if name else None
+
+
+def _read_chunks(file, chunk_size):
+    try:
+        reader = pd.read_csv(
+            file,
+            chunksize=chunk_size,
+            dtype=str,
+            keep_default_na=False,
+            encoding="utf-8-sig",
+            skipinitialspace=True,
+        )
+        for chunk in reader:
+            yield chunk
+    except UnicodeDecodeError:
+        raise ImportFormatError("CSV must be UTF-8 encoded")
+    except pd.errors.EmptyDataError:
+        raise ImportFormatError("CSV is empty")
+    except pd.errors.ParserError as e:
+        raise ImportFormatError(f"CSV could not be parsed: {e}")
+
+
+def _normalize_chunk(chunk):
+    """列名を Staff のフィールド名に揃え、前後の空白を除く"""
+    missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ImportFormatError(f"Missing columns: {', '.join(missing)}")
+
+    df = pd.DataFrame(index=chunk.index)
+    for column, field in COLUMNS.items():
+        df[field] = chunk[column].str.strip() if column in chunk.columns else ""
+    return df
+
+
+def _validate_chunk(df):
+    """
+    チャンク内の全行をまとめて検証する
+    戻り値: {行のindex: [エラーメッセージ, ...]}
+    """
+    checks = [
+        (df["employee_number"] == "", "社員番号は必須です"),
+        (df["name"] == "", "氏名は必須です"),
+    ]
+    for column, max_length in MAX_LENGTHS.items():
+        checks.append((df[COLUMNS[column]].str.len() > max_length, f"{column}は{max_length}文字以内で入力してください"))
+
+    errors = {}
+    for mask, message in checks:
+        for index in df.index[mask]:
+            errors.setdefault(index, []).append(message)
+    return errors
+
+
+def _build_staff(df, resolver):
+    staff_list = []
+    for row in df.itertuples(index=False):
+        staff = Staff(
+            employee_number=row.employee_number,
+            name=row.name,
+            name_kana=row.name_kana,
+            department_id=resolver.get(row.department),
+            position=row.position,
+        )
+        staff.apply_search_fields()
+        staff_list.append(staff)
+    return staff_list
+
+
+def import_staff_csv(file, dry_run=False, chunk_size=None):
+    """
+    社員CSVを取り込む
+    file: バイナリのファイルオブジェクト（アップロードファイル等）
+    戻り値: {
+        "dry_run", "total", "created", "updated", "skipped",
+        "departments_created": [部署名, ...],
+        "errors": [{"line": CSVの行番号, "employee_number", "errors": [...]}, ...],
+    }
+    ヘッダー不足など取り込み自体ができない場合は ImportFormatError を送出する
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    resolver = DepartmentResolver(dry_run=dry_run)
+    summary = {"dry_run": dry_run, "total": 0, "created": 0, "updated": 0, "skipped": 0, "errors": []}
+    # dry_run では登録しないため、前のチャンクに出てきた社員番号は「更新」として数える
+    pending = set()
+
+    for chunk in _read_chunks(file, chunk_size):
+        df = _normalize_chunk(chunk)
+        summary["total"] += len(df)
+
+        errors = _validate_chunk(df)
+        for index in df.index[df["department"].isin(resolver.ambiguous)]:
+            errors.setdefault(index, []).append("同名の部署が複数あるため部署を特定できません")
+        valid = df.drop(index=list(errors))
+
+        # 同じ社員番号が複数行あれば後の行を採用する（1回の upsert で同じ行は1度しか更新できない）
+        for index in valid.index[valid.duplicated(subset="employee_number", keep="last")]:
+            errors.setdefault(index, []).append("同じ社員番号の行が後にあるため取り込みません")
+        valid = valid.drop_duplicates(subset="employee_number", keep="last")
+        if not valid.empty:
+            existing = set(
+                Staff.objects.filter(employee_number__in=list(valid["employee_number"]))
+                .values_list("employee_number", flat=True)
+            ) | pending
+            if dry_run:
+                resolver.ensure(valid["department"])
+                pending.update(valid["employee_number"])
+            else:
+                new_departments = resolver.missing(valid["department"])
+                try:
+                    # 部署の作成も同じトランザクションに入れ、登録に失敗したら部署も残さない
+                    with transaction.atomic():
+                        resolver.ensure(new_departments)
+                        Staff.objects.bulk_create(
+                            _build_staff(valid, resolver),
+                            update_conflicts=True,
+                            unique_fields=["employee_number"],
+                            update_fields=UPDATE_FIELDS,
+                        )
+                except DatabaseError as e:
+                    resolver.discard(new_departments)
+                    for index in valid.index:
+                        errors.setdefault(index, []).append(f"登録に失敗しました: {e}")
+                    valid = valid.iloc[0:0]
+
+        updated = int(valid["employee_number"].isin(existing).sum()) if not valid.empty else 0
+        summary["updated"] += updated
+        summary["created"] += len(valid) - updated
+        summary["skipped"] += len(errors)
+        for index, messages in sorted(errors.items()):
+            summary["errors"].append({
+                # pandas の index はファイル先頭からの通し番号
+                "line": int(index) + HEADER_LINES + 1,
+                "employee_number": df.at[index, "employee_number"],
+                "errors": messages,
+            })
+
+    summary["departments_created"] = resolver.created
+    # bulk_create は保存シグナルを送らないため、名簿キャッシュはここでまとめて破棄する
+    if not dry_run and (summary["created"] or summary["updated"]):
+        transaction.on_commit(invalidate_staff_directory)
+    return summary
@@ -0,0 +1,144 @@
+"""
+SystemSetting のプロセス内キャッシュ
+
+全キーを1クエリで読み込み、SYSTEM_SETTING_CACHE_TTL 秒の間はメモリから返す。
+設定が保存・削除されると共有キャッシュ上のバージョンを進め（api.signals 参照）、
+他のワーカーは SYSTEM_SETTING_VERSION_CHECK_SECONDS ごとにバージョンを確認して読み直す
+（確認の間隔内は共有キャッシュも読まない）。
+"""
+import re
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+SETTINGS_VERSION_KEY = "system_settings:version"
+SETTINGS_CACHE_TTL = getattr(settings, "SYSTEM_SETTING_CACHE_TTL", 300)
+SETTINGS_VERSION_CHECK_SECONDS = getattr(settings, "SYSTEM_SETTING_VERSION_CHECK_SECONDS", 5)
+
+TRUE_VALUES = {"1", "true", "yes", "on", "はい", "有効"}
+FALSE_VALUES = {"0", "false", "no", "off", "いいえ", "無効"}
+
+# 例: "90" / "90s" / "5m" / "1h30m" / "1:30"（分:秒）/ "1:00:00"（時:分:秒）
+DURATION_PATTERN = re.compile(r"^(?:(?P<h>\d+)h)?(?:(?P<m>\d+)m)?(?:(?P<s>\d+)s?)?$")
+
+_registry = {"values": None, "loaded_at": 0.0, "checked_at": 0.0, "version": None}
+_lock = threading.Lock()
+
+
+def _shared_version():
+    return cache.get(SETTINGS_VERSION_KEY, 0)
+
+
+def _load():
+    from .models import SystemSetting
+
+    # 読み込み中に進んだバージョンを取りこぼさないよう、クエリより先にバージョンを読む
+    version = _shared_version()
+    values = dict(SystemSetting.objects.values_list("key", "value"))
+    _registry["values"] = values
+    _registry["loaded_at"] = _registry["checked_at"] = time.monotonic()
+    _registry["version"] = version
+    return values
+
+
+def _is_fresh(now):
+    return _registry["values"] is not None and now - _registry["checked_at"] < SETTINGS_VERSION_CHECK_SECONDS
+
+
+def get_all_settings():
+    """
+    全設定を {key: value} で返す
+    確認の間隔内はメモリから返し、間隔を過ぎたら共有キャッシュのバージョンを確認する
+    （バージョンが進んでいる・SETTINGS_CACHE_TTL を過ぎた・無効化済みなら1クエリで再読込）
+    """
+    if _is_fresh(time.monotonic()):
+        return _registry["values"]
+
+    with _lock:
+        now = time.monotonic()
+        if _is_fresh(now):
+            return _registry["values"]
+        if (
+            _registry["values"] is not None
+            and now - _registry["loaded_at"] < SETTINGS_CACHE_TTL
+            and _registry["version"] == _shared_version()
+        ):
+            _registry["checked_at"] = now
+            return _registry["values"]
+        return _load()
+
+
+def invalidate_settings():
+    """自プロセスのキャッシュを破棄し、他ワーカーにも再読込させる"""
+    _registry["values"] = None
+    try:
+        cache.incr(SETTINGS_VERSION_KEY)
+    except ValueError:
+        cache.set(SETTINGS_VERSION_KEY, int(time.time()), timeout=None)
+
+
+def get_setting(key, default=None):
+    """設定値を文字列のまま返す"""
+    return get_all_settings().get(key, default)
+
+
+def get_int(key, default=0):
+    value = get_setting(key)
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return default
+
+
+def get_bool(key, default=False):
+    value = get_setting(key)
+    if value is None:
+        return default
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return default
+
+
+def parse_duration(value):
+    """'90' / '5m' / '1h30m' / '1:30' 形式の文字列を timedelta に変換（不正なら None）"""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if ":" in value:
+        parts = value.split(":")
+        if len(parts) > 3 or not all(part.isdigit() for part in parts):
+            return None
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + int(part)
+        return timedelta(seconds=seconds)
+
+    match = DURATION_PATTERN.match(value)
+    if not value or not match:
+        return None
+    return timedelta(
+        hours=int(match.group("h") or 0),
+        minutes=int(match.group("m") or 0),
+        seconds=int(match.group("s") or 0),
+    )
+
+
+def get_duration(key, default=None):
+    """設定値を timedelta で返す。default には timedelta または秒数を指定できる"""
+    duration = parse_duration(get_setting(key))
+    if duration is not None:
+        return duration
+    if isinstance(default, (int, float)):
+        return timedelta(seconds=default)
+    return default
+
+
+def get_seconds(key, default=0):
+    """時間系の設定値を整数秒で返す"""
+    return int(get_duration(key, default).total_seconds())
@@ -1,3 +1,765 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import msgpack
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .channel_layer import SQLiteChannelLayer
+from .routing import websocket_urlpatterns
+from .directory import DIRECTORY_VERSION_KEY, build_staff_directory, get_directory_version, invalidate_staff_directory
+from .escalation import start_waiting
+from .exports import export_staff_csv, export_visits_csv
+from . import services, system_settings, webhook_health
+from .models import Department, NotificationOutbox, Staff, SystemSetting, Visit, VisitStatistic
+from .notifications import (
+    MAX_ATTEMPTS, SEND_SECONDS, LeaseExpired, _attempt, _record_success, claim_due_notifications,
+    create_session, deliver_due_notifications, lease_seconds,
+)
+from .partitions import (
+    UnknownPartition, add_months, archive_visits, detach_partition, month_bounds, month_start, partition_months,
+)
+from .staff_import import import_staff_csv
+from .visit_statistics import key_of, rebuild_statistics
+from .visit_events import RECEPTION_GROUP, build_visit_message, staff_group_name
+from .visit_transitions import accept_visit
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class StubWebhook:
+    """Teams Webhook の代わりのローカル HTTP サーバー（応答ステータスを順に返し、受信回数を数える）"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.received = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.received += 1
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write(b"1")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/webhook"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NotificationDeliveryTests(TestCase):
+    """送信キューの配信（再送・dead・二重送信の防止）"""
+
+    def setUp(self):
+        self.session = create_session()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def enqueue(self, url, **fields):
+        return NotificationOutbox.objects.create(webhook_url=url, payload={"text": "test"}, **fields)
+
+    def deliver(self):
+        return deliver_due_notifications(self.session, self.executor, batch_size=10, concurrency=2)
+
+    def test_retry_until_sent(self):
+        with StubWebhook([500, 200]) as stub:
+            item = self.enqueue(stub.url)
+
+            self.assertEqual(self.deliver()["retry"], 1)
+            item.refresh_from_db()
+            self.assertEqual((item.status, item.attempts), ("pending", 1))
+            self.assertGreater(item.next_attempt_at, timezone.now())
+
+            # バックオフ中は送らない
+            self.assertEqual(sum(self.deliver().values()), 0)
+
+            NotificationOutbox.objects.filter(pk=item.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(self.deliver()["sent"], 1)
+            item.refresh_from_db()
+            self.assertEqual((item.status, item.attempts), ("sent", 2))
+            self.assertEqual(stub.received, 2)
+
+    def test_permanent_error_is_dead_letter(self):
+        with StubWebhook([400]) as stub:
+            item = self.enqueue(stub.url)
+            self.assertEqual(self.deliver()["dead"], 1)
+            item.refresh_from_db()
+            self.assertEqual(item.status, "dead")
+            self.assertIn("HTTP 400", item.last_error)
+
+    def test_retry_limit_is_dead_letter(self):
+        with StubWebhook([503]) as stub:
+            item = self.enqueue(stub.url, attempts=MAX_ATTEMPTS - 1)
+            self.assertEqual(self.deliver()["dead"], 1)
+            item.refresh_from_db()
+            self.assertEqual((item.status, item.attempts), ("dead", MAX_ATTEMPTS))
+
+    def test_lease_covers_whole_batch(self):
+        with StubWebhook([]) as stub:
+            self.enqueue(stub.url)
+            before = timezone.now()
+            [item] = claim_due_notifications(50, concurrency=4)
+            self.assertGreaterEqual(item.next_attempt_at - before, timedelta(seconds=13 * SEND_SECONDS))
+            self.assertEqual(lease_seconds(50, 4), 14 * SEND_SECONDS)
+
+    def test_no_double_send_after_lease_is_taken_over(self):
+        with StubWebhook([]) as stub:
+            item = self.enqueue(stub.url)
+            [stalled] = claim_due_notifications(1)
+            # lease 中は他のワーカーに取られない
+            self.assertEqual(claim_due_notifications(1), [])
+
+            # 最初のワーカーが止まっている間に lease が切れ、別のワーカーが取り直す
+            NotificationOutbox.objects.filter(pk=item.pk).update(next_attempt_at=timezone.now())
+            [taken_over] = claim_due_notifications(1)
+
+            # 止まっていたワーカーは lease の残りが無いので送らず、結果も上書きしない
+            stalled.next_attempt_at = timezone.now()
+            self.assertIsInstance(_attempt(self.session, stalled), LeaseExpired)
+            self.assertEqual(_record_success(stalled), "lost")
+            item.refresh_from_db()
+            self.assertEqual((item.status, item.next_attempt_at), ("pending", taken_over.next_attempt_at))
+
+            self.assertIsNone(_attempt(self.session, taken_over))
+            self.assertEqual(_record_success(taken_over), "sent")
+            self.assertEqual(stub.received, 1)
+
+
+class CsvExportStreamingTests(TestCase):
+    """CSV エクスポートは ASGI では非同期イテレーターで送る"""
+
+    def setUp(self):
+        Staff.objects.bulk_create(Staff(employee_number=f"E{i:04d}", name=f"社員{i}") for i in range(5))
+
+    def test_wsgi_response_is_sync(self):
+        response = export_staff_csv(RequestFactory().get("/api/staff/export_csv/"))
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 6)
+
+    async def test_asgi_response_is_async(self):
+        response = export_staff_csv(AsyncRequestFactory().get("/api/staff/export_csv/"))
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response]
+        # ヘッダー行だけを先に送る
+        self.assertTrue(chunks[0].decode().startswith("\ufeff社員番号"))
+        self.assertEqual(len(b"".join(chunks).decode().splitlines()), 6)
+
+
+def _receive_messages(path, name, count, ready, results):
+    """別プロセス：グループに参加し、count 件受け取って番号を results へ返す"""
+    async def main():
+        layer = SQLiteChannelLayer(path=path)
+        channel = await layer.new_channel()
+        await layer.group_add("reception", channel)
+        ready.put((name, channel))
+        for _ in range(count):
+            message = await layer.receive(channel)
+            results.put(message["n"])
+        await layer.close()
+
+    asyncio.run(main())
+
+
+def _send_messages(path, channel, numbers):
+    """別プロセス：channel へ直接送る"""
+    async def main():
+        layer = SQLiteChannelLayer(path=path)
+        for n in numbers:
+            await layer.send(channel, {"type": "test.message", "n": n})
+        await layer.close()
+
+    asyncio.run(main())
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """プロセス間で共有する SQLite チャネルレイヤー"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "channels.sqlite3")
+        self.context = multiprocessing.get_context("fork")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_send_and_receive_across_processes(self):
+        group_numbers = list(range(20))
+        direct_numbers = [list(range(100, 120)), list(range(200, 220))]
+        ready = self.context.Queue()
+        results = {"first": self.context.Queue(), "second": self.context.Queue()}
+        expected = {
+            "first": sorted(group_numbers + direct_numbers[0] + direct_numbers[1]),
+            "second": group_numbers,
+        }
+        receivers = [
+            self.context.Process(
+                target=_receive_messages, args=(self.path, name, len(expected[name]), ready, results[name])
+            )
+            for name in results
+        ]
+        for process in receivers:
+            process.start()
+        channels = dict(ready.get(timeout=20) for _ in receivers)
+
+        # 2つのプロセスから first へ直接、このプロセスからグループへ同時に送る
+        senders = [
+            self.context.Process(target=_send_messages, args=(self.path, channels["first"], numbers))
+            for numbers in direct_numbers
+        ]
+        for process in senders:
+            process.start()
+
+        async def group_send():
+            layer = SQLiteChannelLayer(path=self.path)
+            for n in group_numbers:
+                await layer.group_send("reception", {"type": "test.message", "n": n})
+            await layer.close()
+
+        asyncio.run(group_send())
+
+        for name, numbers in expected.items():
+            received = sorted(results[name].get(timeout=20) for _ in numbers)
+            self.assertEqual(received, numbers)
+        for process in senders + receivers:
+            process.join(timeout=20)
+            self.assertEqual(process.exitcode, 0)
+
+    def test_polling_does_not_wait_for_write_lock(self):
+        layer = SQLiteChannelLayer(path=self.path)
+        channel = asyncio.run(layer.new_channel())
+        asyncio.run(layer.group_add("reception", channel))
+        # 他のプロセスが書き込みトランザクションを開いたまま
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.monotonic()
+            rows = asyncio.run(layer._take_messages([layer.non_local_name(channel)], time.time()))
+            self.assertEqual(rows, [])
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            writer.execute("ROLLBACK")
+            writer.close()
+            asyncio.run(layer.close())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class VisitPartitionTests(TestCase):
+    """古い来訪の月別パーティションへの移動・切り離しと、API・CSV 出力からの見え方"""
+
+    def setUp(self):
+        department = Department.objects.create(name="営業部")
+        self.staff = Staff.objects.create(employee_number="E0001", name="担当 太郎", department=department)
+        this_month = month_start(timezone.now())
+        self.old_months = [add_months(this_month, -6), add_months(this_month, -5)]
+        self.old = [
+            self.create_visit("古い来訪1", self.day(self.old_months[0], 3)),
+            self.create_visit("古い来訪2", self.day(self.old_months[0], 20)),
+            self.create_visit("古い来訪3", self.day(self.old_months[1], 10)),
+        ]
+        self.recent = self.create_visit("最近の来訪", timezone.now())
+        self.outbox = NotificationOutbox.objects.create(visit=self.old[0], webhook_url="http://127.0.0.1/", payload={})
+
+    @staticmethod
+    def day(month, day):
+        return month_bounds(month)[0] + timedelta(days=day - 1, hours=12)
+
+    def create_visit(self, name, visited_at):
+        visit = Visit.objects.create(
+            visit_type="appointment", visitor_company="株式会社テスト", visitor_name=name,
+            staff=self.staff, status="manager", visited_at=visited_at,
+        )
+        visit.notified_staff.add(self.staff)
+        return visit
+
+    def period(self):
+        return {"from": f"{self.old_months[0]:%Y-%m-%d}", "to": f"{timezone.localdate():%Y-%m-%d}"}
+
+    def test_archive_moves_old_months(self):
+        results = archive_visits(keep_months=3)
+
+        self.assertEqual(results, {self.old_months[0]: 2, self.old_months[1]: 1})
+        self.assertEqual(partition_months(), self.old_months)
+        self.assertEqual(list(Visit.objects.values_list("id", flat=True)), [self.recent.id])
+        self.outbox.refresh_from_db()
+        self.assertIsNone(self.outbox.visit_id)
+        # 移した来訪は担当者の情報を列として持つ
+        data = self.client.get(f"/api/visits/{self.old[0].id}/").json()
+        self.assertEqual(
+            (data["archived"], data["staff_name"], data["department_name"], data["notified_staff"]),
+            (True, "担当 太郎", "営業部", [self.staff.id]),
+        )
+        # 2回目は移すものが無い
+        self.assertEqual(archive_visits(keep_months=3), {})
+
+    def test_list_includes_archived_visits_only_for_a_period(self):
+        archive_visits(keep_months=3)
+
+        self.assertEqual([v["id"] for v in self.client.get("/api/visits/").json()], [self.recent.id])
+        data = self.client.get("/api/visits/", self.period()).json()
+        self.assertEqual([v["id"] for v in data], [self.recent.id] + [v.id for v in reversed(self.old)])
+        self.assertEqual([v.get("archived", False) for v in data], [False, True, True, True])
+        self.assertEqual(self.client.get("/api/visits/", {"from": "2024-13-01"}).status_code, 400)
+
+    def test_export_reads_partitions_and_api_visit(self):
+        archive_visits(keep_months=3)
+
+        response = export_visits_csv(**{f"date_{key}": value for key, value in self.period().items()})
+        lines = b"".join(response.streaming_content).decode().splitlines()[1:]
+        self.assertEqual(
+            [line.split(",")[3] for line in lines], ["古い来訪1", "古い来訪2", "古い来訪3", "最近の来訪"]
+        )
+        self.assertTrue(all(",担当 太郎,営業部," in line for line in lines))
+
+    def test_detached_month_is_no_longer_visible(self):
+        archive_visits(keep_months=3)
+        self.assertEqual(detach_partition(self.old_months[0]), f"api_visit_d{self.old_months[0]:%Y%m}")
+
+        self.assertEqual(partition_months(), self.old_months[1:])
+        data = self.client.get("/api/visits/", self.period()).json()
+        self.assertEqual([v["id"] for v in data], [self.recent.id, self.old[2].id])
+        self.assertEqual(self.client.get(f"/api/visits/{self.old[0].id}/").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/visits/{self.old[2].id}/").status_code, 200)
+        with self.assertRaises(UnknownPartition):
+            detach_partition(self.old_months[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DirectoryVersionTests(SimpleTestCase):
+    """社員名簿のバージョンはキャッシュから消えても戻らない"""
+
+    def setUp(self):
+        cache.delete(DIRECTORY_VERSION_KEY)
+
+    def test_version_keeps_increasing_after_key_is_lost(self):
+        first = get_directory_version()
+        invalidate_staff_directory()
+        second = get_directory_version()
+        self.assertGreater(second, first)
+
+        cache.delete(DIRECTORY_VERSION_KEY)
+        self.assertGreater(get_directory_version(), second)
+
+        third = get_directory_version()
+        cache.delete(DIRECTORY_VERSION_KEY)
+        invalidate_staff_directory()
+        self.assertGreater(get_directory_version(), third)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SystemSettingCacheTests(TestCase):
+    """SystemSetting のプロセス内キャッシュ"""
+
+    def setUp(self):
+        system_settings._registry.update(values=None, loaded_at=0.0, checked_at=0.0, version=None)
+        self.addCleanup(system_settings._registry.update, values=None)
+        SystemSetting.objects.create(key="escalation_interval_seconds", value="30")
+
+    def expire_check(self):
+        system_settings._registry["checked_at"] -= system_settings.SETTINGS_VERSION_CHECK_SECONDS
+
+    def test_shared_version_is_read_only_after_check_interval(self):
+        self.assertEqual(system_settings.get_int("escalation_interval_seconds"), 30)
+        with mock.patch.object(system_settings, "_shared_version", wraps=system_settings._shared_version) as version:
+            with self.assertNumQueries(0):
+                for _ in range(10):
+                    system_settings.get_all_settings()
+            self.assertEqual(version.call_count, 0)
+
+            self.expire_check()
+            with self.assertNumQueries(0):
+                system_settings.get_all_settings()
+            self.assertEqual(version.call_count, 1)
+
+    def test_other_worker_change_is_seen_after_check_interval(self):
+        system_settings.get_all_settings()
+        # 他のワーカーが保存した（DB とバージョンだけが変わる）
+        SystemSetting.objects.filter(key="escalation_interval_seconds").update(value="60")
+        cache.set(system_settings.SETTINGS_VERSION_KEY, system_settings._shared_version() + 1)
+
+        self.assertEqual(system_settings.get_int("escalation_interval_seconds"), 30)
+        self.expire_check()
+        self.assertEqual(system_settings.get_int("escalation_interval_seconds"), 60)
+
+    def test_version_is_read_before_query(self):
+        calls = []
+        with mock.patch.object(system_settings, "_shared_version", side_effect=lambda: calls.append("version") or 0):
+            with mock.patch.object(
+                SystemSetting.objects, "values_list",
+                side_effect=lambda *args: calls.append("query") or [("escalation_interval_seconds", "30")],
+            ):
+                system_settings.get_all_settings()
+        self.assertEqual(calls, ["version", "query"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class WebhookHealthTests(SimpleTestCase):
+    """送信結果の記録は状態ロックが取れたときだけ行う"""
+
+    url = "http://127.0.0.1/webhook"
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(webhook_health, "LOCK_WAIT", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hold_lock(self):
+        cache.add(webhook_health._key(self.url, "lock"), 1, timeout=60)
+        self.addCleanup(cache.delete, webhook_health._key(self.url, "lock"))
+
+    def test_failure_is_not_recorded_without_lock(self):
+        self.hold_lock()
+        with self.assertLogs("api.webhook_health", "WARNING"):
+            self.assertFalse(webhook_health.record_failure(self.url, retry_after=30))
+        health = webhook_health.get_health(self.url)
+        self.assertEqual((health["failures"], health["blocked_until"]), (0, 0.0))
+
+    def test_failure_and_success_are_recorded_with_lock(self):
+        self.assertTrue(webhook_health.record_failure(self.url))
+        self.assertEqual(webhook_health.get_health(self.url)["failures"], 1)
+
+        self.hold_lock()
+        with self.assertLogs("api.webhook_health", "WARNING"):
+            self.assertFalse(webhook_health.record_success(self.url))
+        self.assertEqual(webhook_health.get_health(self.url)["failures"], 1)
+
+        cache.delete(webhook_health._key(self.url, "lock"))
+        self.assertTrue(webhook_health.record_success(self.url))
+        self.assertEqual(webhook_health.get_health(self.url)["failures"], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DepartmentCycleTests(TestCase):
+    """部署の親に自身・配下の部署は指定できない"""
+
+    def setUp(self):
+        self.root = Department.objects.create(name="本部")
+        self.child = Department.objects.create(name="部", parent=self.root)
+        self.grandchild = Department.objects.create(name="課", parent=self.child)
+
+    def test_api_rejects_cycle(self):
+        for parent in (self.root, self.grandchild):
+            response = self.client.patch(
+                f"/api/departments/{self.root.id}/", {"parent": parent.id}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("parent", response.json())
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
+
+    def test_api_allows_moving_to_another_branch(self):
+        other = Department.objects.create(name="別の本部")
+        response = self.client.patch(
+            f"/api/departments/{self.child.id}/", {"parent": other.id}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.full_name, "別の本部 > 部 > 課")
+
+    def test_save_rejects_cycle(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.save()
+        self.assertIsNone(Department.objects.get(pk=self.root.pk).parent_id)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class EscalationTests(TestCase):
+    """応答待ち来訪のエスカレーション"""
+
+    def setUp(self):
+        system_settings._registry.update(values=None)
+        self.addCleanup(system_settings._registry.update, values=None)
+        self.general_affairs = Department.objects.create(name="総務部", teams_api_url="http://127.0.0.1/general")
+        SystemSetting.objects.create(key="general_affairs_department_id", value=str(self.general_affairs.id))
+
+    def test_escalating_visit_without_staff_notifies_general_affairs(self):
+        visit = Visit.objects.create(
+            visit_type="no-appointment", visitor_company="株式会社テスト", visitor_name="山田", status="waiting",
+        )
+        response = self.client.post(f"/api/visits/{visit.id}/escalate/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "notified")
+        outbox = NotificationOutbox.objects.get(visit=visit)
+        self.assertEqual(outbox.webhook_url, "http://127.0.0.1/general")
+        texts = [block.get("text") for block in outbox.payload["attachments"][0]["content"]["body"]]
+        self.assertIn("担当: **未割り当て**", texts)
+
+    def test_start_waiting_does_not_overwrite_concurrent_response(self):
+        department = Department.objects.create(name="営業部", teams_api_url="http://127.0.0.1/sales")
+        staff = Staff.objects.create(employee_number="E0001", name="担当 太郎", department=department)
+        visit = Visit.objects.create(
+            visit_type="appointment", visitor_company="株式会社テスト", visitor_name="山田", status="waiting",
+        )
+        # 画面が読んだ後に担当者が応答した
+        Visit.objects.filter(pk=visit.pk).update(status="manager", staff=staff)
+
+        start_waiting(visit, staff)
+
+        visit.refresh_from_db()
+        self.assertEqual(visit.status, "manager")
+        self.assertIsNone(visit.escalation_due_at)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_start_waiting_notifies_staff_department(self):
+        department = Department.objects.create(name="営業部", teams_api_url="http://127.0.0.1/sales")
+        staff = Staff.objects.create(employee_number="E0001", name="担当 太郎", department=department)
+        visit = Visit.objects.create(
+            visit_type="appointment", visitor_company="株式会社テスト", visitor_name="山田", status="waiting",
+        )
+
+        start_waiting(visit, staff)
+
+        visit.refresh_from_db()
+        self.assertEqual((visit.staff, visit.escalation_level), (staff, 0))
+        self.assertIsNotNone(visit.escalation_due_at)
+        self.assertEqual(NotificationOutbox.objects.get().webhook_url, "http://127.0.0.1/sales")
+
+
+class StaffSearchTests(TestCase):
+    """社員検索の正規化と並び順"""
+
+    def setUp(self):
+        department = Department.objects.create(name="営業部")
+        self.exact = Staff.objects.create(employee_number="E0010", name="山田", name_kana="ヤマダ", department=department)
+        self.prefix = Staff.objects.create(employee_number="E0020", name="山田 太郎", name_kana="ヤマダ タロウ", department=department)
+        self.contains = Staff.objects.create(employee_number="E0030", name="小山田 花子", name_kana="コヤマダ ハナコ", department=department)
+        Staff.objects.create(employee_number="E0040", name="田中 一郎", name_kana="タナカ イチロウ", department=department)
+
+    def test_romaji_and_kana_are_normalized(self):
+        for query in ("yamada", "ヤマダ", "ﾔﾏﾀﾞ", "やまだ"):
+            with self.subTest(query=query):
+                self.assertEqual(services.search_staff(query), [self.exact, self.prefix, self.contains])
+
+    def test_single_character_matches_prefix_with_unvoiced_variant(self):
+        # 1文字は前方一致。濁音の「が」は清音の「か」で始まる読みにも一致する
+        kato = Staff.objects.create(employee_number="E0050", name="加藤", name_kana="カトウ", department=self.exact.department)
+        self.assertEqual(services.search_staff("が"), [kato])
+        self.assertEqual([s.name for s in services.search_staff("だ")], ["田中 一郎"])
+
+    def test_prefix_match_excludes_contains(self):
+        self.assertEqual(services.search_staff("yamada", match="prefix"), [self.exact, self.prefix])
+
+    def test_falls_back_to_substring_only_without_reading_matches(self):
+        with self.assertNumQueries(1):
+            services.search_staff("yamada")
+        with self.assertNumQueries(2):
+            self.assertEqual(services.search_staff("001"), [self.exact])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class VisitStatisticTests(TestCase):
+    """来訪集計表の差分更新と作り直し"""
+
+    def setUp(self):
+        self.staff = Staff.objects.create(employee_number="E0001", name="担当 太郎", department=Department.objects.create(name="営業部"))
+
+    def create_visit(self, **fields):
+        values = {"visit_type": "appointment", "visitor_company": "株式会社テスト", "visitor_name": "山田", "status": "waiting"}
+        return Visit.objects.create(**{**values, **fields})
+
+    def counts(self):
+        return {(row.status, row.staff_id): row.count for row in VisitStatistic.objects.filter(count__gt=0)}
+
+    def test_save_and_delete_update_counts(self):
+        visit = self.create_visit()
+        self.create_visit(staff=self.staff)
+        self.assertEqual(self.counts(), {("waiting", 0): 1, ("waiting", self.staff.id): 1})
+
+        visit.status = "notified"
+        visit.save()
+        self.assertEqual(self.counts(), {("notified", 0): 1, ("waiting", self.staff.id): 1})
+
+        visit.delete()
+        self.assertEqual(self.counts(), {("waiting", self.staff.id): 1})
+
+    def test_save_without_key_fields_keeps_counts(self):
+        visit = self.create_visit()
+        visit.response_message = "すぐ行きます"
+        visit.save(update_fields=["response_message"])
+        self.assertEqual(self.counts(), {("waiting", 0): 1})
+
+    def test_transition_moves_count(self):
+        visit = self.create_visit(staff=self.staff)
+        accept_visit(visit, "すぐ行きます")
+        self.assertEqual(self.counts(), {("manager", self.staff.id): 1})
+
+    def test_rebuild_restores_counts(self):
+        visit = self.create_visit(staff=self.staff)
+        self.create_visit(status="notified")
+        VisitStatistic.objects.all().delete()
+        VisitStatistic.objects.create(count=5, **{**key_of(visit), "status": "manager"})
+
+        self.assertEqual(rebuild_statistics(), 2)
+        self.assertEqual(self.counts(), {("waiting", self.staff.id): 1, ("notified", 0): 1})
+
+    def test_migration_populates_counts(self):
+        migration = importlib.import_module("api.migrations.0018_visitstatistic")
+        visit = self.create_visit(staff=self.staff)
+        self.create_visit(staff=self.staff)
+        VisitStatistic.objects.all().delete()
+
+        migration.populate_statistics(apps, None)
+        self.assertEqual(VisitStatistic.objects.get().count, 2)
+        self.assertEqual(VisitStatistic.objects.values(*key_of(visit)).get(), key_of(visit))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StaffImportTests(TestCase):
+    """社員CSVの一括インポート"""
+
+    CSV = (
+        "社員番号,氏名,氏名カナ,部署名,役職\n"
+        "E0001,山田 太郎,ヤマダ タロウ,営業部,\n"
+        "E0002,佐藤 花子,サトウ ハナコ,新設部,課長\n"
+        "E0001,山田 次郎,ヤマダ ジロウ,営業部,\n"
+        ",名無し,,営業部,\n"
+    )
+
+    def setUp(self):
+        Department.objects.create(name="営業部")
+
+    def run_import(self, **kwargs):
+        return import_staff_csv(io.BytesIO(self.CSV.encode("utf-8")), **kwargs)
+
+    def assertCounts(self, summary, created, updated, skipped):
+        self.assertEqual((summary["created"], summary["updated"], summary["skipped"]), (created, updated, skipped))
+        self.assertEqual(created + updated + skipped, summary["total"])
+
+    def test_import_reports_duplicates_as_skipped(self):
+        Staff.objects.create(employee_number="E0002", name="旧姓", department=Department.objects.get())
+
+        summary = self.run_import()
+
+        self.assertCounts(summary, created=1, updated=1, skipped=2)
+        self.assertEqual([error["line"] for error in summary["errors"]], [2, 5])
+        self.assertEqual(summary["departments_created"], ["新設部"])
+        self.assertEqual(Staff.objects.get(employee_number="E0001").name, "山田 次郎")
+        self.assertEqual(Staff.objects.get(employee_number="E0002").department.name, "新設部")
+
+    def test_dry_run_writes_nothing(self):
+        summary = self.run_import(dry_run=True)
+
+        self.assertCounts(summary, created=2, updated=0, skipped=2)
+        self.assertEqual(summary["departments_created"], ["新設部"])
+        self.assertFalse(Staff.objects.exists())
+        self.assertEqual(Department.objects.count(), 1)
+
+    def test_failed_chunk_leaves_no_new_departments(self):
+        with mock.patch.object(Staff.objects, "bulk_create", side_effect=DatabaseError("boom")):
+            summary = self.run_import()
+
+        self.assertCounts(summary, created=0, updated=0, skipped=4)
+        self.assertEqual(summary["departments_created"], [])
+        self.assertEqual(list(Department.objects.values_list("name", flat=True)), ["営業部"])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConstantQueryTests(TestCase):
+    """名簿・部署階層・社員一覧のクエリ数は部署・社員の数に依存しない"""
+
+    def add_organization(self, sections, staff_per_section):
+        headquarters = Department.objects.create(name=f"本部{Department.objects.count()}", department_type="headquarters")
+        for i in range(sections):
+            section = Department.objects.create(name=f"{headquarters.name}-課{i}", department_type="section", parent=headquarters)
+            for j in range(staff_per_section):
+                Staff.objects.create(
+                    employee_number=f"{section.pk:03d}{j:03d}", name=f"社員{section.pk}-{j}", department=section,
+                )
+
+    def assertConstantQueries(self, num, func):
+        self.add_organization(sections=1, staff_per_section=1)
+        with self.assertNumQueries(num):
+            func()
+        self.add_organization(sections=5, staff_per_section=10)
+        with self.assertNumQueries(num):
+            func()
+
+    def test_staff_directory(self):
+        self.assertConstantQueries(2, build_staff_directory)
+
+    def get_ok(self, path, **query):
+        return lambda: self.assertEqual(self.client.get(path, query).status_code, 200)
+
+    def test_department_hierarchy(self):
+        self.assertConstantQueries(1, self.get_ok("/api/departments/hierarchy/"))
+
+    def test_staff_list(self):
+        self.assertConstantQueries(1, self.get_ok("/api/staff/"))
+
+    def test_staff_search(self):
+        self.assertConstantQueries(1, self.get_ok("/api/staff/search/", q="社員"))
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class ConsumerTests(SimpleTestCase):
+    """WebSocket の送信形式（msgpack）とまとめ送り"""
+
+    async def connect(self, path, **kwargs):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path, **kwargs)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_msgpack_frame(self):
+        communicator, subprotocol = await self.connect("/ws/staff/7/", subprotocols=["msgpack"])
+        self.assertEqual(subprotocol, "msgpack")
+        message = {"type": "visitor_notification", "visit_id": 1, "visitor_name": "山田"}
+
+        await get_channel_layer().group_send(staff_group_name(7), {"type": "visitor_notification", "message": message})
+
+        self.assertEqual(msgpack.unpackb(await communicator.receive_from(), raw=False), message)
+        await communicator.disconnect()
+
+    async def test_batch_keeps_latest_message_per_visit(self):
+        with mock.patch("api.consumers.BATCH_INTERVAL_MS", 20):
+            communicator, _ = await self.connect("/ws/reception/?batch=1")
+        layer = get_channel_layer()
+        for visit_id, status in ((1, "waiting"), (2, "waiting"), (1, "manager")):
+            message = build_visit_message(visit_id, status)
+            await layer.group_send(RECEPTION_GROUP, {"type": "visit_status_update", "message": message})
+
+        frame = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(frame["type"], "batch")
+        self.assertEqual([(m["visit_id"], m["status"]) for m in frame["messages"]], [(2, "waiting"), (1, "manager")])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+        await communicator.disconnect()
@@ -18,6 +18,7 @@ urlpatterns = [
     path("staff/search/", views.StaffViewSet.as_view({"get": "search"}), name="staff-search"),
     path("staff/import_csv/", views.StaffViewSet.as_view({"post": "import_csv"}), name="staff-import-csv"),
     path("staff/export_csv/", views.StaffViewSet.as_view({"get": "export_csv"}), name="staff-export-csv"),
+    path("visits/export_csv/", views.VisitViewSet.as_view({"get": "export_csv"}), name="visit-export-csv"),
     path("visits/<int:pk>/respond/", views.VisitViewSet.as_view({"post": "respond"}), name="visit-respond"),
     path("visits/<int:pk>/escalate/", views.VisitViewSet.as_view({"post": "escalate"}), name="visit-escalate"),
     path("visits/statistics/", views.VisitViewSet.as_view({"get": "statistics"}), name="visit-statistics"),
@@ -1,11 +1,8 @@
-import pandas as pd
-import requests
 import json
-from io import StringIO
 
+from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse
-from django.utils import timezone
+from django.http import Http404
 from django.shortcuts import render, redirect, get_object_or_404
 
 from rest_framework import viewsets, status
@@ -13,140 +10,165 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .models import Department, Staff, Visit, SystemSetting
-from .serializers import DepartmentSerializer, StaffSerializer, VisitSerializer, SystemSettingSerializer
+from .serializers import (
+    ArchivedVisitSerializer, DepartmentSerializer, StaffSerializer, SystemSettingSerializer, VisitSerializer,
+)
+from . import presence, services
+from .escalation import escalate_visit, start_waiting
+from .exports import InvalidDateRange, export_staff_csv, export_visits_csv, parse_date_range
+from .notifications import enqueue_teams_notification
+from .partitions import find_archived_visit, visit_querysets
+from .staff_import import ImportFormatError, import_staff_csv
+from .visit_statistics import InvalidPeriod, get_statistics
+from .visit_transitions import InvalidTransition, StaleTransition, accept_visit, decline_visit
 
 class DepartmentViewSet(viewsets.ModelViewSet):
     queryset = Department.objects.all().order_by("order", "name")
     serializer_class = DepartmentSerializer
 
+    def list(self, request, *args, **kwargs):
+        """部署一覧（children は1クエリで取得した部署から組み立てる）"""
+        return Response(services.get_department_list(self.filter_queryset(self.get_queryset()), request=request))
+
     @action(detail=False, methods=["get"])
     def hierarchy(self, request):
-        """ルート部署（親がNoneの部署）から階層構造を取得"""
-        root_departments = Department.objects.filter(parent__isnull=True).order_by("order", "name")
-        serializer = self.get_serializer(root_departments, many=True)
-        return Response(serializer.data)
+        """
+        ルート部署（親がNoneの部署）から階層構造を取得
+        - ?root=<id>  : 指定部署を起点としたサブツリーを返す
+        - ?depth=<n>  : children を展開する階層数を制限する（0 ならルートのみ）
+        """
+        try:
+            data = services.get_department_tree(
+                root_id=request.query_params.get("root") or None,
+                depth=services.parse_depth(request.query_params.get("depth")),
+                request=request,
+            )
+        except services.InvalidParameter as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Department.DoesNotExist:
+            return Response({"error": "Department not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
 
 class StaffViewSet(viewsets.ModelViewSet):
-    queryset = Staff.objects.all().order_by("employee_number")
+    queryset = Staff.objects.select_related("department").order_by("employee_number")
     serializer_class = StaffSerializer
 
     @action(detail=False, methods=["get"])
     def search(self, request):
-        """名前、カナ、社員番号によるスタッフ検索"""
-        query = request.query_params.get("q", "")
-        department_id = request.query_params.get("department", None)
-        staff = Staff.objects.all()
-
-        if query:
-            staff = staff.filter(
-                Q(name__icontains=query) |
-                Q(name_kana__icontains=query) |
-                Q(employee_number__icontains=query)
-            )
-        if department_id:
-            staff = staff.filter(department__id=department_id)
-        
+        """
+        名前、カナ、社員番号によるスタッフ検索
+        - ?q=<検索語>  : ローマ字・カタカナも含めて読みで照合し、一致度順に返す
+        - ?match=prefix で常に前方一致、?limit=<n> で件数を制限
+        """
+        limit = request.query_params.get("limit", "")
+        staff = services.search_staff(
+            query=request.query_params.get("q", ""),
+            department_id=request.query_params.get("department", None),
+            match=request.query_params.get("match", ""),
+            limit=int(limit) if limit.isdigit() else None,
+        )
         serializer = self.get_serializer(staff, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def presence(self, request):
+        """
+        担当者の在席（通知画面への接続）状況をまとめて返す
+        - ?ids=1,2,3 : 対象の担当者ID（省略時は空）
+        """
+        ids = {int(pk) for pk in request.query_params.get("ids", "").split(",") if pk.strip().isdigit()}
+        online = presence.online_staff_ids(ids)
+        return Response({"online": sorted(online), "offline": sorted(ids - online)})
+
     @action(detail=False, methods=["post"])
     def import_csv(self, request):
-        """CSVによるスタッフ一括登録"""
+        """
+        CSVによるスタッフ一括登録（社員番号をキーに新規登録・更新）
+        - ?dry_run=1 : 登録せずに検証結果と行ごとのエラーだけを返す
+        """
         if "file" not in request.FILES:
             return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        csv_file = request.FILES["file"]
-        data = csv_file.read().decode("utf-8-sig")
-        df = pd.read_csv(StringIO(data))
-
-        errors = []
-        for index, row in df.iterrows():
-            try:
-                department, _ = Department.objects.get_or_create(name=row["部署名"], defaults={
-                    "department_type": "section"
-                })
-                Staff.objects.update_or_create(
-                    employee_number=row["社員番号"],
-                    defaults={
-                        "name": row["氏名"],
-                        "name_kana": row.get("氏名カナ", ""),
-                        "department": department,
-                        "position": row.get("役職", ""),
-                        "email": row.get("メールアドレス", ""),
-                        "phone": row.get("内線番号", ""),
-                    }
-                )
-            except Exception as e:
-                errors.append(f"Line {index + 2}: {e}")
-        
-        if errors:
-            return Response({"status": "partially_succeeded", "errors": errors}, status=status.HTTP_207_MULTI_STATUS)
-        return Response({"status": "success", "message": "CSV imported successfully"})
+
+        dry_run = request.query_params.get("dry_run", request.data.get("dry_run", "")) in ("1", "true", "True")
+        try:
+            summary = import_staff_csv(request.FILES["file"], dry_run=dry_run)
+        except ImportFormatError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if summary["errors"]:
+            return Response({"status": "partially_succeeded", **summary}, status=status.HTTP_207_MULTI_STATUS)
+        message = "CSV validated successfully" if dry_run else "CSV imported successfully"
+        return Response({"status": "success", "message": message, **summary})
 
     @action(detail=False, methods=["get"])
     def export_csv(self, request):
-        """スタッフ一覧のCSV出力"""
-        staff_data = Staff.objects.all().values(
-            "employee_number", "name", "name_kana", "department__name", 
-            "position", "email", "phone"
-        )
-        df = pd.DataFrame(list(staff_data))
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="staff_export.csv"'
-        df.to_csv(response, index=False, encoding="utf-8-sig")
-        return response
+        """スタッフ一覧のCSV出力（ストリーミング）"""
+        return export_staff_csv(request)
 
 class VisitViewSet(viewsets.ModelViewSet):
     queryset = Visit.objects.all().order_by("-visited_at")
     serializer_class = VisitSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        来訪一覧（新しい順）
+        - ?from=YYYY-MM-DD&to=YYYY-MM-DD : 来訪日で絞り込む（両端を含む）。
+          期間を指定したときは月別パーティションへ移した来訪（archived=true）も含める
+        期間を指定しなければ api_visit（直近 VISIT_HOT_MONTHS か月）だけを返す
+        """
+        date_from, date_to = request.query_params.get("from"), request.query_params.get("to")
+        if not date_from and not date_to:
+            return super().list(request, *args, **kwargs)
+        try:
+            start, end = parse_date_range(date_from, date_to)
+        except InvalidDateRange as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # api_visit → 新しい月のパーティションの順（パーティションは api_visit より古い月だけを持つ）
+        data = []
+        for queryset in reversed(visit_querysets(start, end)):
+            queryset = queryset.order_by("-visited_at", "-id")
+            if queryset.model is Visit:
+                data += self.get_serializer(queryset.select_related("staff").prefetch_related("notified_staff"), many=True).data
+            else:
+                data += ArchivedVisitSerializer(queryset, many=True).data
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """来訪の詳細。パーティションへ移した来訪は読み取り専用の内容（archived=true）を返す"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = kwargs.get("pk")
+            visit = find_archived_visit(int(pk)) if str(pk).isdigit() else None
+            if visit is None:
+                raise
+            return Response(ArchivedVisitSerializer(visit).data)
+
     def perform_create(self, serializer):
-        """データ保存時に自動でTeamsへ通知"""
-        # 1. データベースに保存
-        visit = serializer.save()
-        
-        # 2. 担当者の部署にTeams API URLがあるかチェック
-        if visit.staff and visit.staff.department and visit.staff.department.teams_api_url:
-            self.send_teams_notification(visit, visit.staff.department.teams_api_url)
-
-    def send_teams_notification(self, visit, webhook_url):
-        """TeamsチャネルへAdaptive Card形式で通知を投稿"""
-        local_time = timezone.localtime(visit.visited_at).strftime('%H:%M')
-        
-        payload = {
-            "type": "message",
-            "attachments": [{
-                "contentType": "application/vnd.microsoft.card.adaptive",
-                "content": {
-                    "type": "AdaptiveCard",
-                    "version": "1.4",
-                    "body": [
-                        {"type": "TextBlock", "text": "🔔 来客通知", "weight": "Bolder", "size": "Large", "color": "Attention"},
-                        {"type": "TextBlock", "text": f"担当: **{visit.staff.name}** さん", "wrap": True},
-                        {"type": "FactSet", "facts": [
-                            {"title": "会社名:", "value": visit.visitor_company},
-                            {"title": "お客様:", "value": f"{visit.visitor_name} 様"},
-                            {"title": "用件:", "value": visit.purpose_preset or visit.purpose_custom or "なし"},
-                            {"title": "到着:", "value": local_time}
-                        ]}
-                    ],
-                    "actions": [
-                        {
-                            "type": "Action.OpenUrl",
-                            "title": "管理画面を表示",
-                            "url": f"http://localhost:8000/admin/api/visit/{visit.id}/change/"
-                        }
-                    ],
-                    "$schema": "http://adaptivecards.io/schemas/adaptive-card.json"
-                }
-            }]
-        }
+        """データ保存時にTeams通知を送信キューへ登録（送信は send_notifications ワーカーが行う）"""
+        # 来訪と通知キューを同一トランザクションで保存し、どちらか一方だけ残らないようにする
+        with transaction.atomic():
+            visit = serializer.save()
+            if visit.status == "waiting" and visit.staff_id:
+                # 応答待ちはエスカレーション期限も設定する（run_escalations が監視）
+                start_waiting(visit, visit.staff)
+            else:
+                enqueue_teams_notification(visit)
 
+    @action(detail=False, methods=["get"])
+    def statistics(self, request):
+        """
+        来訪件数の統計（時間帯・日・来訪種別・ステータス・担当者・部署別）
+        - ?from=YYYY-MM-DD&to=YYYY-MM-DD : 集計期間（両端を含む。省略時は今日までの30日間）
+        集計表（VisitStatistic）のみを読む
+        """
         try:
-            # タイムアウトを短めに設定してユーザーを待たせない
-            requests.post(webhook_url, json=payload, timeout=5)
-        except Exception as e:
-            print(f"Teams Notification Failed: {e}")
+            data = get_statistics(request.query_params.get("from"), request.query_params.get("to"))
+        except InvalidPeriod as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
     @action(detail=True, methods=["post"])
     def respond(self, request, pk=None):
         """担当者からの応答（受諾・拒否）を処理"""
@@ -155,41 +177,49 @@ class VisitViewSet(viewsets.ModelViewSet):
         response_message = request.data.get("message", "")
 
         if response_status == "available":
-            visit.status = "accepted"
+            transition = accept_visit
         elif response_status == "unavailable":
-            visit.status = "unavailable"
+            transition = decline_visit
         else:
             return Response({"error": "Invalid response status"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        visit.response_message = response_message
-        visit.response_time = timezone.now()
-        visit.save()
+
+        try:
+            transition(visit, response_message)
+        except (InvalidTransition, StaleTransition):
+            # 既に応答済み・別の処理が先に変更した（上書きしない）
+            visit.refresh_from_db()
+            return Response(
+                {"error": "Visit has already been handled", "status": visit.status},
+                status=status.HTTP_409_CONFLICT,
+            )
         return Response(self.get_serializer(visit).data)
 
+    @action(detail=False, methods=["get"])
+    def export_csv(self, request):
+        """
+        来訪記録のCSV出力（ストリーミング）
+        - ?from=YYYY-MM-DD&to=YYYY-MM-DD : 来訪日で絞り込む（両端を含む）
+        """
+        try:
+            return export_visits_csv(request.query_params.get("from"), request.query_params.get("to"), request)
+        except InvalidDateRange as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=True, methods=["post"])
     def escalate(self, request, pk=None):
-        """代理人へのエスカレーション処理"""
+        """
+        応答待ちの来訪を次の通知先へすぐにエスカレーション
+        （通常は run_escalations が期限到来時に自動で行う）
+        """
         visit = self.get_object()
-        current_level = visit.escalation_level
-        next_staff = None
-
-        if current_level == 0 and visit.staff and visit.staff.substitute1:
-            next_staff = visit.staff.substitute1
-            visit.escalation_level = 1
-        elif current_level == 1 and visit.staff and visit.staff.substitute2:
-            next_staff = visit.staff.substitute2
-            visit.escalation_level = 2
-        elif current_level == 2:
-            visit.escalation_level = 3
-            return Response({"escalated_to": "general_affairs", "message": "総務へ転送しました"})
-        else:
-            return Response({"error": "No substitute available"}, status=status.HTTP_400_BAD_REQUEST)
-
-        visit.save()
+        result = escalate_visit(visit.pk, force=True)
+        if result is None:
+            return Response({"error": "Visit is not waiting for a response"}, status=status.HTTP_400_BAD_REQUEST)
         return Response({
-            "escalated_to": next_staff.id, 
-            "escalated_to_name": next_staff.name, 
-            "level": visit.escalation_level
+            "escalated_to": result["target"],
+            "level": result["level"],
+            "status": result["status"],
+            "next_due_at": result["next_due_at"],
         })
 
 class SystemSettingViewSet(viewsets.ModelViewSet):
@@ -0,0 +1,127 @@
+"""
+来訪ステータス変更の WebSocket 配信
+
+担当者の応答などで Visit.status が変わると、トランザクションのコミット後に
+- 来訪ごとのグループ（visit_<id>）: その来訪の待機画面だけが受け取る
+- 受付全体のグループ（reception）: 受付の一覧表示など全体を見ている画面向け
+へ ReceptionConsumer.visit_status_update として送る。
+担当者（NotificationConsumer）への通知は、接続中（api.presence）のときだけ送る。
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import presence
+
+logger = logging.getLogger(__name__)
+
+RECEPTION_GROUP = "reception"
+
+# 待機画面が「担当者が対応する」「担当者は対応できない」と判断するステータス
+ACCEPTED_STATUSES = {"accepted", "manager"}
+DECLINED_STATUSES = {"unavailable", "notified"}
+
+
+def visit_group_name(visit_id):
+    return f"visit_{visit_id}"
+
+
+def visit_result(status):
+    """ステータスを待機画面向けの結果（accepted / declined / None）にする"""
+    if status in ACCEPTED_STATUSES:
+        return "accepted"
+    if status in DECLINED_STATUSES:
+        return "declined"
+    return None
+
+
+def build_visit_message(visit_id, status, response_message="", staff_id=None):
+    return {
+        "type": "visit_status",
+        "visit_id": visit_id,
+        "status": status,
+        "result": visit_result(status),
+        "response_message": response_message or "",
+        "staff_id": staff_id,
+    }
+
+
+def _send_group(group, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(group, event)
+    except Exception:
+        # 配信できなくても待機画面はタイマーで先へ進むため、保存処理は失敗させない
+        logger.exception("Failed to publish to %s", group)
+
+
+def _send(message):
+    event = {"type": "visit.status_update", "message": message}
+    _send_group(visit_group_name(message["visit_id"]), event)
+    _send_group(RECEPTION_GROUP, event)
+
+
+def publish_visit_status(visit):
+    """
+    来訪の現在のステータスをコミット後に配信する
+    （ロールバックされた変更は配信されない。値は呼び出し時点のものを送る）
+    """
+    message = build_visit_message(visit.pk, visit.status, visit.response_message, visit.staff_id)
+    transaction.on_commit(lambda: _send(message))
+
+
+def staff_group_name(staff_id):
+    """NotificationConsumer（ws/staff/<staff_id>/）のグループ名"""
+    return f"staff_{staff_id}"
+
+
+def publish_visitor_notification(visit):
+    """
+    担当者の画面（staff_<id>）へ来訪を知らせる（コミット後）
+    在席はコミット後に確認し、接続中でなければ送らない
+    """
+    if not visit.staff_id:
+        return
+    message = {
+        "type": "visitor_notification",
+        "visit_id": visit.pk,
+        "visitor_company": visit.visitor_company,
+        "visitor_name": visit.visitor_name,
+        "purpose": visit.purpose_preset or visit.purpose_custom or "",
+        "visited_at": visit.visited_at.isoformat(),
+    }
+    staff_id = visit.staff_id
+
+    def send():
+        if presence.is_online(staff_id):
+            _send_group(staff_group_name(staff_id), {"type": "visitor.notification", "message": message})
+
+    transaction.on_commit(send)
+
+
+def publish_visit_escalation(visit, target_name, next_seconds=None):
+    """
+    エスカレーションしたことをコミット後に配信する
+    - 待機画面（visit_<id>）: 通知先とタイマーの残り秒数を更新する
+    - 元の担当者（staff_<id>）: 別の通知先へ回したことを知らせる
+    """
+    message = {
+        "type": "visit_escalation",
+        "visit_id": visit.pk,
+        "status": visit.status,
+        "level": visit.escalation_level,
+        "target": target_name,
+        "next_seconds": next_seconds,
+    }
+    staff_id = visit.staff_id
+
+    def send():
+        _send(message)
+        if staff_id and presence.is_online(staff_id):
+            _send_group(staff_group_name(staff_id), {"type": "escalation.notification", "message": message})
+
+    transaction.on_commit(send)
@@ -0,0 +1,216 @@
+"""
+来訪統計（VisitStatistic 集計表）の更新と読み出し
+
+- apply_visit_change(): Visit の保存・削除時に、変更前後の集計キーの件数を ±1 する
+- rebuild_statistics(): Visit 全体（または期間。月別パーティションを含む）から集計表を作り直す
+- get_statistics(): /api/visits/statistics/ の応答を集計表だけから組み立てる
+
+集計キーは (来訪日, 時間帯, 来訪種別, ステータス, 担当者ID)。日付・時間帯は TIME_ZONE のローカル時刻。
+部署別は担当者の現在の所属部署でまとめる（集計表には部署を持たせない）。
+"""
+from collections import Counter
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, ExtractHour, TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Department, Staff, Visit, VisitStatistic
+from .partitions import visit_querysets
+
+# 集計キーに使う Visit のフィールド
+KEY_FIELDS = ("visited_at", "visit_type", "status", "staff_id")
+
+# 期間未指定時の集計日数（今日を含む）
+DEFAULT_DAYS = 30
+
+REBUILD_BATCH_SIZE = 1000
+
+
+class InvalidPeriod(ValueError):
+    """期間指定が不正"""
+
+
+def visit_key(visited_at, visit_type, status, staff_id):
+    """Visit の値から集計キー（VisitStatistic の検索条件）を作る"""
+    local = timezone.localtime(visited_at)
+    return {
+        "date": local.date(),
+        "hour": local.hour,
+        "visit_type": visit_type or "",
+        "status": status or "",
+        "staff_id": staff_id or 0,
+    }
+
+
+def key_of(visit):
+    return visit_key(visit.visited_at, visit.visit_type, visit.status, visit.staff_id)
+
+
+def _add(key, delta):
+    updated = VisitStatistic.objects.filter(**key).update(count=F("count") + delta)
+    if updated or delta < 0:
+        return
+    try:
+        # 同じキーを別リクエストが同時に作った場合に備えてセーブポイント内で作成する
+        with transaction.atomic():
+            VisitStatistic.objects.create(count=delta, **key)
+    except IntegrityError:
+        VisitStatistic.objects.filter(**key).update(count=F("count") + delta)
+
+
+def apply_visit_change(old_key=None, new_key=None):
+    """変更前のキーを -1、変更後のキーを +1 する（同じなら何もしない）"""
+    if old_key == new_key:
+        return
+    with transaction.atomic():
+        if old_key:
+            _add(old_key, -1)
+        if new_key:
+            _add(new_key, 1)
+
+
+def load_key(pk):
+    """DB上の現在の値から集計キーを作る（存在しなければ None）"""
+    values = Visit.objects.filter(pk=pk).values_list(*KEY_FIELDS).first()
+    return visit_key(*values) if values else None
+
+
+def aggregate_visits(visits):
+    """
+    Visit（またはパーティション）の QuerySet を集計キーごとの件数にまとめる（GROUP BY はDB側で行う）
+    """
+    tz = timezone.get_current_timezone()
+    return (
+        visits.annotate(
+            stat_date=TruncDate("visited_at", tzinfo=tz),
+            stat_hour=ExtractHour("visited_at", tzinfo=tz),
+            stat_staff_id=Coalesce("staff_id", 0),
+        )
+        .values("stat_date", "stat_hour", "visit_type", "status", "stat_staff_id")
+        .annotate(stat_count=Count("id"))
+        .order_by()
+    )
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min)) if day else None
+
+
+def rebuild_statistics(date_from=None, date_to=None):
+    """
+    集計表を作り直す（date_from〜date_to を指定した場合はその期間の行だけ）
+    月別パーティション（api.partitions）の来訪も含める
+    戻り値: 作成した集計行数
+    """
+    statistics = VisitStatistic.objects.all()
+    if date_from:
+        statistics = statistics.filter(date__gte=date_from)
+    if date_to:
+        statistics = statistics.filter(date__lte=date_to)
+
+    sources = visit_querysets(_day_start(date_from), _day_start(date_to + timedelta(days=1) if date_to else None))
+
+    # 同じ月が api_visit とパーティションの両方にあり得るため、キーごとに合算してから登録する
+    counts = Counter()
+    for visits in sources:
+        for row in aggregate_visits(visits).iterator(chunk_size=REBUILD_BATCH_SIZE):
+            key = (row["stat_date"], row["stat_hour"], row["visit_type"] or "", row["status"] or "", row["stat_staff_id"])
+            counts[key] += row["stat_count"]
+
+    with transaction.atomic():
+        statistics.delete()
+        rows = (
+            VisitStatistic(date=day, hour=hour, visit_type=visit_type, status=status, staff_id=staff_id, count=count)
+            for (day, hour, visit_type, status, staff_id), count in counts.items()
+        )
+        while batch := list(islice(rows, REBUILD_BATCH_SIZE)):
+            VisitStatistic.objects.bulk_create(batch)
+    return len(counts)
+
+
+def parse_period(date_from=None, date_to=None):
+    """YYYY-MM-DD の期間（両端を含む）。未指定なら今日までの DEFAULT_DAYS 日間"""
+    try:
+        end = parse_date(date_to) if date_to else timezone.localdate()
+        start = parse_date(date_from) if date_from else end - timedelta(days=DEFAULT_DAYS - 1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        raise InvalidPeriod("from/to must be dates (YYYY-MM-DD)")
+    if start > end:
+        raise InvalidPeriod("from must be on or before to")
+    return start, end
+
+
+def _group(rows, field):
+    return (
+        rows.values(field)
+        .annotate(total=Sum("count"))
+        .filter(total__gt=0)
+        .order_by(field)
+    )
+
+
+def get_statistics(date_from=None, date_to=None):
+    """
+    期間内の来訪件数を時間帯・日・来訪種別・ステータス・担当者・部署ごとに返す
+    集計表のみを読む（Visit テーブルは参照しない）
+    """
+    start, end = parse_period(date_from, date_to)
+    rows = VisitStatistic.objects.filter(date__gte=start, date__lte=end)
+
+    by_hour = {row["hour"]: row["total"] for row in _group(rows, "hour")}
+    by_day = {row["date"]: row["total"] for row in _group(rows, "date")}
+    by_staff = {row["staff_id"]: row["total"] for row in _group(rows, "staff_id")}
+    visit_types = dict(Visit.VISIT_TYPES)
+    statuses = dict(Visit.STATUS_CHOICES)
+
+    staff_info = {
+        row["id"]: row
+        for row in Staff.objects.filter(pk__in=[pk for pk in by_staff if pk]).values("id", "name", "department_id")
+    }
+    by_department = {}
+    for staff_id, total in by_staff.items():
+        department_id = staff_info.get(staff_id, {}).get("department_id")
+        by_department[department_id] = by_department.get(department_id, 0) + total
+    department_names = dict(
+        Department.objects.filter(pk__in=[pk for pk in by_department if pk]).values_list("id", "full_name")
+    )
+
+    days = (end - start).days + 1
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "total": sum(by_day.values()),
+        "by_hour": [{"hour": hour, "count": by_hour.get(hour, 0)} for hour in range(24)],
+        "by_day": [
+            {"date": day.isoformat(), "count": by_day.get(day, 0)}
+            for day in (start + timedelta(days=i) for i in range(days))
+        ],
+        "by_visit_type": [
+            {"visit_type": row["visit_type"], "label": visit_types.get(row["visit_type"], row["visit_type"]), "count": row["total"]}
+            for row in _group(rows, "visit_type")
+        ],
+        "by_status": [
+            {"status": row["status"], "label": statuses.get(row["status"], row["status"]), "count": row["total"]}
+            for row in _group(rows, "status")
+        ],
+        "by_staff": sorted(
+            (
+                {"staff_id": staff_id or None, "name": staff_info.get(staff_id, {}).get("name", ""), "count": total}
+                for staff_id, total in by_staff.items()
+            ),
+            key=lambda row: -row["count"],
+        ),
+        "by_department": sorted(
+            (
+                {"department_id": department_id, "name": department_names.get(department_id, ""), "count": total}
+                for department_id, total in by_department.items()
+            ),
+            key=lambda row: -row["count"],
+        ),
+    }
@@ -0,0 +1,80 @@
+"""
+来訪ステータスの遷移
+
+各遷移は UPDATE api_visit SET <変更する列> WHERE id=<id> AND status=<遷移前> を1回だけ発行する。
+担当者の応答・エスカレーション・受付端末の完了処理が同時に走っても先に成功した一方だけが反映され、
+後の一方は StaleTransition になる（全列の save() による上書きで更新が失われることが無い）。
+
+QuerySet.update() は保存シグナルを送らないため、集計表（VisitStatistic）の差分更新と
+待機画面への配信はここで行う。
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Visit
+from .visit_events import publish_visit_status
+from .visit_statistics import apply_visit_change, key_of
+
+STATUS_LABELS = dict(Visit.STATUS_CHOICES)
+
+# 遷移前 → 遷移できるステータス
+ALLOWED_TRANSITIONS = {
+    "waiting": {"manager", "notified"},
+    # 総務対応に回った後で担当者が応答した場合は担当者対応に切り替える
+    "notified": {"manager"},
+    "manager": set(),
+}
+
+# 遷移と同時に更新できる列
+TRANSITION_FIELDS = {
+    "staff", "visit_type", "purpose_preset", "purpose_custom",
+    "response_message", "response_time", "escalation_level", "escalation_due_at",
+}
+
+
+class InvalidTransition(ValueError):
+    """STATUS_CHOICES に無いステータス、または許可されていない遷移"""
+
+
+class StaleTransition(Exception):
+    """読み込んだ後に別の処理が来訪を更新していた（遷移は行っていない）"""
+
+
+def transition_visit(visit, to_status, where=None, **fields):
+    """
+    visit を to_status へ遷移させる（visit は遷移後の値に更新される）
+    where: 追加の条件（例: {"escalation_level": 1}）
+    """
+    if to_status not in STATUS_LABELS:
+        raise InvalidTransition(f"Unknown visit status: {to_status}")
+    if to_status not in ALLOWED_TRANSITIONS.get(visit.status, set()):
+        raise InvalidTransition(f"Cannot change visit status from {visit.status} to {to_status}")
+    unknown = set(fields) - TRANSITION_FIELDS
+    if unknown:
+        raise InvalidTransition(f"Fields cannot be updated by a transition: {', '.join(sorted(unknown))}")
+
+    old_key = key_of(visit)
+    values = {"status": to_status, "updated_at": timezone.now(), **fields}
+    with transaction.atomic():
+        updated = Visit.objects.filter(pk=visit.pk, status=visit.status, **(where or {})).update(**values)
+        if not updated:
+            raise StaleTransition(f"Visit {visit.pk} was changed by another request")
+        for name, value in values.items():
+            setattr(visit, name, value)
+        apply_visit_change(old_key, key_of(visit))
+        publish_visit_status(visit)
+    return visit
+
+
+def _response_fields(message):
+    return {"response_message": message or "", "response_time": timezone.now(), "escalation_due_at": None}
+
+
+def accept_visit(visit, message=""):
+    """担当者が対応する（応答待ち・総務対応 → 担当者対応）"""
+    return transition_visit(visit, "manager", **_response_fields(message))
+
+
+def decline_visit(visit, message=""):
+    """担当者が対応できない（応答待ち → 総務対応）"""
+    return transition_visit(visit, "notified", **_response_fields(message))
@@ -0,0 +1,175 @@
+"""
+Teams Webhook ごとの健全性管理（サーキットブレーカー＋送信レート制限）
+
+状態は Django のキャッシュ（Redis / ファイルキャッシュ）に置き、
+send_notifications ワーカーが複数プロセスあっても共有される。
+
+- サーキットブレーカー: 連続失敗が閾値を超えると open にし、一定時間は送信せず即座に諦める。
+  時間経過後は half-open として1件だけ試し、成功すれば closed に戻す。
+- トークンバケット: URL ごとの送信レートを制限し、429 の Retry-After を受けたらその間は送信しない。
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = getattr(settings, "TEAMS_BREAKER_FAILURE_THRESHOLD", 5)
+COOLDOWN_SECONDS = getattr(settings, "TEAMS_BREAKER_COOLDOWN", 30)
+MAX_COOLDOWN_SECONDS = getattr(settings, "TEAMS_BREAKER_MAX_COOLDOWN", 600)
+RATE_PER_SECOND = getattr(settings, "TEAMS_RATE_PER_SECOND", 1.0)
+RATE_BURST = getattr(settings, "TEAMS_RATE_BURST", 4)
+
+# half-open 時の試行1件が結果を返すまで、他の送信を止めておく秒数
+PROBE_TIMEOUT = getattr(settings, "TEAMS_NOTIFICATION_TIMEOUT", 5) * 2
+# 状態更新用ロックの有効期限と取得待ち時間
+LOCK_TIMEOUT = 2
+LOCK_WAIT = 0.5
+# 送信結果を記録するときにロックの取得を試みる回数（それでも取れなければ記録を見送る）
+LOCK_ATTEMPTS = 3
+# ロックが取れない・half-open の試行中などで送信を見送るときの待ち秒数
+BUSY_RETRY_SECONDS = 1.0
+STATE_TIMEOUT = 60 * 60 * 24
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _key(url, kind):
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return f"webhook:{kind}:{digest}"
+
+
+class _StateLock:
+    """cache.add による簡易的なプロセス間ロック"""
+
+    def __init__(self, url):
+        self.key = _key(url, "lock")
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + LOCK_WAIT
+        while True:
+            self.acquired = cache.add(self.key, 1, timeout=LOCK_TIMEOUT)
+            if self.acquired or time.monotonic() >= deadline:
+                return self.acquired
+            time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            cache.delete(self.key)
+
+
+def _breaker(url):
+    return cache.get(_key(url, "breaker")) or {"state": CLOSED, "failures": 0, "opens": 0, "open_until": 0.0}
+
+
+def _bucket(url):
+    return cache.get(_key(url, "bucket")) or {"tokens": float(RATE_BURST), "updated": time.time(), "blocked_until": 0.0}
+
+
+def get_health(url):
+    """管理・確認用に現在の状態を返す"""
+    breaker = _breaker(url)
+    state = breaker["state"]
+    if state == OPEN and time.time() >= breaker["open_until"]:
+        state = HALF_OPEN
+    return {"state": state, "failures": breaker["failures"], "blocked_until": _bucket(url)["blocked_until"]}
+
+
+def before_send(url):
+    """
+    送信してよいか判定し、よければトークンを1つ消費する
+    戻り値: 0 なら今すぐ送信可。正の値ならその秒数後まで送信を見送る（HTTP は行わない）
+    """
+    now = time.time()
+    breaker = _breaker(url)
+    if breaker["state"] == OPEN:
+        if now < breaker["open_until"]:
+            return breaker["open_until"] - now
+        # half-open: 試行は全プロセスで1件だけ
+        if not cache.add(_key(url, "probe"), 1, timeout=PROBE_TIMEOUT):
+            return BUSY_RETRY_SECONDS
+
+    with _StateLock(url) as locked:
+        if not locked:
+            return BUSY_RETRY_SECONDS
+        bucket = _bucket(url)
+        if now < bucket["blocked_until"]:
+            wait = bucket["blocked_until"] - now
+        else:
+            bucket["tokens"] = min(float(RATE_BURST), bucket["tokens"] + (now - bucket["updated"]) * RATE_PER_SECOND)
+            bucket["updated"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                wait = 0
+            else:
+                wait = (1 - bucket["tokens"]) / RATE_PER_SECOND
+            cache.set(_key(url, "bucket"), bucket, timeout=STATE_TIMEOUT)
+
+    if wait and breaker["state"] == OPEN:
+        # 試行枠を取ったが送らないので他に譲る
+        cache.delete(_key(url, "probe"))
+    return wait
+
+
+def _update_state(url, update):
+    """ロックを取って update() を実行する。取れなければ見送って False を返す"""
+    for _ in range(LOCK_ATTEMPTS):
+        with _StateLock(url) as locked:
+            if locked:
+                update()
+                return True
+    logger.warning("Webhook state update skipped, lock is busy (%s)", _key(url, "lock"))
+    return False
+
+
+def record_success(url):
+    """
+    送信成功: ブレーカーを closed に戻す
+    戻り値: 状態を記録できたか（ロックが取れなければ False）
+    """
+    def close():
+        cache.set(_key(url, "breaker"), {"state": CLOSED, "failures": 0, "opens": 0, "open_until": 0.0}, timeout=STATE_TIMEOUT)
+
+    breaker = _breaker(url)
+    recorded = True
+    if breaker["state"] != CLOSED or breaker["failures"]:
+        recorded = _update_state(url, close)
+    cache.delete(_key(url, "probe"))
+    return recorded
+
+
+def record_failure(url, retry_after=None, trip=True):
+    """
+    送信失敗を記録する
+    - retry_after: 429 等で指定された待ち秒数。その間はこの URL へ送らない
+    - trip: ブレーカーの失敗として数えるか（429 などのレート制限は数えない）
+    戻り値: 状態を記録できたか（ロックが取れなければ False）
+    """
+    now = time.time()
+
+    def update():
+        if retry_after:
+            bucket = _bucket(url)
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after)
+            bucket["tokens"] = 0.0
+            bucket["updated"] = now
+            cache.set(_key(url, "bucket"), bucket, timeout=STATE_TIMEOUT)
+
+        if trip:
+            breaker = _breaker(url)
+            breaker["failures"] += 1
+            # half-open の試行が失敗した場合、または閾値に達した場合は open（待ち時間は開くたびに倍）
+            if breaker["state"] == OPEN or breaker["failures"] >= FAILURE_THRESHOLD:
+                cooldown = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** breaker["opens"])
+                breaker.update(state=OPEN, opens=breaker["opens"] + 1, open_until=now + cooldown)
+            cache.set(_key(url, "breaker"), breaker, timeout=STATE_TIMEOUT)
+
+    recorded = _update_state(url, update)
+    cache.delete(_key(url, "probe"))
+    return recorded
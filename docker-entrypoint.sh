@@ -7,5 +7,20 @@ python manage.py migrate --noinput
 echo "Create superuser if not exists"
 python manage.py create_admin
 
-echo "Start gunicorn"
-exec gunicorn reception_system.wsgi:application --bind 0.0.0.0:$PORT
+# asgi: HTTP と WebSocket（uvicorn ワーカー） / wsgi: HTTP のみ（同期ワーカー）
+export SERVER_MODE="${SERVER_MODE:-asgi}"
+case "$SERVER_MODE" in
+  asgi|wsgi) ;;
+  *) echo "Unknown SERVER_MODE: $SERVER_MODE (asgi or wsgi)" >&2; exit 1 ;;
+esac
+
+# asgi ではエスカレーションと Teams 通知の配信を gunicorn のワーカー内で動かす（api/lifespan.py）
+# wsgi には lifespan が無いため別プロセスで動かす
+if [ "$SERVER_MODE" = "wsgi" ]; then
+  echo "Start notification worker and escalation scheduler"
+  python manage.py send_notifications &
+  python manage.py run_escalations &
+fi
+
+echo "Start gunicorn ($SERVER_MODE)"
+exec gunicorn --config gunicorn.conf.py
@@ -0,0 +1,204 @@
+"""
+受付端末の画面（async 版）
+
+views.py の受付フローと同じ画面・同じ来訪下書きを async def のビューで返す。ASGI サーバー
+（SERVER_MODE=asgi）ではイベントループ上で処理されるため、1つのワーカーで多数の受付端末・
+担当者端末（WebSocket）を同時に扱える。urls.py は KIOSK_ASYNC_VIEWS のときこちらを使う。
+
+- 読み込み・削除は async ORM（afirst / adelete）で行う
+- 来訪の作成・応答待ちの開始・ステータス遷移はトランザクションと保存シグナルが必要なため、
+  views.py の同期処理（finish_visit / start_waiting_visit）を sync_to_async で1回だけ呼ぶ
+  （Django 4.2 には async のトランザクションが無く、acreate / aupdate も1クエリごとに
+  sync_to_async を挟むだけなので、書き込みを分けるとかえってスレッドの往復が増える）
+- 描画は views.py の関数を使い、スレッドで行う（コンテキストプロセッサーが SystemSetting を読むため）
+
+Django 4.2 の async ORM もクエリ自体はスレッドで実行するが、リクエストごとにワーカーの
+スレッドを占有しないため、待機画面・完了画面が集中しても WebSocket の処理が止まらない。
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import render
+
+from api import services
+from api.directory import get_staff_directory
+from api.models import Staff, Visit
+from api.system_settings import get_all_settings
+from . import views
+from .visit_draft import clear_draft, load_draft, update_draft, update_draft_from_query
+
+logger = logging.getLogger(__name__)
+
+
+async def find_staff(staff_id):
+    return await Staff.objects.filter(id=staff_id).afirst() if staff_id else None
+
+
+async def find_visit(visit_id):
+    return await Visit.objects.filter(id=visit_id).afirst() if visit_id else None
+
+
+async def render_async(render_func, *args, **kwargs):
+    return await sync_to_async(render_func)(*args, **kwargs)
+
+
+def get_only(request):
+    """require_http_methods(["GET"]) の代わり（Django 4.2 のデコレーターは async ビューに使えない）"""
+    return None if request.method == "GET" else HttpResponseNotAllowed(["GET"])
+
+
+#  初期画面表示
+async def index(request):
+    # 受付フローの開始：前の来訪者の下書きを残さない
+    clear_draft(request)
+    # 設定はプロセス内キャッシュから読む（再読込が要るときだけクエリを発行する）
+    system_settings = await sync_to_async(get_all_settings)()
+    return await render_async(render, request, "frontend/index.html", {
+        "system_settings": system_settings
+    })
+
+
+# 来訪者情報入力画面・総務/担当者の選択・要件入力（来訪下書きだけを読み書きし、DB を読まない）
+async def visitor_info(request):
+    return await render_async(views.visitor_info, request)
+
+
+async def which(request):
+    return await render_async(views.which, request)
+
+
+async def purpose_input(request):
+    return await render_async(views.purpose_input, request)
+
+
+# 担当者検索画面
+async def render_staff_search(request, template_name, visit_type):
+    try:
+        # キャッシュに無ければ DB から作り直すため同期処理として呼ぶ
+        directory = await sync_to_async(get_staff_directory)()
+    except Exception as e:
+        return await render_async(views.render_staff_search_error, request, template_name, e)
+    return await render_async(views.render_staff_search, request, template_name, visit_type, directory=directory)
+
+
+async def staff_search(request):
+    return await render_staff_search(request, "frontend/screens/staff_search.html", "appointment")
+
+
+async def staff_search2(request):
+    return await render_staff_search(request, "frontend/screens/staff_search2.html", "no-appointment")
+
+
+async def staff_search_department(request, department_id):
+    """担当者検索画面：部署タブ1つ分のHTML断片"""
+    not_allowed = get_only(request)
+    if not_allowed:
+        return not_allowed
+    directory = await sync_to_async(get_staff_directory)()
+    return await render_async(views.render_department_tab, request, directory, department_id)
+
+
+async def staff_search_staff_page(request):
+    """担当者検索画面：名前検索タブの社員リスト1ページ分のHTML断片（?q= で絞り込み）"""
+    not_allowed = get_only(request)
+    if not_allowed:
+        return not_allowed
+    directory = await sync_to_async(get_staff_directory)()
+    return await render_async(views.render_staff_page, request, directory)
+
+
+# 待機画面
+async def waiting(request):
+    draft = update_draft_from_query(request)
+    staff = await find_staff(draft["staff_id"])
+    escalation_seconds = await sync_to_async(views.start_waiting_visit)(request, staff)
+    return await render_async(
+        views.render_waiting, request, "frontend/screens/waiting.html", draft, staff, escalation_seconds
+    )
+
+
+async def waiting2(request):
+    draft = update_draft_from_query(request)
+    visit_type = "no-appointment"
+    update_draft(request, visit_type=visit_type)
+    staff = await find_staff(draft["staff_id"])
+    escalation_seconds = await sync_to_async(views.start_waiting_visit)(request, staff)
+    return await render_async(
+        views.render_waiting, request, "frontend/screens/waiting2.html", draft, staff, escalation_seconds,
+        visit_type=visit_type,
+    )
+
+
+async def cancel_waiting_visit(request, url_name, default_visit_type):
+    """キャンセルされた来訪を削除し、来訪者の情報を付けて担当者検索画面へ戻す"""
+    visit_id = load_draft(request)["visit_id"]
+    if visit_id:
+        await Visit.objects.filter(id=visit_id).adelete()
+    return views.back_to_staff_search(request, url_name, default_visit_type)
+
+
+async def cancel_from_waiting(request):
+    return await cancel_waiting_visit(request, "frontend:staff_search", "appointment")
+
+
+async def cancel_from_waiting2(request):
+    return await cancel_waiting_visit(request, "frontend:staff_search2", "no-appointment")
+
+
+# 受付完了画面
+async def reception_complete(request):
+    draft = update_draft_from_query(request)
+    status_param = request.GET.get("status")
+    staff = await find_staff(draft["staff_id"])
+    visit = await find_visit(draft["visit_id"])
+    status = status_param or ("notified" if visit else "manager")
+    if error := views.invalid_completion_status(status):
+        return error
+    visit = await sync_to_async(views.finish_visit)(
+        request, visit, staff, status, views.completion_fields(draft, staff)
+    )
+
+    # 履歴固定 → 来訪下書きを破棄
+    clear_draft(request)
+    return await render_async(views.render_reception_complete, request, draft, staff, visit)
+
+
+# 通知画面
+async def notification_complete(request):
+    draft = update_draft_from_query(request)
+    status = request.GET.get("status") or "notified"
+    if error := views.invalid_completion_status(status):
+        return error
+    staff = await find_staff(draft["staff_id"])
+    visit = await find_visit(draft["visit_id"])
+    visit = await sync_to_async(views.finish_visit)(
+        request, visit, staff, status, views.completion_fields(draft, staff, replace_staff=False)
+    )
+
+    # 履歴確定 → 来訪下書きを破棄
+    clear_draft(request)
+    return await render_async(views.render_notification_complete, request, draft, staff, visit)
+
+
+# APIエンドポイント：部署階層・スタッフ一覧（views.py と同じJSON）
+async def get_departments(request):
+    not_allowed = get_only(request)
+    if not_allowed:
+        return not_allowed
+    try:
+        return JsonResponse(await sync_to_async(services.get_department_tree)(request=request), safe=False)
+    except Exception as e:
+        logger.exception("get_departments failed")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def get_staff(request):
+    not_allowed = get_only(request)
+    if not_allowed:
+        return not_allowed
+    try:
+        return JsonResponse(await sync_to_async(services.get_staff_list)(request=request), safe=False)
+    except Exception as e:
+        logger.exception("get_staff failed")
+        return JsonResponse({'error': str(e)}, status=500)
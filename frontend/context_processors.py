@@ -1,20 +1,17 @@
-from .models import SystemSetting
+from api.system_settings import get_all_settings, get_seconds
 
 def system_settings_processor(request):
-    system_settings = SystemSetting.objects.first()
+    # 描画のたびに DB を読まないよう、プロセス内キャッシュの全設定（{key: value}）を渡す
+    system_settings = get_all_settings()
     return {
         "system_settings": system_settings,
-        "background_image": system_settings.background_image_url if system_settings else ""
+        "background_image": system_settings.get("background_image_url", "")
     }
 
 def redirect_settings(request):
     # 管理画面で設定した 'redirect_timeout' キーを取得
-    # 文字列を数値に変換（予期せぬ入力への対策としてtry-exceptを入れると安全）
-    try:
-        seconds_str = SystemSetting.get_setting('redirect_timeout', default='120')
-        seconds = int(seconds_str)
-    except (ValueError, TypeError):
-        seconds = 120  # エラー時はデフォルト120秒
+    # 不正な値の場合はデフォルト120秒（設定はプロセス内キャッシュから取得）
+    seconds = get_seconds('redirect_timeout', 120)
 
     return {
         'redirect_timeout_ms': seconds * 1000  # JS用にミリ秒で返す
@@ -1,3 +1,147 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from api import system_settings
+from api.models import Department, Staff, SystemSetting, Visit, VisitStatistic
+from . import async_views
+from .context_processors import system_settings_processor
+from .visit_draft import DRAFT_COOKIE, empty_draft, load_draft, pack
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class KioskDraftTests(TestCase):
+    """受付フローの来訪者情報は来訪下書き（cookie）で運び、URL には載せない"""
+
+    def start(self, company, name, visit_type="no-appointment"):
+        self.client.get(reverse("frontend:index"))
+        self.client.get(reverse("frontend:visitor_info"), {"visit_type": visit_type})
+        return self.client.post(reverse("frontend:visitor_info"), {"company": company, "name": name})
+
+    def assertNoVisitorFields(self, response):
+        for field in ("visitor_name", "visitor_company", "purpose_preset", "purpose_custom"):
+            self.assertNotIn(field, response.get("Location", ""))
+
+    def test_flow_without_visitor_fields_in_urls(self):
+        response = self.start("株式会社テスト", "山田 太郎")
+        self.assertRedirects(response, reverse("frontend:purpose_input"), fetch_redirect_response=False)
+
+        response = self.client.post(reverse("frontend:purpose_input"), {"purpose_custom": "打ち合わせ"})
+        self.assertRedirects(response, reverse("frontend:which"), fetch_redirect_response=False)
+        self.assertNoVisitorFields(response)
+
+        response = self.client.get(reverse("frontend:which"))
+        self.assertContains(response, reverse("frontend:notification_complete"))
+        self.assertNotContains(response, "visitor_name=")
+
+        self.client.get(reverse("frontend:notification_complete"))
+        visit = Visit.objects.get()
+        self.assertEqual(
+            (visit.visitor_company, visit.visitor_name, visit.purpose_custom, visit.status),
+            ("株式会社テスト", "山田 太郎", "打ち合わせ", "notified"),
+        )
+
+    def test_appointment_goes_to_staff_search(self):
+        response = self.start("株式会社テスト", "山田 太郎", visit_type="appointment")
+        self.assertRedirects(response, reverse("frontend:staff_search"), fetch_redirect_response=False)
+
+    def test_next_visitor_starts_with_empty_draft(self):
+        self.start("A社", "来訪者A")
+        self.client.post(reverse("frontend:purpose_input"), {"purpose_custom": "Aの用件"})
+
+        # 次の来訪者は初期画面から始める
+        self.start("B社", "来訪者B")
+        response = self.client.get(reverse("frontend:purpose_input"))
+        self.assertNotContains(response, "Aの用件")
+        self.assertRedirects(
+            self.client.get(reverse("frontend:which")), reverse("frontend:purpose_input"),
+            fetch_redirect_response=False,
+        )
+
+    def test_visitor_fields_in_query_are_ignored(self):
+        self.start("A社", "来訪者A")
+        self.client.get(reverse("frontend:staff_search"), {"visitor_name": "URLの名前"})
+        self.client.get(reverse("frontend:notification_complete"), {"visitor_name": "URLの名前"})
+        self.assertEqual(Visit.objects.get().visitor_name, "来訪者A")
+
+    def test_visit_is_created_only_when_waiting_starts(self):
+        staff = Staff.objects.create(employee_number="E0001", name="担当 太郎", department=Department.objects.create(name="営業部"))
+        self.start("株式会社テスト", "山田 太郎", visit_type="appointment")
+        self.assertEqual(self.client.get(reverse("frontend:staff_search")).status_code, 200)
+        self.assertFalse(Visit.objects.exists())
+
+        # 待機画面で担当者への通知を始めるときに初めて保存し、再表示では作り直さない
+        self.client.get(reverse("frontend:waiting"), {"staff_id": staff.id})
+        self.client.get(reverse("frontend:waiting"), {"staff_id": staff.id})
+        visit = Visit.objects.get()
+        self.assertEqual((visit.status, visit.staff, visit.visitor_name), ("waiting", staff, "山田 太郎"))
+
+        self.client.get(reverse("frontend:cancel_from_waiting"))
+        self.assertFalse(Visit.objects.exists())
+
+    def test_unknown_completion_status_is_rejected(self):
+        self.start("A社", "来訪者A")
+        for name in ("frontend:reception_complete", "frontend:notification_complete"):
+            response = self.client.get(reverse(name), {"status": "bogus"})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Visit.objects.exists())
+        self.assertFalse(VisitStatistic.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AsyncKioskViewTests(TestCase):
+    """async 版の受付ビュー（KIOSK_ASYNC_VIEWS の設定に関係なく直接呼ぶ）"""
+
+    def request(self, path, draft, **query):
+        request = AsyncRequestFactory().get(path, query)
+        request.COOKIES[DRAFT_COOKIE] = pack(draft)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_waiting_creates_visit_and_completion_finishes_it(self):
+        department = await Department.objects.acreate(name="営業部")
+        staff = await Staff.objects.acreate(employee_number="E0001", name="担当 太郎", department=department)
+        draft = {**empty_draft(), "visitor_company": "株式会社テスト", "visitor_name": "山田", "visit_type": "appointment"}
+
+        request = self.request("/waiting/", draft, staff_id=staff.id)
+        response = await async_views.waiting(request)
+        self.assertEqual(response.status_code, 200)
+        visit = await Visit.objects.aget()
+        self.assertEqual((visit.status, visit.staff_id, visit.visitor_name), ("waiting", staff.id, "山田"))
+        self.assertEqual(load_draft(request)["visit_id"], visit.id)
+
+        request = self.request("/reception-complete/", load_draft(request), status="manager")
+        response = await async_views.reception_complete(request)
+        self.assertEqual(response.status_code, 200)
+        await visit.arefresh_from_db()
+        self.assertEqual(visit.status, "manager")
+        self.assertIsNone(load_draft(request)["visit_id"])
+
+    async def test_notification_complete_creates_visit_and_rejects_unknown_status(self):
+        draft = {**empty_draft(), "visitor_company": "株式会社テスト", "visitor_name": "山田"}
+
+        response = await async_views.notification_complete(self.request("/notification-complete/", draft, status="bogus"))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await Visit.objects.aexists())
+
+        response = await async_views.notification_complete(self.request("/notification-complete/", draft))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Visit.objects.values_list("status", flat=True).aget(), "notified")
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SystemSettingsProcessorTests(TestCase):
+    def setUp(self):
+        system_settings._registry.update(values=None)
+        self.addCleanup(system_settings._registry.update, values=None)
+
+    def test_settings_are_read_from_process_cache(self):
+        SystemSetting.objects.create(key="background_image_url", value="/media/bg.png")
+        system_settings_processor(None)
+
+        with self.assertNumQueries(0):
+            context = system_settings_processor(None)
+        self.assertEqual(context["background_image"], "/media/bg.png")
+        self.assertEqual(context["system_settings"]["background_image_url"], "/media/bg.png")
@@ -1,21 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# ASGI サーバーでは受付フローを async 版のビューで処理する
+kiosk = async_views if settings.KIOSK_ASYNC_VIEWS else views
 
 app_name = 'frontend'
 
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('visitor-info/', views.visitor_info, name='visitor_info'),
-    path('staff-search/', views.staff_search, name='staff_search'),
-    path('staff-search2/', views.staff_search2, name='staff_search2'),
-    path('purpose-input/', views.purpose_input, name='purpose_input'),
-    path('waiting/', views.waiting, name='waiting'),
-    path('waiting2/', views.waiting2, name='waiting2'),
-    path('reception-complete/', views.reception_complete, name='reception_complete'),
-    path('notification-complete/', views.notification_complete, name='notification_complete'),
-    path('which/', views.which, name='which'),
-    path('cancel_from_waiting', views.cancel_from_waiting, name='cancel_from_waiting'),
-    path('cancel_from_waiting2', views.cancel_from_waiting2, name='cancel_from_waiting2'),
+    path('', kiosk.index, name='index'),
+    path('visitor-info/', kiosk.visitor_info, name='visitor_info'),
+    path('staff-search/', kiosk.staff_search, name='staff_search'),
+    path('staff-search2/', kiosk.staff_search2, name='staff_search2'),
+    path('staff-search/departments/<int:department_id>/', kiosk.staff_search_department, name='staff_search_department'),
+    path('staff-search/staff/', kiosk.staff_search_staff_page, name='staff_search_staff_page'),
+    path('purpose-input/', kiosk.purpose_input, name='purpose_input'),
+    path('waiting/', kiosk.waiting, name='waiting'),
+    path('waiting2/', kiosk.waiting2, name='waiting2'),
+    path('reception-complete/', kiosk.reception_complete, name='reception_complete'),
+    path('notification-complete/', kiosk.notification_complete, name='notification_complete'),
+    path('which/', kiosk.which, name='which'),
+    path('cancel_from_waiting', kiosk.cancel_from_waiting, name='cancel_from_waiting'),
+    path('cancel_from_waiting2', kiosk.cancel_from_waiting2, name='cancel_from_waiting2'),
 
     # path('notification/', views.notification, name='notification'),
     # path('staff-unavailable/', views.staff_unavailable, name='staff_unavailable'),
@@ -24,8 +30,8 @@ urlpatterns = [
     # path('courier/', views.courier, name='courier'),
 
     # API endpoints
-    path('api/departments/', views.get_departments, name='get_departments'),
-    path('api/staff/', views.get_staff, name='get_staff'),
+    path('api/departments/', kiosk.get_departments, name='get_departments'),
+    path('api/staff/', kiosk.get_staff, name='get_staff'),
     path('api/notify-staff/', views.notify_staff, name='notify_staff'),
 ]
 
@@ -1,21 +1,33 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 import json
-import requests
-from api.models import Department, Staff, SystemSetting, Visit
+import logging
+from api.models import Department, Staff, Visit
+from api.directory import filter_staff_entries, get_staff_directory
+from api.escalation import start_waiting
+from api.system_settings import get_all_settings, get_seconds
+from api.visit_transitions import InvalidTransition, StaleTransition, transition_visit
+from api import services
+from .visit_draft import clear_draft, load_draft, update_draft, update_draft_from_query
 from django.utils import timezone
 from django.shortcuts import redirect
 from django.http import JsonResponse
+from django.db import transaction
 from django.db.models import Q
-from django.urls import reverse
-from urllib.parse import urlencode
 
-API_BASE_URL = 'http://localhost:8000/api'
+logger = logging.getLogger(__name__)
+
+# 担当者検索画面の名前検索タブで1回に描画する社員数
+STAFF_PAGE_SIZE = 50
+
+# 受付完了・通知画面で ?status= に指定できる完了ステータス
+COMPLETION_STATUSES = {"manager", "notified"}
 
 
-def create_visit(visitor_name, visitor_company, staff, purpose_preset=None, purpose_custom=None, purpose_type="", visit_type=""):
+def create_visit(visitor_name, visitor_company, staff, purpose_preset=None, purpose_custom=None, purpose_type="", visit_type="", status="waiting"):
+    """来訪と通知対象スタッフを1つのトランザクションで保存する"""
 
     visitor_name = visitor_name or "なし"
     visitor_company = visitor_company or "なし"
@@ -24,80 +36,85 @@ def create_visit(visitor_name, visitor_company, staff, purpose_preset=None, purp
     purpose_preset = purpose_preset if purpose_preset else ""
     purpose_custom = purpose_custom if purpose_custom else ""
 
-    visit = Visit.objects.create(
-        visitor_name=visitor_name,
-        visitor_company=visitor_company,
+    with transaction.atomic():
+        visit = Visit.objects.create(
+            visitor_name=visitor_name,
+            visitor_company=visitor_company,
+            staff=staff,
+            visit_type=visit_type,
+            purpose_preset=purpose_preset,
+            purpose_custom=purpose_custom,
+            purpose_type=purpose_type,
+            visited_at=timezone.now(),
+            status=status,
+        )
+
+        if staff:
+            visit.notified_staff.add(staff)
+
+    return visit
+
+
+def persist_draft_visit(request, staff, status):
+    """来訪下書きの内容で Visit を作成し、下書きに来訪IDを記録する"""
+    draft = load_draft(request)
+    visit = create_visit(
+        visitor_name=draft["visitor_name"],
+        visitor_company=draft["visitor_company"],
         staff=staff,
-        visit_type=visit_type,
-        purpose_preset=purpose_preset,
-        purpose_custom=purpose_custom,
-        purpose_type=purpose_type,
-        visited_at=timezone.now(),
-        status="waiting", 
+        purpose_preset=draft["purpose_preset"],
+        purpose_custom=draft["purpose_custom"],
+        purpose_type=draft["purpose_type"] or "",
+        visit_type=draft["visit_type"] or "no-appointment",
+        status=status,
     )
+    update_draft(request, visit_id=visit.id)
+    return visit
 
-    if staff:
-        visit.notified_staff.add(staff)
 
-    visit.save()
+def complete_visit(visit, status, **fields):
+    """
+    既存の来訪を受付完了のステータスへ遷移させる（1回の条件付き UPDATE）
+    値が変わらない項目は更新しない。応答・エスカレーションで既に確定していればそのまま返す
+    """
+    current = {name: getattr(visit, name) for name in fields if name != "staff"}
+    current["staff"] = visit.staff_id
+    fields = {
+        name: value for name, value in fields.items()
+        if current[name] != (value.pk if name == "staff" and value else value)
+    }
+    try:
+        transition_visit(visit, status, **fields)
+    except (InvalidTransition, StaleTransition) as e:
+        logger.info("Visit %s not updated: %s", visit.id, e)
+        visit.refresh_from_db()
     return visit
 
 
-
 def record_visit(request, visit_type="other"):
     """
-    来訪履歴を作成または更新する共通関数
-    - 既にセッションに visit_id があれば更新
-    - なければ新規作成
+    来訪下書きを更新する共通関数（DB には書き込まない）
+    Visit は担当者への通知を始める待機画面、または受付完了時に初めて作成する
+    （途中で離れた来訪は下書き cookie の期限切れで消える）
     """
-    visitor_name = request.GET.get("visitor_name") or "なし"
-    visitor_company = request.GET.get("visitor_company") or "なし"
-    staff_id = request.GET.get("staff_id")
-    purpose_preset = request.GET.get("purpose_preset", "")
-    purpose_custom = request.GET.get("purpose_custom", "")
-    purpose_type = request.GET.get("purpose_type", "")
-
-    staff = Staff.objects.filter(id=staff_id).first()
-
-    visit_id = request.session.get("visit_id")
-    visit = None
-
-    if visit_id:
-        # 既存訪問を更新
-        visit = Visit.objects.filter(id=visit_id).first()
-        if visit:
-            # ★ 修正箇所: purpose_preset または purpose_custom に値がある場合のみ更新 ★
-            if purpose_preset or purpose_custom:
-                visit.purpose_preset = purpose_preset
-                visit.purpose_custom = purpose_custom
-                visit.purpose_type = purpose_type
-                visit.save()
-            
-            return visit
-
-    # なければ新規作成
-    visit = create_visit(visitor_name, visitor_company, staff, purpose_preset, purpose_custom, purpose_type, visit_type,)
-    visit.save()
-
-    request.session["visit_id"] = visit.id
-    return visit
+    draft = update_draft_from_query(request)
+    if not draft["visit_id"]:
+        update_draft(request, visit_type=visit_type)
+    return draft
 
 
 def get_all_subdept_ids(department):
     """指定部署とその子部署すべてのIDをリストで返す"""
-    ids = [department.id]
-    for child in department.children.all():
-        ids.extend(get_all_subdept_ids(child))
-    return ids
+    return list(department.get_descendants(include_self=True).values_list("id", flat=True))
 
 def get_department_full_name(dept):
-    """部署のフルパスを取得（例：営業部 営業第二課）"""
-    names = []
-    current = dept
-    while current:
-        names.insert(0, current.name)
-        current = current.parent
-    return "　".join(names)
+    """
+    部署の階層名を取得（例：本部 > 部 > 課）
+    Department.full_name に保存済みの値を使うため追加クエリは発生しない
+    """
+    if not dept:
+        return ""
+    return dept.full_name or dept.name
 
 def get_department_hierarchy():
     departments = Department.objects.filter(department_type="department").order_by("order")
@@ -128,98 +145,67 @@ def get_department_hierarchy():
 
 #  初期画面表示
 def index(request):
-    system_settings = SystemSetting.objects.first()
+    # 受付フローの開始：前の来訪者の下書きを残さない
+    clear_draft(request)
     return render(request, "frontend/index.html", {
-        "system_settings": system_settings
+        "system_settings": get_all_settings()
     })
 
 # 来訪者情報入力画面
 def visitor_info(request):
-    return render(request, 'frontend/screens/visitor_info.html')
+    """
+    GET : 初期画面から来た（?visit_type= がある）ときは新しい来訪下書きを始める
+          戻るボタンで来たときは下書きの来訪者情報を入力欄に戻す
+    POST: 来訪者情報を下書きに保存し、来訪種別に応じた次の画面へ進む
+    """
+    if request.method == "POST":
+        visitor_company = request.POST.get("company", "").strip()
+        visitor_name = request.POST.get("name", "").strip()
+        if not visitor_company or not visitor_name:
+            return render(request, 'frontend/screens/visitor_info.html', {
+                "visitor_company": visitor_company,
+                "visitor_name": visitor_name,
+                "error": "会社名とお名前を入力してください。",
+            })
+        draft = update_draft(request, visitor_company=visitor_company, visitor_name=visitor_name)
+        next_urls = {"appointment": "frontend:staff_search", "no-appointment": "frontend:purpose_input"}
+        return redirect(next_urls.get(draft["visit_type"], "frontend:index"))
+
+    visit_type = request.GET.get("visit_type")
+    if visit_type:
+        clear_draft(request)
+        update_draft(request, visit_type=visit_type)
+    draft = load_draft(request)
+    return render(request, 'frontend/screens/visitor_info.html', {
+        "visitor_company": draft["visitor_company"] or "",
+        "visitor_name": draft["visitor_name"] or "",
+    })
 
 
 # 担当者検索画面
-def staff_search(request):
+def render_staff_search(request, template_name, visit_type, directory=None):
     """
     本部タブ表示＋課ごと社員表示＋名前検索対応
+    staff_search / staff_search2 共通の描画処理（directory: 取得済みの社員名簿スナップショット）
     """
-    record_visit(request, visit_type="appointment") 
-    visitor_name = request.GET.get("visitor_name")
-    visitor_company = request.GET.get("visitor_company")
-    visit_type = "appointment"
-    purpose_preset = request.GET.get("purpose_preset")
-    purpose_custom = request.GET.get("purpose_custom")
+    record_visit(request, visit_type=visit_type)
+    draft = load_draft(request)
+    visitor_name = draft["visitor_name"]
+    visitor_company = draft["visitor_company"]
+    purpose_preset = draft["purpose_preset"]
+    purpose_custom = draft["purpose_custom"]
     try:
-        # 本部取得（部署タブ用）
-        headquarters_list = Department.objects.filter(
-        Q(department_type="headquarters") | Q(department_type="special")
-        ).order_by("order")
-        departments_data = []
-
-        # 本部配下の課を取得する関数
-        def get_sections(dept):
-            return dept.children.filter(department_type="section").order_by("order")
-
-        for hq in headquarters_list:
-            dept_info = {
-                "id": hq.id,
-                "name": hq.name,
-                "full_name": hq.name,
-                "sections": [],
-                "staff_list": [],
-            }
-
-            # 本部直下の社員
-            staff_qs = Staff.objects.filter(department=hq).order_by("name")
-            for staff in staff_qs:
-                dept_info["staff_list"].append({
-                    "id": staff.id,
-                    "name": staff.name,
-                    "name_kana": staff.name_kana,
-                    "position": staff.position,
-                    "photo_url": staff.photo_url,
-                    "department_full_name": get_department_full_name(hq),
-                })
-
-            # 本部配下の課ごと社員
-            sections = get_sections(hq)
-            for section in sections:
-                section_staff_qs = Staff.objects.filter(department=section).order_by("name")
-                section_staff_list = []
-                for staff in section_staff_qs:
-                    section_staff_list.append({
-                        "id": staff.id,
-                        "name": staff.name,
-                        "name_kana": staff.name_kana,
-                        "position": staff.position,
-                        "photo_url": staff.photo_url,
-                        "department_full_name": get_department_full_name(section),
-                    })
-                dept_info["sections"].append({
-                    "id": section.id,
-                    "name": section.name,
-                    "full_name": get_department_full_name(section),
-                    "staff_list": section_staff_list,
-                })
-
-            departments_data.append(dept_info)
-
-        # 名前検索用 全社員リスト
-        all_staff_qs = Staff.objects.filter().order_by("name")
-        staff_list = []
-        for staff in all_staff_qs:
-            staff_list.append({
-                "id": staff.id,
-                "name": staff.name,
-                "name_kana": staff.name_kana,
-                "position": staff.position,
-                "photo_url": staff.photo_url,
-                "department_full_name": get_department_full_name(staff.department) if staff.department else "",
-            })
+        # 部署タブ・課ごとの社員・名前検索用の全社員リスト（キャッシュ済みスナップショット）
+        # 初回表示は先頭の部署タブと社員リスト1ページ目のみ描画し、残りは断片ビューで取得する
+        directory = directory or get_staff_directory()
+        departments_data = directory["departments_data"]
+        staff_list = directory["staff_list"]
 
         context = {
-            "departments_data": departments_data, 
-            "staff_list": staff_list,              
+            "departments_data": departments_data,
+            "first_department": departments_data[0] if departments_data else None,
+            "staff_list": staff_list[:STAFF_PAGE_SIZE],
+            "next_page": 2 if len(staff_list) > STAFF_PAGE_SIZE else None,
             "body_class": "name-search",
             "visitor_name": visitor_name,
             "visitor_company": visitor_company,
@@ -228,438 +214,286 @@ def staff_search(request):
             "visit_type":visit_type,
         }
 
-        return render(request, "frontend/screens/staff_search.html", context)
+        return render(request, template_name, context)
 
     except Exception as e:
-        print(f"Error in staff_search view: {e}")
-        return render(request, "frontend/screens/staff_search.html", {
-            "departments_data": [],
-            "staff_list": [],
-            "error": str(e),
-        })
+        return render_staff_search_error(request, template_name, e)
 
 
-def staff_search2(request):
-    """
-    本部タブ表示＋課ごと社員表示＋名前検索対応
-    """
-    record_visit(request, visit_type="no-appointment") 
-    visitor_name = request.GET.get("visitor_name")
-    visitor_company = request.GET.get("visitor_company")
-    visit_type = "no-appointment"
-    purpose_preset = request.GET.get("purpose_preset")
-    purpose_custom = request.GET.get("purpose_custom")
-    try:
-        # 本部取得（部署タブ用）
-        headquarters_list = Department.objects.filter(
-        Q(department_type="headquarters") | Q(department_type="special")
-        ).order_by("order")
-        departments_data = []
-
-        # 本部配下の課を取得する関数
-        def get_sections(dept):
-            return dept.children.filter(department_type="section").order_by("order")
-
-        for hq in headquarters_list:
-            dept_info = {
-                "id": hq.id,
-                "name": hq.name,
-                "full_name": hq.name,
-                "sections": [],
-                "staff_list": [],
-            }
-
-            # 本部直下の社員
-            staff_qs = Staff.objects.filter(department=hq).order_by("name")
-            for staff in staff_qs:
-                dept_info["staff_list"].append({
-                    "id": staff.id,
-                    "name": staff.name,
-                    "name_kana": staff.name_kana,
-                    "position": staff.position,
-                    "photo_url": staff.photo_url,
-                    "department_full_name": get_department_full_name(hq),
-                })
-
-            # 本部配下の課ごと社員
-            sections = get_sections(hq)
-            for section in sections:
-                section_staff_qs = Staff.objects.filter(department=section).order_by("name")
-                section_staff_list = []
-                for staff in section_staff_qs:
-                    section_staff_list.append({
-                        "id": staff.id,
-                        "name": staff.name,
-                        "name_kana": staff.name_kana,
-                        "position": staff.position,
-                        "photo_url": staff.photo_url,
-                        "department_full_name": get_department_full_name(section),
-                    })
-                dept_info["sections"].append({
-                    "id": section.id,
-                    "name": section.name,
-                    "full_name": get_department_full_name(section),
-                    "staff_list": section_staff_list,
-                })
-
-            departments_data.append(dept_info)
-
-        # 名前検索用 全社員リスト
-        all_staff_qs = Staff.objects.filter().order_by("name")
-        staff_list = []
-        for staff in all_staff_qs:
-            staff_list.append({
-                "id": staff.id,
-                "name": staff.name,
-                "name_kana": staff.name_kana,
-                "position": staff.position,
-                "photo_url": staff.photo_url,
-                "department_full_name": get_department_full_name(staff.department) if staff.department else "",
-            })
+def render_staff_search_error(request, template_name, error):
+    logger.error("Error in staff search view (%s): %s", template_name, error)
+    return render(request, template_name, {
+        "departments_data": [],
+        "staff_list": [],
+        "error": str(error),
+    })
 
-        context = {
-            "departments_data": departments_data, 
-            "staff_list": staff_list,              
-            "body_class": "name-search",
-            "visitor_name": visitor_name,
-            "visitor_company": visitor_company,
-            "purpose_preset": purpose_preset,
-            "purpose_custom": purpose_custom,
-            "visit_type":visit_type,
-        }
 
-        return render(request, "frontend/screens/staff_search2.html", context)
+def staff_search(request):
+    return render_staff_search(request, "frontend/screens/staff_search.html", "appointment")
 
-    except Exception as e:
-        print(f"Error in staff_search2 view: {e}")
-        return render(request, "frontend/screens/staff_search2.html", {
-            "departments_data": [],
-            "staff_list": [],
-            "error": str(e),
-        })
 
-def get_department_full_name(dept):
-    """
-    部署の階層名を取得（例：本部 > 部 > 課）
-    """
-    if not dept:
-        return ""
-    names = []
-    current = dept
-    while current:
-        names.append(current.name)
-        current = current.parent
-    return " > ".join(reversed(names))
+def staff_search2(request):
+    return render_staff_search(request, "frontend/screens/staff_search2.html", "no-appointment")
 
 
+@require_http_methods(["GET"])
+def staff_search_department(request, department_id):
+    """担当者検索画面：部署タブ1つ分のHTML断片"""
+    return render_department_tab(request, get_staff_directory(), department_id)
+
+
+def render_department_tab(request, directory, department_id):
+    departments_data = directory["departments_data"]
+    dept = next((d for d in departments_data if d["id"] == department_id), None)
+    if dept is None:
+        raise Http404("部署が見つかりません")
+    return render(request, "frontend/partials/department_tab.html", {
+        "dept": dept,
+        "visible": True,
+    })
+
 
-def waiting(request):
-    staff_id = request.GET.get("staff_id")
-    staff_name = request.GET.get("staff_name")
-    visitor_company = request.GET.get("visitor_company")
-    visitor_name = request.GET.get("visitor_name")
-    purpose_preset = request.GET.get("purpose_preset", "")
-    purpose_custom = request.GET.get("purpose_custom","")
-    purpose_type = request.GET.get("purpose_type", "")
+@require_http_methods(["GET"])
+def staff_search_staff_page(request):
+    """担当者検索画面：名前検索タブの社員リスト1ページ分のHTML断片（?q= で絞り込み）"""
+    return render_staff_page(request, get_staff_directory())
 
-    # 設定取得
-    escalation_seconds = int(SystemSetting.get_setting("escalation_interval_seconds", 5))
 
-    # スタッフ取得
-    staff = Staff.objects.filter(id=staff_id).first()
+def render_staff_page(request, directory):
+    page = request.GET.get("page", "1")
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    query = request.GET.get("q", "")
 
-    request.session["visit_type"] = "appointment"
+    staff_list = filter_staff_entries(directory["staff_list"], query)
+    start = (page - 1) * STAFF_PAGE_SIZE
+    end = start + STAFF_PAGE_SIZE
 
+    return render(request, "frontend/partials/staff_list_page.html", {
+        "staff_list": staff_list[start:end],
+        "page": page,
+        "next_page": page + 1 if len(staff_list) > end else None,
+    })
 
-    return render(request, "frontend/screens/waiting.html", {
-        "visitor_company": visitor_company,
-        "visitor_name": visitor_name,
+
+def start_waiting_visit(request, staff):
+    """
+    来訪下書きの来訪を応答待ちにして、次のエスカレーションまでの秒数を返す
+    （来訪がまだ無ければ作成する。担当者が不明なら設定値の秒数。待機画面の再表示では期限を延ばさない）
+    """
+    escalation_seconds = get_seconds("escalation_interval_seconds", 5)
+    if staff is None:
+        return escalation_seconds
+    visit_id = load_draft(request)["visit_id"]
+    visit = Visit.objects.filter(id=visit_id).first() if visit_id else None
+
+    with transaction.atomic():
+        if visit is None:
+            # 担当者への通知に来訪IDが要るため、ここで初めて保存する
+            visit = persist_draft_visit(request, staff, "waiting")
+        start_waiting(visit, staff)
+    if visit.escalation_due_at is None:
+        return escalation_seconds
+    return max(0, int((visit.escalation_due_at - timezone.now()).total_seconds()))
+
+
+def render_waiting(request, template_name, draft, staff, escalation_seconds, **extra):
+    """waiting / waiting2 共通の描画処理"""
+    return render(request, template_name, {
+        # 担当者の応答を WebSocket で受け取るための来訪ID（start_waiting_visit で作成済み）
+        "visit_id": draft["visit_id"],
+        "visitor_company": draft["visitor_company"],
+        "visitor_name": draft["visitor_name"],
         "staff_name": staff.name if staff else "不明",
         "staff": staff,
-        "purpose_preset":purpose_preset,
-        "purpose_custom":purpose_custom,
+        "purpose_preset": draft["purpose_preset"] or "",
+        "purpose_custom": draft["purpose_custom"] or "",
         "escalation_seconds": escalation_seconds,
+        **extra,
     })
 
-def waiting(request):
-    staff_id = request.GET.get("staff_id")
-    staff_name = request.GET.get("staff_name")
-    visitor_company = request.GET.get("visitor_company")
-    visitor_name = request.GET.get("visitor_name")
-    purpose_preset = request.GET.get("purpose_preset", "")
-    purpose_custom = request.GET.get("purpose_custom","")
-    purpose_type = request.GET.get("purpose_type", "")
 
-    # 設定取得
-    escalation_seconds = int(SystemSetting.get_setting("escalation_interval_seconds", 5))
+def waiting(request):
+    draft = update_draft_from_query(request)
 
     # スタッフ取得
-    staff = Staff.objects.filter(id=staff_id).first()
+    staff = Staff.objects.filter(id=draft["staff_id"]).first() if draft["staff_id"] else None
 
-    return render(request, "frontend/screens/waiting.html", {
-        "visitor_company": visitor_company,
-        "visitor_name": visitor_name,
-        "staff_name": staff.name if staff else "不明",
-        "staff": staff,
-        "purpose_preset":purpose_preset,
-        "purpose_custom":purpose_custom,
-        "escalation_seconds": escalation_seconds,
-    })
+    # 担当者への通知とエスカレーション期限の設定（以降の段階的対応は run_escalations が行う）
+    escalation_seconds = start_waiting_visit(request, staff)
+
+    return render_waiting(request, "frontend/screens/waiting.html", draft, staff, escalation_seconds)
 
 def cancel_from_waiting(request):
     """
-    waiting2画面からのキャンセル時、セッションに保存された情報をstaff_search2画面へ引き継いでリダイレクトする
+    waiting画面からのキャンセル時、来訪下書きの情報をstaff_search画面へ引き継いでリダイレクトする
     また、キャンセルされた訪問のVisitレコードを削除する。
     """
-    # セッションから情報を取得
-    visit_id = request.session.get("visit_id")
-    visitor_name = request.session.get("visitor_name", "")
-    visitor_company = request.session.get("visitor_company", "")
-    purpose_preset = request.session.get("purpose_preset", "")
-    purpose_custom = request.session.get("purpose_custom", "")
-    visit_type = request.session.get("visit_type", "appointment")
-
-    if visit_id:
-        Visit.objects.filter(id=visit_id).delete()
-    
-    request.session.pop("visit_id", None)
-
-    params = {
-        "visitor_name": visitor_name,
-        "visitor_company": visitor_company,
-        "purpose_preset": purpose_preset,
-        "purpose_custom": purpose_custom,
-        "visit_type": visit_type
-    }
-    
-    from django.urls import reverse
-    from urllib.parse import urlencode
+    return cancel_waiting_visit(request, "frontend:staff_search", "appointment")
+
 
-    base_url = reverse('frontend:staff_search')
-    query_string = urlencode(params)
+def cancel_waiting_visit(request, url_name, default_visit_type):
+    """キャンセルされた来訪を削除し、来訪者の情報を付けて担当者検索画面へ戻す"""
+    draft = load_draft(request)
+    if draft["visit_id"]:
+        Visit.objects.filter(id=draft["visit_id"]).delete()
+    return back_to_staff_search(request, url_name, default_visit_type)
 
-    return redirect(f"{base_url}?{query_string}")
 
+def back_to_staff_search(request, url_name, default_visit_type):
+    """来訪下書きから来訪IDと担当者を外して担当者検索画面へ戻す（来訪者の情報は下書きに残す）"""
+    draft = load_draft(request)
+    update_draft(request, visit_id=None, staff_id=None, visit_type=draft["visit_type"] or default_visit_type)
+    return redirect(url_name)
 
 
 def waiting2(request):
-    staff_id = request.GET.get("staff_id")
-    staff_name = request.GET.get("staff_name")
-    visitor_company = request.GET.get("visitor_company")
-    visitor_name = request.GET.get("visitor_name")
-    purpose_preset = request.GET.get("purpose_preset", "")
-    purpose_custom = request.GET.get("purpose_custom","")
-    purpose_type = request.GET.get("purpose_type", "")
+    draft = update_draft_from_query(request)
     visit_type = "no-appointment"
-
-    # 設定取得
-    escalation_seconds = int(SystemSetting.get_setting("escalation_interval_seconds", 5))
+    update_draft(request, visit_type=visit_type)
 
     # スタッフ取得
-    staff = Staff.objects.filter(id=staff_id).first()
-
-    request.session["visitor_name"] = visitor_name
-    request.session["visitor_company"] = visitor_company
-    request.session["staff_id"] = staff_id
-    request.session["purpose_preset"] = purpose_preset
-    request.session["purpose_custom"] = purpose_custom
-    request.session["visit_type"] = "no_appointment"
-    # record_visit(request, visit_type="no_appointment")
-
+    staff = Staff.objects.filter(id=draft["staff_id"]).first() if draft["staff_id"] else None
 
+    # 担当者への通知とエスカレーション期限の設定（以降の段階的対応は run_escalations が行う）
+    escalation_seconds = start_waiting_visit(request, staff)
 
-    return render(request, "frontend/screens/waiting2.html", {
-        "visitor_company": visitor_company,
-        "visitor_name": visitor_name,
-        "staff_name": staff.name if staff else "不明",
-        "staff": staff,
-        "purpose_preset":purpose_preset,
-        "purpose_custom":purpose_custom,
-        "escalation_seconds": escalation_seconds,
-        "visit_type":visit_type,
-    })
+    return render_waiting(
+        request, "frontend/screens/waiting2.html", draft, staff, escalation_seconds, visit_type=visit_type
+    )
 
 
 def cancel_from_waiting2(request):
     """
-    waiting2画面からのキャンセル時、セッションに保存された情報をstaff_search2画面へ引き継いでリダイレクトする
+    waiting2画面からのキャンセル時、来訪下書きの情報をstaff_search2画面へ引き継いでリダイレクトする
     また、キャンセルされた訪問のVisitレコードを削除する。
     """
-    # セッションから情報を取得
-    visit_id = request.session.get("visit_id")
-    visitor_name = request.session.get("visitor_name", "")
-    visitor_company = request.session.get("visitor_company", "")
-    purpose_preset = request.session.get("purpose_preset", "")
-    purpose_custom = request.session.get("purpose_custom", "")
-    visit_type = request.session.get("visit_type", "no-appointment")
-
-    if visit_id:
-        Visit.objects.filter(id=visit_id).delete()
-    
-    request.session.pop("visit_id", None)
-
-    params = {
-        "visitor_name": visitor_name,
-        "visitor_company": visitor_company,
-        "purpose_preset": purpose_preset,
-        "purpose_custom": purpose_custom,
-        "visit_type": visit_type
-    }
-    
-    # URL名 'frontend:staff_search2' を使用し、クエリパラメータを安全にエンコードして渡す
-    from django.urls import reverse
-    from urllib.parse import urlencode
-
-    base_url = reverse('frontend:staff_search2')
-    query_string = urlencode(params)
-
-    return redirect(f"{base_url}?{query_string}")
-
-
-
-
-
+    return cancel_waiting_visit(request, "frontend:staff_search2", "no-appointment")
 
 
 def which(request):
-    visitor_name = request.GET.get("visitor_name")
-    visitor_company = request.GET.get("visitor_company")
-    staff_id = request.GET.get("staff_id")
-    visit_type = request.GET.get("visit_type")
-    purpose_preset = request.GET.get("purpose_preset") or "--"
-    purpose_custom = request.GET.get("purpose_custom") or "--"
-
-    if not purpose_preset and not purpose_custom:
+    draft = load_draft(request)
+    if not draft["visitor_name"] or not draft["visitor_company"]:
+        return redirect("frontend:visitor_info")
+    if not draft["purpose_preset"] and not draft["purpose_custom"]:
         return redirect("frontend:purpose_input")
 
     return render(request, "frontend/screens/which.html", {
-        "visitor_name": visitor_name,
-        "visitor_company": visitor_company,
-        "staff_id": staff_id,
-        "purpose_preset": purpose_preset,
-        "purpose_custom": purpose_custom,
-        "visit_type":visit_type,
+        "visitor_name": draft["visitor_name"],
+        "visitor_company": draft["visitor_company"],
+        "staff_id": draft["staff_id"],
+        "purpose_preset": draft["purpose_preset"] or "--",
+        "purpose_custom": draft["purpose_custom"] or "--",
+        "visit_type": draft["visit_type"],
     })
 
 
+PURPOSES = [
+    "新規取引のご相談",
+    "既存取引のご相談",
+    "配達・納品の方",
+    "集荷の方",
+    "その他のお問い合わせ",
+]
+
 
 # 要件入力画面
 def purpose_input(request):
-    staff_id = request.GET.get("staff_id")
-    staff_name = request.GET.get("staff_name")
-    visitor_company = request.GET.get("visitor_company")
-    visitor_name = request.GET.get("visitor_name")
-    purpose_preset = request.GET.get("purpose_preset", "")
-    purpose_custom = request.GET.get("purpose_custom","")
-    visit_type = ("no-appointment")
-
-    purposes = [
-        "新規取引のご相談",
-        "既存取引のご相談",
-        "配達・納品の方",
-        "集荷の方",
-        "その他のお問い合わせ",
-    ]
-
+    """
+    GET : 下書きの用件を選択済みにして表示する
+    POST: 用件を下書きに保存し、担当者呼び出し／総務通知の選択画面へ進む
+    """
+    if request.method == "POST":
+        purpose_preset = request.POST.get("purpose_preset", "").strip()
+        purpose_preset = purpose_preset if purpose_preset in PURPOSES else ""
+        purpose_custom = request.POST.get("purpose_custom", "").strip()[:200]
+        if purpose_preset or purpose_custom:
+            update_draft(request, purpose_preset=purpose_preset, purpose_custom=purpose_custom)
+            return redirect("frontend:which")
+
+    draft = load_draft(request)
     return render(request, "frontend/screens/purpose_input.html", {
-        "visitor_company": visitor_company,
-        "visitor_name": visitor_name,
-        "staff_name": staff_name,
-        "purposes": purposes,
-        "staff_id": staff_id,
-        "purpose_preset": purpose_preset,
-        "purpose_custom": purpose_custom,
-        "visit_type":visit_type,
+        "visitor_company": draft["visitor_company"],
+        "visitor_name": draft["visitor_name"],
+        "purposes": PURPOSES,
+        "staff_id": draft["staff_id"],
+        "purpose_preset": draft["purpose_preset"] or "",
+        "purpose_custom": draft["purpose_custom"] or "",
+        "visit_type": "no-appointment",
     })
 
 
 
 # 受付完了画面
-def reception_complete(request):
-    print(">>> reception_complete GET:", request.GET.dict())
-
-    visitor_name = request.GET.get("visitor_name", "")
-    visitor_company = request.GET.get("visitor_company", "")
-    staff_id = request.GET.get("staff_id")
-    purpose_preset = request.GET.get("purpose_preset")
-    purpose_custom = request.GET.get("purpose_custom")
-    status_param = request.GET.get("status")
-
-
-    staff = Staff.objects.filter(id=staff_id).first() if staff_id and staff_id.isdigit() else None
-
-    # 既存 Visit
-    visit_id = request.session.get("visit_id")
-    visit = Visit.objects.filter(id=visit_id).first() if visit_id else None
-
-    url_visit_type = request.GET.get("visit_type")
-
+def completion_fields(draft, staff, replace_staff=True):
+    """
+    受付完了時に既存の来訪へ書き込む項目（下書きに値のあるものだけ）
+    replace_staff=False なら担当者が不明のとき担当者を変えない
+    """
+    fields = {"staff": staff} if staff or replace_staff else {}
+    if draft["visit_type"]:
+        fields["visit_type"] = draft["visit_type"]
+    # 目的情報の更新 (前回修正済みと仮定)
+    if draft["purpose_preset"] is not None:
+        fields["purpose_preset"] = draft["purpose_preset"]
+    if draft["purpose_custom"] is not None:
+        fields["purpose_custom"] = draft["purpose_custom"]
+    return fields
+
+
+def finish_visit(request, visit, staff, status, fields):
+    """
+    来訪下書きの来訪を受付完了のステータスにする
+    来訪がまだ無ければ（待機画面を経由しない受付）下書きから最終ステータスで作成する
+    """
     if visit:
-        visit.status = status_param or "notified"
-        visit.staff = staff
-        
-        if url_visit_type:
-            visit.visit_type = url_visit_type
-            
-        # 目的情報の更新 (前回修正済みと仮定)
-        if purpose_preset is not None:
-            visit.purpose_preset = purpose_preset
-        if purpose_custom is not None:
-            visit.purpose_custom = purpose_custom
-            
-        visit.save()
-
-        print(f"3. Visit updated. New DB visit_type: {visit.visit_type}")
-    # 新規 → create_visit して status 反映
+        before = visit.status
+        complete_visit(visit, status, **fields)
+        logger.debug("Visit %s completed: %s -> %s", visit.id, before, visit.status)
     else:
-        print(f"2. No Visit found. Creating new with visit_type: {visit_type}")
-
-        final_visit_type = url_visit_type if url_visit_type else "no-appointment"
-        
-        visit = create_visit(
-            visitor_name=visitor_name,
-            visitor_company=visitor_company,
-            staff=staff,
-            purpose_preset=purpose_preset,
-            purpose_custom=purpose_custom,
-            purpose_type="",
-            visit_type=final_visit_type,
-        )
+        visit = persist_draft_visit(request, staff, status)
+        logger.debug("Visit %s created: status=%s", visit.id, visit.status)
+    return visit
 
-        visit.status = status_param or "manager"
-        visit.save()
 
-        request.session["visit_id"] = visit.id
-        print(f">>> Visit created: id={visit.id}, status={visit.status}")
+def invalid_completion_status(status):
+    """?status= が完了ステータスでなければ 400 を返す（DBに書き込む前に弾く）"""
+    if status in COMPLETION_STATUSES:
+        return None
+    return HttpResponseBadRequest("Invalid status")
 
-    # 履歴固定 → セッション削除
-    if "visit_id" in request.session:
-        del request.session["visit_id"]
 
+def render_reception_complete(request, draft, staff, visit):
     return render(request, "frontend/screens/reception_complete.html", {
-        "visitor_name": visitor_name,
-        "visitor_company": visitor_company,
+        "visitor_name": draft["visitor_name"] or "",
+        "visitor_company": draft["visitor_company"] or "",
         "staff_name": staff.name if staff else "",
         "staff": staff,
         "visit": visit,
     })
 
 
-# 通知画面
-def notification_complete(request):
-    visitor_name = request.GET.get("visitor_name", "")
-    visitor_company = request.GET.get("visitor_company", "")
-    staff_id = request.GET.get("staff_id")
-    purpose_preset = request.GET.get("purpose_preset")
-    purpose_custom = request.GET.get("purpose_custom")
-    status_param = request.GET.get("status") or "notified"
+def reception_complete(request):
+    draft = update_draft_from_query(request)
+    status_param = request.GET.get("status")
+    staff = Staff.objects.filter(id=draft["staff_id"]).first() if draft["staff_id"] else None
+
+    # 既存 Visit → 完了ステータスへ / 新規 → 来訪下書きから作成
+    visit = Visit.objects.filter(id=draft["visit_id"]).first() if draft["visit_id"] else None
+    status = status_param or ("notified" if visit else "manager")
+    if error := invalid_completion_status(status):
+        return error
+    visit = finish_visit(request, visit, staff, status, completion_fields(draft, staff))
 
-    staff = Staff.objects.filter(id=staff_id).first() if staff_id and staff_id.isdigit() else None
+    # 履歴固定 → 来訪下書きを破棄
+    clear_draft(request)
+    return render_reception_complete(request, draft, staff, visit)
 
-    url_visit_type = request.GET.get("visit_type")
 
+# 通知画面
+def render_notification_complete(request, draft, staff, visit):
     # 遷移元に応じてメッセージを決定
-    if staff_id and staff:
+    if draft["staff_id"] and staff:
         # waiting/waiting2から来た場合（担当者不在）
         message_title = f"{staff.name}は不在のため、総務へ通知しました。"
         message_lead = "担当者が不在のため、総務へ通知いたしました。しばらくお待ちください。"
@@ -668,90 +502,47 @@ def notification_complete(request):
         message_title = "総務へ通知しました"
         message_lead = "総務へ通知いたしました。しばらくお待ちください。"
 
-    # 既存 Visit を取得
-    visit_id = request.session.get("visit_id")
-    visit = Visit.objects.filter(id=visit_id).first() if visit_id else None
-
- 
-    if visit:
-        print(f">>> Visit found: {visit.id} / before status={visit.status}")
-        visit.status = status_param or "manager"
-
-        if staff: # staff が None でない場合のみ更新
-            visit.staff = staff
-        
-        if url_visit_type:
-            visit.visit_type = url_visit_type
-        # リクエストパラメータに目的情報があれば更新する
-        if purpose_preset is not None:
-            visit.purpose_preset = purpose_preset
-        if purpose_custom is not None:
-            visit.purpose_custom = purpose_custom
-            
-        visit.responded_at = timezone.now()
-        visit.save()
-        print(f">>> Visit updated: status={visit.status}")
-
-
-    # --- Visit が無い場合 → 新規作成 ---
-    else:
-        print(">>> No existing visit, creating new Visit")
-
-        final_visit_type = url_visit_type if url_visit_type else "no-appointment"
-
-        visit = create_visit(
-            visitor_name=visitor_name,
-            visitor_company=visitor_company,
-            staff=staff,
-            purpose_preset=purpose_preset,
-            purpose_custom=purpose_custom,
-            purpose_type="",
-            visit_type=final_visit_type,
-        )
-
-        visit.status = status_param
-        visit.save()
-
-        # 新しく作った Visit をセッションに保存
-        request.session["visit_id"] = visit.id
-
-        print(f">>> Visit created: id={visit.id}, status={visit.status}")
-
-    # 履歴確定 → セッション削除
-    if "visit_id" in request.session:
-        del request.session["visit_id"]
-
     return render(request, "frontend/screens/notification_complete.html", {
-        "visitor_name": visitor_name,
-        "visitor_company": visitor_company,
+        "visitor_name": draft["visitor_name"] or "",
+        "visitor_company": draft["visitor_company"] or "",
         "staff": staff,
         "staff_name": staff.name if staff else "",
         "visit": visit,
-        "message_title": message_title, 
-        "message_lead": message_lead,   
+        "message_title": message_title,
+        "message_lead": message_lead,
     })
 
 
+def notification_complete(request):
+    draft = update_draft_from_query(request)
+    status = request.GET.get("status") or "notified"
+    if error := invalid_completion_status(status):
+        return error
+    staff = Staff.objects.filter(id=draft["staff_id"]).first() if draft["staff_id"] else None
+
+    # 既存 Visit → 完了ステータスへ（担当者が不明なら担当者は変えない） / 無ければ新規作成
+    visit = Visit.objects.filter(id=draft["visit_id"]).first() if draft["visit_id"] else None
+    visit = finish_visit(request, visit, staff, status, completion_fields(draft, staff, replace_staff=False))
+
+    # 履歴確定 → 来訪下書きを破棄
+    clear_draft(request)
+    return render_notification_complete(request, draft, staff, visit)
+
+
 
-# APIエンドポイント：部署階層取得
+# APIエンドポイント：部署階層取得（/api/departments/hierarchy/ と同じJSON）
 @require_http_methods(["GET"])
 def get_departments(request):
     try:
-        response = requests.get(f'{API_BASE_URL}/departments/hierarchy/')
-        if response.status_code == 200:
-            return JsonResponse(response.json(), safe=False)
-        return JsonResponse({'error': 'Failed to fetch departments'}, status=500)
+        return JsonResponse(services.get_department_tree(request=request), safe=False)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-# APIエンドポイント：スタッフ一覧取得
+# APIエンドポイント：スタッフ一覧取得（/api/staff/ と同じJSON）
 @require_http_methods(["GET"])
 def get_staff(request):
     try:
-        response = requests.get(f'{API_BASE_URL}/staff/')
-        if response.status_code == 200:
-            return JsonResponse(response.json(), safe=False)
-        return JsonResponse({'error': 'Failed to fetch staff'}, status=500)
+        return JsonResponse(services.get_staff_list(request=request), safe=False)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -0,0 +1,135 @@
+"""
+受付端末の来訪下書き（visitor_info → staff_search → waiting → complete の間の状態）
+
+来訪ID・来訪者・担当者・用件を1つの構造にまとめ、署名付き（改ざん検知）・圧縮した
+cookie に保持する。DB のセッションには書き込まないため、画面遷移ごとにセッション行の
+読み込み・書き換えが発生しない。
+
+- load_draft(request)            : 現在の下書き（cookie が無い・壊れている・版が違うときは空）
+- update_draft(request, **values): 値を更新する（レスポンスで cookie を書き直す）
+- update_draft_from_query(request): クエリ文字列で渡された担当者・来訪種別を下書きへ取り込む
+- clear_draft(request)           : 受付の開始時・完了時に破棄する
+
+来訪者名・会社名・用件は画面のフォーム（POST）からだけ受け取り、URL には載せない。
+
+cookie の書き込みは VisitDraftMiddleware が変更のあったレスポンスにだけ行う。
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+
+DRAFT_COOKIE = getattr(settings, "KIOSK_DRAFT_COOKIE", "kiosk_visit")
+DRAFT_MAX_AGE = getattr(settings, "KIOSK_DRAFT_MAX_AGE", 60 * 60)
+DRAFT_SALT = "frontend.visit_draft"
+# 構造を変えたら上げる（古い版の cookie は読み捨てる）
+DRAFT_VERSION = 1
+
+# 下書きの項目と cookie 上の短いキー
+FIELDS = {
+    "visit_id": "i",
+    "visitor_name": "n",
+    "visitor_company": "c",
+    "staff_id": "s",
+    "purpose_preset": "p",
+    "purpose_custom": "u",
+    "purpose_type": "t",
+    "visit_type": "k",
+}
+# クエリ文字列から取り込む項目（来訪者の情報・来訪IDは受け取らない）
+QUERY_FIELDS = ["staff_id", "visit_type"]
+
+REQUEST_ATTR = "_visit_draft"
+DIRTY_ATTR = "_visit_draft_dirty"
+
+
+def empty_draft():
+    return {field: None for field in FIELDS}
+
+
+def pack(draft):
+    data = {key: draft[field] for field, key in FIELDS.items() if draft.get(field) not in (None, "")}
+    data["v"] = DRAFT_VERSION
+    return signing.dumps(data, salt=DRAFT_SALT, compress=True)
+
+
+def unpack(value):
+    try:
+        data = signing.loads(value, salt=DRAFT_SALT, max_age=DRAFT_MAX_AGE)
+    except signing.BadSignature:
+        return empty_draft()
+    if not isinstance(data, dict) or data.get("v") != DRAFT_VERSION:
+        return empty_draft()
+    return {field: data.get(key) for field, key in FIELDS.items()}
+
+
+def load_draft(request):
+    draft = getattr(request, REQUEST_ATTR, None)
+    if draft is None:
+        value = request.COOKIES.get(DRAFT_COOKIE)
+        draft = unpack(value) if value else empty_draft()
+        setattr(request, REQUEST_ATTR, draft)
+    return draft
+
+
+def update_draft(request, **values):
+    unknown = set(values) - set(FIELDS)
+    if unknown:
+        raise KeyError(f"Unknown draft fields: {', '.join(sorted(unknown))}")
+    draft = load_draft(request)
+    if any(draft[field] != value for field, value in values.items()):
+        draft.update(values)
+        setattr(request, DIRTY_ATTR, True)
+    return draft
+
+
+def update_draft_from_query(request):
+    """クエリ文字列に含まれる項目だけを上書きして下書きを返す"""
+    values = {field: request.GET[field] for field in QUERY_FIELDS if field in request.GET}
+    staff_id = values.get("staff_id")
+    if staff_id is not None:
+        values["staff_id"] = int(staff_id) if staff_id.isdigit() else None
+    return update_draft(request, **values)
+
+
+def clear_draft(request):
+    setattr(request, REQUEST_ATTR, empty_draft())
+    setattr(request, DIRTY_ATTR, True)
+
+
+class VisitDraftMiddleware:
+    """
+    下書きが変更されたレスポンスにだけ cookie を書き込む
+    async のビュー（frontend.async_views）をスレッドへ移さずに通せるよう、同期・非同期の両方に対応する
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.write_cookie(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.write_cookie(request, await self.get_response(request))
+
+    @staticmethod
+    def write_cookie(request, response):
+        if getattr(request, DIRTY_ATTR, False):
+            draft = getattr(request, REQUEST_ATTR)
+            if any(value not in (None, "") for value in draft.values()):
+                response.set_cookie(
+                    DRAFT_COOKIE,
+                    pack(draft),
+                    max_age=DRAFT_MAX_AGE,
+                    httponly=True,
+                    samesite="Lax",
+                    secure=request.is_secure(),
+                )
+            else:
+                response.delete_cookie(DRAFT_COOKIE, samesite="Lax")
+        return response
@@ -0,0 +1,23 @@
+"""
+gunicorn の設定（docker-entrypoint.sh から読み込む）
+
+SERVER_MODE=asgi（既定）: uvicorn ワーカーで reception_system.asgi を動かし、HTTP と WebSocket を
+                          同じプロセスで扱う（lifespan でエスカレーションのスケジューラーも動かす）
+SERVER_MODE=wsgi        : 同期ワーカーで reception_system.wsgi を動かす（WebSocket は使えない）
+"""
+import os
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "asgi")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# HTTP keep-alive の秒数（uvicorn ワーカーでは timeout_keep_alive になる）
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "reception_system.asgi:application"
+    worker_class = "reception_system.uvicorn_worker.ReceptionUvicornWorker"
+else:
+    wsgi_app = "reception_system.wsgi:application"
@@ -1,18 +1,24 @@
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import api.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "reception_system.settings")
 
+# アプリ登録を済ませてからコンシューマー（モデルを読み込む）を import する
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import api.routing  # noqa: E402
+from api.lifespan import Lifespan  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             api.routing.websocket_urlpatterns
         )
     ),
+    # uvicorn ワーカーの起動・終了処理
+    "lifespan": Lifespan(),
 })
-
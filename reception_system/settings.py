@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,6 +79,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # 受付端末の来訪下書き（署名付き cookie。DB のセッションは使わない）
+    'frontend.visit_draft.VisitDraftMiddleware',
 ]
 
 
@@ -109,14 +112,99 @@ TEMPLATES = [
 WSGI_APPLICATION = 'reception_system.wsgi.application'
 ASGI_APPLICATION = 'reception_system.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
-        'CONFIG': {
-            'hosts': [('localhost', 6379)],
+# Cache
+# 社員名簿スナップショット等をワーカー間で共有する。
+# REDIS_URL があれば Redis、無ければ同一ホスト内で共有できるファイルキャッシュを使う。
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
         },
-    },
-}
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'reception_system_cache')),
+        },
+    }
+
+# Channels（WebSocket 通知のワーカー間配信）
+# REDIS_URL があれば Redis、無ければ同一ホストのワーカー間で共有する SQLite ファイル
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'api.channel_layer.SQLiteChannelLayer',
+            'CONFIG': {
+                'path': os.environ.get(
+                    'CHANNEL_LAYER_PATH', os.path.join(tempfile.gettempdir(), 'reception_channels.sqlite3')
+                ),
+            },
+        },
+    }
+# ASGI サーバー（SERVER_MODE=asgi）内でエスカレーションのスケジューラー・Teams 通知の配信を動かす
+# 0 にした場合は `python manage.py run_escalations` / `python manage.py send_notifications` を別に起動する
+ESCALATION_IN_SERVER = os.environ.get('ESCALATION_IN_SERVER', '1') == '1'
+NOTIFICATIONS_IN_SERVER = os.environ.get('NOTIFICATIONS_IN_SERVER', '1') == '1'
+# 上記はワーカーのうち CACHES のリーダー lease を持つ1つだけが動かす（落ちたらこの秒数で他が引き継ぐ）
+BACKGROUND_LEADER_TTL = 15
+# 受付端末の画面を async 版のビュー（frontend.async_views）で処理する（既定は ASGI サーバーのとき）
+KIOSK_ASYNC_VIEWS = os.environ.get('KIOSK_ASYNC_VIEWS', '1' if os.environ.get('SERVER_MODE', 'asgi') == 'asgi' else '0') == '1'
+# WebSocket で ?batch=1 を指定した接続へ更新をまとめて送る間隔（ミリ秒）
+WEBSOCKET_BATCH_INTERVAL_MS = 200
+
+# 担当者検索画面の名簿スナップショットの保持秒数（変更時はシグナルで即時無効化される）
+STAFF_DIRECTORY_CACHE_TIMEOUT = 60 * 60 * 24
+# SystemSetting をプロセス内に保持する秒数（保存時は他のワーカーも次のバージョン確認で読み直す）
+SYSTEM_SETTING_CACHE_TTL = 300
+# 他のワーカーでの保存（共有キャッシュのバージョン）を確認する間隔（秒）
+SYSTEM_SETTING_VERSION_CHECK_SECONDS = 5
+# 社員CSVインポートで1回に読み込み・登録する行数
+STAFF_IMPORT_CHUNK_SIZE = 1000
+# CSVエクスポートでDBから1回に読み出す行数
+CSV_EXPORT_CHUNK_SIZE = 2000
+# api_visit に残す月数（今月を含む）。古い月は python manage.py archive_visits で月別パーティションへ移す
+VISIT_HOT_MONTHS = 3
+VISIT_ARCHIVE_BATCH_SIZE = 1000
+# 受付端末の来訪下書き cookie の有効秒数（受付を始めてから完了までの上限）
+KIOSK_DRAFT_MAX_AGE = 60 * 60
+
+# Teams 通知（ASGI サーバー内の配信タスク、または python manage.py send_notifications で配信）
+TEAMS_NOTIFICATION_TIMEOUT = 5
+# 1回に確保するキューの件数・同時送信数・キューが空のときの待機秒数
+TEAMS_NOTIFICATION_BATCH_SIZE = 50
+TEAMS_NOTIFICATION_CONCURRENCY = 4
+TEAMS_NOTIFICATION_POLL_INTERVAL = 1.0
+TEAMS_NOTIFICATION_MAX_ATTEMPTS = 8
+TEAMS_NOTIFICATION_BACKOFF_BASE = 2
+TEAMS_NOTIFICATION_BACKOFF_MAX = 600
+# 送信先URLごとのサーキットブレーカーと送信レート（状態は CACHES で全ワーカー共有）
+TEAMS_BREAKER_FAILURE_THRESHOLD = 5
+TEAMS_BREAKER_COOLDOWN = 30
+TEAMS_BREAKER_MAX_COOLDOWN = 600
+TEAMS_RATE_PER_SECOND = 1.0
+TEAMS_RATE_BURST = 4
+
+# 応答待ち来訪のエスカレーション（python manage.py run_escalations が期限を監視）
+# 間隔は SystemSetting escalation_interval_seconds、総務の部署は general_affairs_department_id
+ESCALATION_RELOAD_SECONDS = 2
+# 担当者が WebSocket に接続していなければ待たずに次の通知先へ回す
+# 担当者の画面が ws/staff/<id>/ に接続する運用でのみ有効にする（接続しない画面では全員が不在になる）
+ESCALATION_SKIP_OFFLINE_STAFF = os.environ.get('ESCALATION_SKIP_OFFLINE_STAFF', '0') == '1'
+# 担当者の在席（ws/staff/<id>/ の接続）を保持する秒数（接続中はこの 1/3 ごとに更新）
+STAFF_PRESENCE_TTL = 60
+
 
 
 # Database
@@ -0,0 +1,18 @@
+"""
+gunicorn 用の uvicorn ワーカー（gunicorn.conf.py の SERVER_MODE=asgi）
+
+lifespan を必須にし（起動処理に失敗したワーカーは起動しない）、WebSocket の ping 間隔を
+環境変数で変えられるようにする。keep-alive は gunicorn の keepalive 設定がそのまま使われる。
+"""
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class ReceptionUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "lifespan": "on",
+        "ws_ping_interval": float(os.environ.get("WEBSOCKET_PING_INTERVAL", "20")),
+        "ws_ping_timeout": float(os.environ.get("WEBSOCKET_PING_TIMEOUT", "20")),
+    }